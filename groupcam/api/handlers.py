@@ -1,16 +1,27 @@
 import operator
+from time import monotonic
 
-import motor
 import colander
 
 import tornado.web
 import tornado.gen
+import tornado.ioloop
+import tornado.websocket
 
-from groupcam.db import db
+from groupcam.core import get_child_logger
 from groupcam.client import manager
+from groupcam.metrics import registry
+from groupcam.registry import camera_registry
+from groupcam.snapshot import CONTENT_TYPES, get_encoders, get_stream_format
 from groupcam.api.schemas import Camera, Preset
 
 
+logger = get_child_logger('api')
+
+# Width of the WebSocket previews if the viewer asks for none
+DEFAULT_PREVIEW_WIDTH = 320
+
+
 class BaseHandler(tornado.web.RequestHandler):
     schema = None
 
@@ -18,6 +29,7 @@ class BaseHandler(tornado.web.RequestHandler):
         """Runs data validation on POST and PUT.
         """
 
+        self.started = monotonic()
         validated = self.validate_resource(**self.path_kwargs)
         json_required = self.request.method in ('POST', 'PUT')
         if validated and json_required and self.schema is not None:
@@ -49,9 +61,27 @@ class BaseHandler(tornado.web.RequestHandler):
             result = obj
         return result
 
-    @tornado.gen.coroutine
     def get_camera(self, camera_id):
-        camera = yield motor.Op(db.async.cameras.find_one, {'id': camera_id})
+        """@return: Future resolving to the camera document, None if there
+        is no such camera
+        """
+        return camera_registry.get(camera_id)
+
+    @tornado.gen.coroutine
+    def update_presets(self, camera_id, operation, condition=None):
+        """Writes the presets and applies them to the running camera.
+
+        @param operation: MongoDB update operation writing the presets
+        @param condition: query the stored camera has to match
+        @return: updated camera document, None if there is no such camera
+        or it doesn't match the condition
+        """
+
+        camera = yield camera_registry.update(camera_id, operation,
+                                              condition)
+        if camera is not None:
+            manager.update_presets(camera_id, camera['presets'],
+                                   self.started)
         return camera
 
     def _validate_json(self):
@@ -77,19 +107,62 @@ class CamerasHandler(BaseHandler):
     @tornado.web.asynchronous
     @tornado.gen.engine
     def get(self):
-        cursor = db.async.cameras.find(length=255)
-        cameras = yield motor.Op(cursor.to_list)
+        cameras = yield camera_registry.get_all()
         keys = ['id', 'title', 'nickname', 'frame_url']
-        result = dict(cameras=self.filter_keys(cameras, keys), ok=True)
+        cameras = self.filter_keys(cameras, keys)
+        extension = get_stream_format()
+        for camera in cameras:
+            camera['frame_url'] = self.reverse_url('frame', camera['id'],
+                                                   extension)
+        result = dict(cameras=cameras, ok=True)
         self.finish(result)
 
     @tornado.web.asynchronous
     @tornado.gen.engine
     def post(self):
-        yield manager.add(self.clean_data)
+        added = yield manager.add(self.clean_data)
+        if not added:
+            self.set_status(503)
+            self.result = dict(reason="No free video devices", ok=False)
         self.finish(self.result)
 
 
+class CameraHandler(BaseHandler):
+    schema = Camera
+
+    @tornado.web.asynchronous
+    @tornado.gen.engine
+    def get(self, camera_id):
+        camera = yield self.get_camera(camera_id)
+        if camera is None:
+            self.set_status(404)
+            self.finish(dict(reason="Invalid camera", ok=False))
+            return
+        keys = ['id', 'title', 'nickname', 'regexp', 'device', 'presets']
+        self.finish(dict(camera=self.filter_keys(camera, keys), ok=True))
+
+    @tornado.web.asynchronous
+    @tornado.gen.engine
+    def put(self, camera_id):
+        camera = dict(self.clean_data, id=camera_id)
+        updated = yield manager.update(camera, self.started)
+        if updated is None:
+            self.set_status(404)
+            self.finish(dict(reason="Invalid camera", ok=False))
+            return
+        self.finish(self.result)
+
+    @tornado.web.asynchronous
+    @tornado.gen.engine
+    def delete(self, camera_id):
+        removed = yield manager.remove(camera_id)
+        if not removed:
+            self.set_status(404)
+            self.finish(dict(reason="Invalid camera", ok=False))
+            return
+        self.finish(dict(ok=True))
+
+
 class UsersHandler(BaseHandler):
     @tornado.web.asynchronous
     @tornado.gen.engine
@@ -105,6 +178,185 @@ class UsersHandler(BaseHandler):
         self.finish(result)
 
 
+class MetricsHandler(BaseHandler):
+    def get(self):
+        # Everything is formatted here, so nothing is spent on the metrics
+        # between scrapes
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.finish(registry.render())
+
+
+class BaseFrameHandler(BaseHandler):
+    def validate_resource(self, camera_id, extension=None):
+        compositor = manager.src_client.get_compositor(camera_id)
+        # Cameras rendered in separate processes have no frames here
+        self.frame_cache = getattr(compositor, 'frame_cache', None)
+        if self.frame_cache is None:
+            reason = "No frames for the camera"
+        elif extension is not None and extension not in get_encoders():
+            reason = "Unsupported format"
+        else:
+            return True
+        self.set_status(404)
+        self.finish(dict(reason=reason, ok=False))
+        return False
+
+
+class FrameHandler(BaseFrameHandler):
+    @tornado.web.asynchronous
+    @tornado.gen.engine
+    def get(self, camera_id, extension):
+        sequence, encoded = yield self.frame_cache.get(extension)
+        self.set_header('Content-Type', CONTENT_TYPES[extension])
+        self.set_header('Cache-Control', 'no-cache')
+        self.finish(encoded)
+
+
+class LatestFrameMixin:
+    """Pushes a camera's frames to a viewer. One frame at most is being
+    sent at a time, a viewer slower than the camera skips to the latest
+    frame instead of queueing them up.
+    """
+
+    _frame_cache = None
+
+    def start_sending(self, frame_cache, width=None):
+        self._io_loop = tornado.ioloop.IOLoop.current()
+        self._frame_cache = frame_cache
+        self._extension = get_stream_format()
+        self._width = width
+        self._sending = False
+        self._closed = False
+        self._sent = 0
+        frame_cache.add_listener(self._on_frame)
+
+    def stop_sending(self):
+        self._closed = True
+        if self._frame_cache is not None:
+            self._frame_cache.remove_listener(self._on_frame)
+
+    def send_frame(self, encoded, callback):
+        """Sends the encoded frame, calls back once it has been written.
+        """
+        raise NotImplementedError
+
+    def _on_frame(self, sequence):
+        # Called from the rendering thread, or from the one removing or
+        # reconfiguring the camera with None
+        if sequence is None:
+            self._io_loop.add_callback(self._close_stream)
+        else:
+            self._io_loop.add_callback(self._send_latest)
+
+    def _close_stream(self):
+        if not self._closed:
+            self.stop_sending()
+            self.close_viewer()
+
+    def _send_latest(self):
+        if self._sending or self._closed:
+            return
+        if self._frame_cache.sequence == self._sent:
+            return
+        self._sending = True
+        future = self._frame_cache.get(self._extension, self._width)
+        self._io_loop.add_future(future, self._on_encoded)
+
+    def _on_encoded(self, future):
+        if self._closed:
+            return
+        try:
+            sequence, encoded = future.result()
+        except Exception:
+            logger.exception("Failed to encode a frame")
+            self.stop_sending()
+            self.close_viewer()
+            return
+        if self._sent:
+            self._frame_cache.frames_skipped += sequence - self._sent - 1
+        self._sent = sequence
+        self.send_frame(encoded, self._on_sent)
+
+    def _on_sent(self):
+        self._sending = False
+        self._send_latest()
+
+
+class StreamHandler(LatestFrameMixin, BaseFrameHandler):
+    """Motion JPEG stream of a camera.
+    """
+
+    boundary = 'groupcamframe'
+
+    @tornado.web.asynchronous
+    def get(self, camera_id):
+        self.set_header('Content-Type',
+                        'multipart/x-mixed-replace; boundary={}'.format(
+                            self.boundary))
+        self.set_header('Cache-Control', 'no-cache')
+        self.start_sending(self.frame_cache)
+
+    def on_connection_close(self):
+        self.stop_sending()
+
+    def send_frame(self, encoded, callback):
+        self.write('--{}\r\nContent-Type: {}\r\n'
+                   'Content-Length: {}\r\n\r\n'.format(
+                       self.boundary, CONTENT_TYPES[self._extension],
+                       len(encoded)))
+        self.write(encoded)
+        self.write('\r\n')
+        self.flush(callback=callback)
+
+    def close_viewer(self):
+        self.finish()
+
+
+class PreviewHandler(LatestFrameMixin, tornado.websocket.WebSocketHandler):
+    """Live preview of a camera over WebSocket, every message is a
+    downscaled frame in the stream format.
+
+    The preview width is given with the width query argument. The socket
+    is closed right away if there are no frames for the camera or the
+    width is invalid, the handshake can't be answered with an error.
+    """
+
+    def open(self, camera_id):
+        # Tornado 3.2 doesn't decode the arguments of WebSocket handlers
+        camera_id = self.decode_argument(camera_id, name='camera_id')
+        compositor = manager.src_client.get_compositor(camera_id)
+        frame_cache = getattr(compositor, 'frame_cache', None)
+        width = self.get_argument('width', str(DEFAULT_PREVIEW_WIDTH))
+        if frame_cache is None:
+            logger.info("No frames for the camera {}".format(camera_id))
+            self.close()
+        elif not width.isdigit():
+            logger.info("Invalid preview width {}".format(width))
+            self.close()
+        else:
+            self.start_sending(frame_cache,
+                               frame_cache.preview_width(int(width)))
+
+    def on_close(self):
+        self.stop_sending()
+
+    def send_frame(self, encoded, callback):
+        self.write_message(encoded, binary=True)
+        self.flush(callback=callback)
+
+    def flush(self, include_footers=False, callback=None):
+        """Calls back once the messages written so far have been sent.
+        """
+
+        # Not supported by WebSocket handlers, which write every message
+        # right away, so it only waits for the connection to drain
+        if not self.stream.closed():
+            self.stream.write(b'', callback)
+
+    def close_viewer(self):
+        self.close()
+
+
 class PresetsHandler(BaseHandler):
     schema = Preset
 
@@ -122,25 +374,30 @@ class PresetsHandler(BaseHandler):
     @tornado.web.asynchronous
     @tornado.gen.engine
     def post(self, camera_id):
-        upd_args = {'id': camera_id}, {'$push': {'presets': self.clean_data}}
-        yield motor.Op(db.async.cameras.update, *upd_args)
-        camera = yield self.get_camera(camera_id)
-        number = camera['presets'].index(self.clean_data) + 1
-        self.finish(dict(number=number, ok=True))
+        operation = {'$push': {'presets': self.clean_data}}
+        camera = yield self.update_presets(camera_id, operation)
+        if camera is None:
+            self.set_status(404)
+            self.finish(dict(reason="Invalid camera", ok=False))
+            return
+        # The returned document is the one right after the push
+        self.finish(dict(number=len(camera['presets']), ok=True))
 
 
 class BasePresetHandler(BaseHandler):
     @tornado.gen.coroutine
-    def validate_resource(self, camera_id, number):
+    def get_preset_camera(self, camera_id, number):
+        """Responds with 404 if there is no such preset.
+
+        @return: camera document, None if the preset doesn't exist
+        """
+
         camera = yield self.get_camera(camera_id)
-        if len(camera['presets']) >= int(number):
-            validated = True
-        else:
-            validated = False
-            self.set_status(404)
-            result = dict(reason="Invalid preset number", ok=False)
-            self.finish(result)
-        return validated
+        if camera is not None and 0 < int(number) <= len(camera['presets']):
+            return camera
+        self.set_status(404)
+        result = dict(reason="Invalid preset number", ok=False)
+        self.finish(result)
 
 
 class PresetHandler(BasePresetHandler):
@@ -149,34 +406,59 @@ class PresetHandler(BasePresetHandler):
     @tornado.web.asynchronous
     @tornado.gen.engine
     def put(self, camera_id, number):
-        field_name = self._get_indexed_field_name(number)
-        operation = {'$set': {field_name: self.clean_data}}
-        yield motor.Op(db.async.cameras.update, {'id': camera_id}, operation)
+        camera = yield self.get_preset_camera(camera_id, number)
+        if camera is None:
+            return
+        index = int(number) - 1
+        key = 'presets.{}'.format(index)
+        operation = {'$set': {key: self.clean_data}}
+        # Setting a removed element would pad the array with nulls
+        condition = {key: {'$exists': True}}
+        updated = yield self.update_presets(camera_id, operation, condition)
+        if updated is None:
+            self.set_status(404)
+            self.finish(dict(reason="Invalid preset number", ok=False))
+            return
         self.finish(self.result)
 
     @tornado.web.asynchronous
     @tornado.gen.engine
     def delete(self, camera_id, number):
-        field_name = self._get_indexed_field_name(number)
-        unset = {'$unset': {field_name: 1}}
-        pull = {'$pull': {'presets': None}}
-        for operation in [unset, pull]:
-            yield motor.Op(db.async.cameras.update,
-                           {'id': camera_id}, operation)
+        camera = yield self.get_preset_camera(camera_id, number)
+        if camera is None:
+            return
+        presets = list(camera['presets'])
+        del presets[int(number) - 1]
+        # Array elements can't be removed by index in a single operation,
+        # so the array is only replaced if nobody has changed it meanwhile
+        operation = {'$set': {'presets': presets}}
+        condition = {'presets': camera['presets']}
+        updated = yield self.update_presets(camera_id, operation, condition)
+        if updated is None:
+            # The preset numbers may have changed, so it isn't retried
+            self.set_status(409)
+            self.finish(dict(reason="Presets changed, retry", ok=False))
+            return
         self.finish(dict(ok=True))
 
-    def _get_indexed_field_name(self, number):
-        index = int(number) - 1
-        return 'presets.{}'.format(index)
-
 
 class ActivatePresetHandler(BasePresetHandler):
     @tornado.web.asynchronous
     @tornado.gen.engine
     def put(self, camera_id, number):
-        camera = yield self.get_camera(camera_id)
-        presets = [dict(preset, active=(index + 1 == int(number)))
-                   for index, preset in enumerate(camera['presets'])]
-        operation = {'$set': {'presets': presets}}
-        yield motor.Op(db.async.cameras.update, {'id': camera_id}, operation)
+        camera = yield self.get_preset_camera(camera_id, number)
+        if camera is None:
+            return
+        # Only the flags are written, not the whole presets, so they are
+        # only written if no preset has been added or removed meanwhile
+        presets_number = len(camera['presets'])
+        operation = {'$set': {
+            'presets.{}.active'.format(index): index + 1 == int(number)
+            for index in range(presets_number)}}
+        condition = {'presets': {'$size': presets_number}}
+        updated = yield self.update_presets(camera_id, operation, condition)
+        if updated is None:
+            self.set_status(409)
+            self.finish(dict(reason="Presets changed, retry", ok=False))
+            return
         self.finish()
@@ -3,6 +3,7 @@ import tornado.web
 
 from groupcam.core import logger
 from groupcam.conf import config
+from groupcam.registry import camera_registry
 from groupcam.api.urls import urls
 
 
@@ -14,5 +15,6 @@ class Application(tornado.web.Application):
 def run_http_server():
     application = Application()
     application.listen(config['http']['port_base'])
+    camera_registry.start_refreshing(config['http']['registry_refresh'])
     logger.info("Launching HTTP server")
     tornado.ioloop.IOLoop.instance().start()
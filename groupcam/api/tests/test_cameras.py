@@ -29,7 +29,8 @@ class TestCameras(BaseAPITestCase):
         found = db.sync.cameras.find_one(camera)
         assert found is not None
         assert found['device'].startswith('/dev/video')
-        assert threading.active_count() == orig_threads_num + 1
+        # The destination client and the camera's device writer
+        assert threading.active_count() == orig_threads_num + 2
 
         _user_logged_in = (lambda: camera['nickname'] in
                            self._get_server_nicknames())
@@ -46,3 +47,34 @@ class TestCameras(BaseAPITestCase):
         users = manager.src_client.users.values()
         nicknames = [str(user.nickname, 'utf8') for user in users]
         return nicknames
+
+
+class TestCamera(BaseAPITestCase):
+    def setup_method(self, method):
+        self._camera = CameraFactory()
+        db.sync.cameras.insert(self._camera)
+        self._url = self.application.reverse_url('camera',
+                                                 self._camera['id'])
+
+    def test_get_camera(self):
+        resp = self.get(self._url)
+        assert resp.code == 200
+        assert resp.json['camera']['title'] == self._camera['title']
+
+    def test_update_camera(self):
+        camera = dict(self._camera, title="Updated")
+        del camera['_id']
+        resp = self.put(self._url, camera)
+        assert resp.code == 200
+        assert self.get_camera(self._camera['id'])['title'] == "Updated"
+
+    def test_update_invalid_camera(self):
+        camera = dict(CameraFactory(), id='no-existing')
+        url = self.application.reverse_url('camera', 'no-existing')
+        assert self.put(url, camera).code == 404
+
+    def test_delete_camera(self):
+        resp = self.delete(self._url)
+        assert resp.code == 200
+        assert self.get_camera(self._camera['id']) is None
+        assert self.delete(self._url).code == 404
@@ -0,0 +1,29 @@
+from tornado.websocket import websocket_connect
+
+from groupcam.api.tests.base import BaseAPITestCase
+
+
+class TestFrames(BaseAPITestCase):
+    def test_get_frame_no_camera(self):
+        url = self.application.reverse_url('frame', 'no-existing', 'png')
+        resp = self.get(url)
+        assert resp.code == 404
+        assert resp.json['ok'] is False
+
+    def test_get_stream_no_camera(self):
+        url = self.application.reverse_url('stream', 'no-existing')
+        assert self.get(url).code == 404
+
+    def test_get_preview_no_upgrade(self):
+        url = self.application.reverse_url('preview', 'no-existing')
+        assert self.get(url).code == 400
+
+    def test_preview_no_camera(self):
+        url = 'ws://localhost:{}{}'.format(
+            self.get_http_port(),
+            self.application.reverse_url('preview', 'no-existing'))
+        websocket_connect(url, self.io_loop, callback=self.stop)
+        connection = self.wait().result()
+        connection.read_message(callback=self.stop)
+        # Closed without a message
+        assert self.wait().result() is None
@@ -0,0 +1,12 @@
+from groupcam.api.tests.base import BaseAPITestCase
+
+
+class TestMetrics(BaseAPITestCase):
+    def test_get_metrics(self):
+        resp = self.get('/metrics')
+        assert resp.code == 200
+        assert resp.headers['Content-Type'].startswith('text/plain')
+        body = str(resp.body, 'utf8')
+        assert '# TYPE groupcam_frame_fetch_seconds histogram' in body
+        assert '# TYPE groupcam_tt4_messages_received_total counter' in body
+        assert 'groupcam_tt4_messages_received_total{client=' in body
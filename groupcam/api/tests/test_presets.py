@@ -70,6 +70,28 @@ class TestPreset(CreatePresetMixture, BaseAPITestCase):
         camera = self.get_camera(self._camera['id'])
         assert camera['presets'] == self._camera['presets'][1:]
 
+    def test_update_removed_preset(self):
+        url = self.application.reverse_url('presets', self._camera['id'])
+        self.get(url)
+        db.sync.cameras.update({'id': self._camera['id']},
+                               {'$set': {'presets': []}})
+        resp = self.put(self._url, PresetFactory())
+        assert resp.code == 404
+        assert not resp.json['ok']
+        assert self.get_camera(self._camera['id'])['presets'] == []
+
+    def test_delete_changed_presets(self):
+        url = self.application.reverse_url('presets', self._camera['id'])
+        self.get(url)
+        preset = PresetFactory()
+        db.sync.cameras.update({'id': self._camera['id']},
+                               {'$push': {'presets': preset}})
+        assert self.delete(self._url).code == 409
+        camera = self.get_camera(self._camera['id'])
+        assert camera['presets'] == self._camera['presets'] + [preset]
+        # The cached camera has been reloaded
+        assert self.delete(self._url).code == 200
+
     def test_delete_invalid_preset(self):
         preset_url = self._get_invalid_preset_url()
         resp = self.delete(preset_url)
@@ -101,3 +123,18 @@ class TestActivatePreset(CreatePresetMixture, BaseAPITestCase):
         assert camera['presets'][0]['active']
         flags = (preset['active'] for preset in camera['presets'][1:])
         assert not any(flags)
+
+    def test_activate_changed_presets(self):
+        url = self.application.reverse_url('presets', self._camera['id'])
+        self.get(url)
+        preset = dict(PresetFactory(), active=True)
+        db.sync.cameras.update({'id': self._camera['id']},
+                               {'$push': {'presets': preset}})
+        assert self.put(self._url, {}).code == 409
+        camera = self.get_camera(self._camera['id'])
+        assert camera['presets'][-1]['active']
+        # The cached camera has been reloaded
+        assert self.put(self._url, {}).code == 200
+        camera = self.get_camera(self._camera['id'])
+        flags = [preset['active'] for preset in camera['presets']]
+        assert flags == [True] + [False] * (len(flags) - 1)
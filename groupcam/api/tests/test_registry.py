@@ -0,0 +1,71 @@
+import tornado.gen
+
+from groupcam.db import db
+from groupcam.registry import CameraRegistry
+from groupcam.api.tests.base import BaseTestCase
+from groupcam.api.tests.factories import CameraFactory
+
+
+class TestCameraRegistry(BaseTestCase):
+    def setup_method(self, method):
+        self._camera = CameraFactory()
+        db.sync.cameras.insert(self._camera)
+        self._registry = CameraRegistry()
+
+    def test_read_through(self):
+        camera = self._get()
+        assert camera == self._camera
+        db.sync.cameras.remove({'id': self._camera['id']})
+        assert self._get() == self._camera
+
+    def test_write_through(self):
+        operation = {'$set': {'title': "Updated"}}
+        camera = self._update(operation)
+        assert camera['title'] == "Updated"
+        assert self.get_camera(self._camera['id'])['title'] == "Updated"
+        assert self._get()['title'] == "Updated"
+
+    def test_concurrent_updates(self):
+        presets = [{'name': "First"}, {'name': "Second"}]
+
+        @tornado.gen.coroutine
+        def push_both():
+            cameras = yield [
+                self._registry.update(self._camera['id'],
+                                      {'$push': {'presets': preset}})
+                for preset in presets]
+            return cameras
+
+        self._get()
+        cameras = self.io_loop.run_sync(push_both)
+        assert [len(camera['presets']) for camera in cameras] == [
+            len(self._camera['presets']) + 1,
+            len(self._camera['presets']) + 2]
+        assert self._get()['presets'][-2:] == presets
+
+    def test_condition_mismatch(self):
+        self._get()
+        db.sync.cameras.update({'id': self._camera['id']},
+                               {'$set': {'title': "Changed"}})
+        camera = self._update({'$set': {'nickname': "Updated"}},
+                              {'title': self._camera['title']})
+        assert camera is None
+        # Reloaded, so that the caller can retry
+        assert self._get()['title'] == "Changed"
+        assert self._get()['nickname'] == self._camera['nickname']
+
+    def test_refresh(self):
+        self._get()
+        db.sync.cameras.update({'id': self._camera['id']},
+                               {'$set': {'title': "Changed"}})
+        assert self._get()['title'] == self._camera['title']
+        self.io_loop.run_sync(self._registry._refresh)
+        assert self._get()['title'] == "Changed"
+
+    def _update(self, operation, condition=None):
+        return self.io_loop.run_sync(lambda: self._registry.update(
+            self._camera['id'], operation, condition))
+
+    def _get(self):
+        return self.io_loop.run_sync(
+            lambda: self._registry.get(self._camera['id']))
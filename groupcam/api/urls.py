@@ -10,6 +10,16 @@ urls = (
      handlers.PresetHandler, {}, 'preset'),
     (r'/cameras/(?P<camera_id>\S+)/presets/(?P<number>\d+)/activate',
      handlers.ActivatePresetHandler, {}, 'activate_preset'),
+    (r'/cameras/(?P<camera_id>\S+)/frame/(?P<extension>\w+)',
+     handlers.FrameHandler, {}, 'frame'),
+    (r'/cameras/(?P<camera_id>\S+)/stream',
+     handlers.StreamHandler, {}, 'stream'),
+    (r'/cameras/(?P<camera_id>\S+)/preview',
+     handlers.PreviewHandler, {}, 'preview'),
+    (r'/cameras/(?P<camera_id>[^/]+)',
+     handlers.CameraHandler, {}, 'camera'),
     (r'/users',
      handlers.UsersHandler, {}, 'users'),
+    (r'/metrics',
+     handlers.MetricsHandler, {}, 'metrics'),
 )
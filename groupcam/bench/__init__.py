@@ -0,0 +1,2 @@
+"""Offline benchmarks, runnable without TeamTalk and v4l2loopback.
+"""
@@ -0,0 +1,128 @@
+"""Benchmarks camera composition with synthetic users.
+
+Drives real Camera objects writing into a file device, /dev/null by
+default, so neither v4l2loopback nor the TeamTalk library are needed.
+Every user sends a new frame before each composition.
+
+Usage: python -m groupcam.bench.pipeline [--users 1,4,9,16]
+    [--source 320x240] [--output 640x480] [--preset auto]
+    [--scaler cairo] [--frames N] [--device /dev/shm/groupcam-bench]
+"""
+
+import time
+import argparse
+import itertools
+import tracemalloc
+
+from groupcam.conf import config, load_config
+from groupcam.device import FileDevice
+from groupcam.preset import PRESETS, BasePreset
+from groupcam.scaler import SCALERS
+from groupcam.bench.synthetic import SyntheticUser
+
+
+_camera_ids = itertools.count(1)
+
+# Presets with a layout of their own, 5+1 has none yet
+LAYOUT_PRESETS = sorted(
+    name for name, preset_class in PRESETS.items()
+    if (preset_class.calculate_display_rects is not
+        BasePreset.calculate_display_rects))
+
+
+def _size(value):
+    return tuple(int(dimension) for dimension in value.split('x'))
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, int(len(values) * percent / 100.))
+    return values[index]
+
+
+def create_camera(output_size, preset, scaler, device_path):
+    from groupcam.camera import Camera
+
+    width, height = output_size
+    config['camera'].update(width=width, height=height)
+    camera_id = 'bench{}'.format(next(_camera_ids))
+    camera = dict(id=camera_id, title="Benchmark", scaler=scaler,
+                  presets=[dict(type=preset, layout={}, active=True)])
+    return Camera(camera, FileDevice(device_path, width, height))
+
+
+def run(users_number, source_size, output_size, preset, scaler,
+        frames, device_path):
+    """Composites the frames and measures them.
+
+    @return: (frames per second, p50 ms, p99 ms, KB allocated per frame)
+    """
+
+    camera = create_camera(output_size, preset, scaler, device_path)
+    users = [SyntheticUser(*source_size, label='user{}'.format(index))
+             for index in range(users_number)]
+    for user in users:
+        camera.add_user(user)
+
+    def composite():
+        for user in users:
+            camera.update_if_has_user(user.user_id)
+        started = time.perf_counter()
+        while camera.dirty and not camera.render_if_dirty():
+            # The writer thread still holds all the buffers
+            time.sleep(0)
+        return time.perf_counter() - started
+
+    # Warming up the layout, text and scaling caches
+    composite()
+
+    started = time.perf_counter()
+    latencies = [composite() for frame in range(frames)]
+    fps = frames / (time.perf_counter() - started)
+
+    # Tracing slows everything down, so allocations are measured apart
+    tracemalloc.start()
+    allocated = 0
+    for frame in range(min(frames, 20)):
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        composite()
+        allocated += tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    return (fps, _percentile(latencies, 50) * 1000.,
+            _percentile(latencies, 99) * 1000.,
+            allocated / min(frames, 20) / 1024.)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument('--users', default='1,4,9,16',
+                           help="comma separated user counts")
+    argparser.add_argument('--source', type=_size, default='320x240',
+                           help="user frame size")
+    argparser.add_argument('--output', type=_size, default='640x480',
+                           help="camera frame size")
+    argparser.add_argument('--preset', choices=LAYOUT_PRESETS,
+                           default='auto')
+    argparser.add_argument('--scaler', choices=sorted(SCALERS),
+                           default='cairo')
+    argparser.add_argument('--frames', type=int, default=200,
+                           help="composited frames per measurement")
+    argparser.add_argument('--device', default='/dev/null',
+                           help="file to write the frames into")
+    args = argparser.parse_args()
+    load_config()
+
+    print("{:>6} {:>10} {:>10} {:>10} {:>12}".format(
+        "users", "fps", "p50", "p99", "alloc/frame"))
+    for users_number in (int(value) for value in args.users.split(',')):
+        fps, p50, p99, allocated = run(
+            users_number, args.source, args.output, args.preset,
+            args.scaler, args.frames, args.device)
+        print("{:>6} {:>10.1f} {:>8.2f}ms {:>8.2f}ms {:>10.1f}KB".format(
+            users_number, fps, p50, p99, allocated))
+
+
+if __name__ == '__main__':
+    main()
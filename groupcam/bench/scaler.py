@@ -0,0 +1,61 @@
+"""Compares the user frame scaling engines.
+
+Usage: python -m groupcam.bench.scaler [--frames N]
+"""
+
+import time
+import argparse
+
+from groupcam.scaler import SCALERS, scaler_factory
+from groupcam.bench.synthetic import SyntheticUser, create_canvas, grid_rects
+
+
+OUTPUT_SIZES = [(640, 480), (1280, 720)]
+GRID_SIZES = [3, 4]
+
+
+def run(scaler_name, output_size, grid_size, source_size, frames):
+    """Scales grid_size x grid_size users into the output frames times.
+
+    @return: average milliseconds per output frame
+    """
+
+    width, height = output_size
+    data, surface, context = create_canvas(width, height)
+    scaler = scaler_factory(scaler_name, surface, data, context)
+    users = [SyntheticUser(*source_size) for index in range(grid_size ** 2)]
+    tiles = list(zip(users, grid_rects(width, height, grid_size)))
+
+    started = time.perf_counter()
+    for frame in range(frames):
+        for user, display_rect in tiles:
+            scaler.draw(user, display_rect)
+        surface.flush()
+    elapsed = time.perf_counter() - started
+    return elapsed / frames * 1000.
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument('--frames', type=int, default=100,
+                           help="output frames per measurement")
+    argparser.add_argument('--source', default='320x240',
+                           help="user frame size")
+    args = argparser.parse_args()
+    source_size = tuple(int(value) for value in args.source.split('x'))
+
+    print("{:>10} {:>6} ".format("output", "grid") +
+          " ".join("{:>10}".format(name) for name in sorted(SCALERS)))
+    for output_size in OUTPUT_SIZES:
+        for grid_size in GRID_SIZES:
+            timings = [run(name, output_size, grid_size, source_size,
+                           args.frames)
+                       for name in sorted(SCALERS)]
+            print("{:>10} {:>6} ".format("{}x{}".format(*output_size),
+                                         "{0}x{0}".format(grid_size)) +
+                  " ".join("{:>8.2f}ms".format(timing)
+                           for timing in timings))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""Soak test of the whole client pipeline against the stub TT4 library.
+
+Runs ClientManager with the source client and a destination client per
+camera, all talking to groupcam.tt4.stub instead of a TeamTalk server,
+while the cameras write into files, on tmpfs by default. Users are spread
+over the cameras by their nicknames. Throughput, latency and memory use
+are reported periodically.
+
+Usage: python -m groupcam.bench.soak [--users 200] [--cameras 24]
+    [--fps 10] [--session SECONDS] [--duration SECONDS] [--interval 10]
+    [--events threads|loop]
+"""
+
+import os
+import time
+import argparse
+import threading
+
+import tornado.ioloop
+
+from groupcam import metrics
+from groupcam import tt4
+from groupcam.conf import config, load_config
+from groupcam.core import options
+from groupcam.tt4.stub import StubLibrary, Script
+
+
+NICKNAME = 'user{index:04d}'
+
+
+def create_cameras(number, device_dir):
+    """Creates the camera documents, users are assigned to the cameras
+    by the last two digits of their nicknames.
+    """
+
+    cameras = []
+    for index in range(number):
+        suffixes = ['{:02d}'.format(suffix) for suffix in range(100)
+                    if suffix % number == index]
+        cameras.append(dict(
+            id='soak{}'.format(index),
+            title="Soak {}".format(index),
+            nickname="Groupcam {}".format(index),
+            regexp=r'^user\d*({})$'.format('|'.join(suffixes)),
+            device=os.path.join(device_dir, 'video{}'.format(index)),
+            presets=[]))
+    return cameras
+
+
+def get_rss():
+    with open('/proc/self/statm') as statm:
+        pages = int(statm.read().split()[1])
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def sum_counter(metric):
+    return sum(value for suffix, labels, value in metric.samples())
+
+
+def sum_buckets(metric):
+    """@return: {upper bound: cumulative count} of all the children
+    """
+
+    buckets = {}
+    for suffix, labels, value in metric.samples():
+        if suffix == '_bucket':
+            bound = float(dict(labels)['le'])
+            buckets[bound] = buckets.get(bound, 0) + value
+    return buckets
+
+
+def bucket_quantile(buckets, previous, quantile):
+    """@return: upper bound of the bucket holding the quantile of the
+    observations made since the previous buckets
+    """
+
+    window = sorted((bound, count - previous.get(bound, 0))
+                    for bound, count in buckets.items())
+    if not window or not window[-1][1]:
+        return 0.
+    for bound, count in window:
+        if count >= window[-1][1] * quantile:
+            return bound
+
+
+def percentile(values, percent):
+    if not values:
+        return 0.
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100.))]
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument('--users', type=int, default=200,
+                           help="users online at once")
+    argparser.add_argument('--cameras', type=int, default=24,
+                           help="number of cameras, up to 100")
+    argparser.add_argument('--fps', type=float, default=10.,
+                           help="frames per second of every user")
+    argparser.add_argument('--source', default='320x240',
+                           help="user frame size")
+    argparser.add_argument('--join-rate', type=float, default=20.,
+                           help="users logging in per second")
+    argparser.add_argument('--session', type=float,
+                           help="seconds after which users are replaced")
+    argparser.add_argument('--duration', type=float, default=3600.,
+                           help="seconds to run for")
+    argparser.add_argument('--interval', type=float, default=10.,
+                           help="seconds between reports")
+    argparser.add_argument('--device-dir', default='/dev/shm',
+                           help="directory to write camera frames into")
+    argparser.add_argument('--events', choices=['threads', 'loop'],
+                           default='threads',
+                           help="TT4 events handling, see the config")
+    args = argparser.parse_args()
+
+    # Not going through core.initialize, which connects to the database
+    options.debug = False
+    load_config()
+    config['camera']['device_type'] = 'file'
+    config['server']['events'] = args.events
+    if args.events == 'loop':
+        # Handling the messages in place of the HTTP server
+        io_loop = tornado.ioloop.IOLoop.instance()
+        threading.Thread(target=io_loop.start, daemon=True).start()
+    frame_size = tuple(int(value) for value in args.source.split('x'))
+    library = StubLibrary(Script(
+        users=args.users, nickname=NICKNAME, join_rate=args.join_rate,
+        fps=args.fps, frame_size=frame_size, session=args.session))
+    tt4.use_library(library)
+
+    from groupcam.client import manager
+    manager.run_async(create_cameras(args.cameras, args.device_dir))
+
+    print("{:>8} {:>6} {:>9} {:>9} {:>9} {:>9} {:>9} {:>10} {:>9} "
+          "{:>8} {:>7}".format("time", "users", "msgs/s", "fetch/s",
+                               "render/s", "lat p50", "lat p99", "comp p99",
+                               "rss", "growth", "threads"))
+    started = time.monotonic()
+    previous = dict(time=started, messages=0, fetched=0, rendered=0,
+                    buckets={}, rss=get_rss())
+    initial_rss = None
+    while time.monotonic() - started < args.duration:
+        time.sleep(args.interval)
+        now = time.monotonic()
+        elapsed = now - previous['time']
+        stats = library.stats
+        current = dict(
+            time=now,
+            messages=sum_counter(metrics.MESSAGES_RECEIVED),
+            fetched=stats['frames_served'],
+            rendered=sum_counter(metrics.FRAMES_RENDERED),
+            buckets=sum_buckets(metrics.COMPOSITION_TIME),
+            rss=get_rss())
+        if initial_rss is None:
+            # Measured once all the users and cameras have been set up
+            initial_rss = current['rss']
+        latencies = library.take_latencies()
+
+        def rate(key):
+            return (current[key] - previous[key]) / elapsed
+
+        print("{:>7.0f}s {:>6} {:>9.0f} {:>9.1f} {:>9.1f} {:>7.1f}ms "
+              "{:>7.1f}ms {:>8.1f}ms {:>7.0f}MB {:>+6.1f}MB {:>7}".format(
+                  now - started, stats['users'], rate('messages'),
+                  rate('fetched'), rate('rendered'),
+                  percentile(latencies, 50) * 1000.,
+                  percentile(latencies, 99) * 1000.,
+                  bucket_quantile(current['buckets'], previous['buckets'],
+                                  .99) * 1000.,
+                  current['rss'] / 2 ** 20,
+                  (current['rss'] - initial_rss) / 2 ** 20,
+                  threading.active_count()), flush=True)
+        previous = current
+
+    manager.stop()
+    library.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""Synthetic stand-ins for the objects fed into the compositor.
+"""
+
+import itertools
+
+import numpy
+import cairo
+
+
+_user_ids = itertools.count(1)
+
+
+class SyntheticUser:
+    """Mimics groupcam.user.User with a random noise frame.
+    """
+
+    def __init__(self, width, height, label=None):
+        self.user_id = next(_user_ids)
+        self.label = label
+        self.img_width = width
+        self.img_height = height
+        self.updated = None
+        self.data = numpy.random.randint(
+            -2 ** 31, 2 ** 31 - 1, width * height, dtype=numpy.int32)
+        self.surface = cairo.ImageSurface.create_for_data(
+            self.data, cairo.FORMAT_ARGB32, width, height)
+
+
+def create_canvas(width, height):
+    """Creates the camera-like pixel array, surface and context.
+
+    @return: (data, surface, context) tuple
+    """
+
+    data = numpy.zeros(width * height, dtype=numpy.int32)
+    surface = cairo.ImageSurface.create_for_data(
+        data, cairo.FORMAT_ARGB32, width, height, width * 4)
+    return data, surface, cairo.Context(surface)
+
+
+def grid_rects(width, height, size):
+    """Splits the canvas into size x size tiles.
+    """
+
+    tile_width, tile_height = width / size, height / size
+    return [(col * tile_width, row * tile_height, tile_width, tile_height)
+            for row in range(size) for col in range(size)]
@@ -0,0 +1,114 @@
+"""Measures the per-call overhead of the TT4 bindings.
+
+The legacy calls, allocating structs and pointers on every call against
+undeclared signatures, are compared with groupcam.tt4.TT4 running against
+a stub library compiled from tt4stub.c, whose functions return at once.
+
+Usage: python -m groupcam.bench.tt4 [--calls N]
+"""
+
+import os
+import ctypes
+import timeit
+import argparse
+import tempfile
+import subprocess
+
+import numpy
+
+from groupcam.tt4 import TT4, Message, load_library, structs
+
+
+STUB_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'tt4stub.c')
+
+
+def build_stub(directory):
+    """Compiles the stub library.
+
+    @return: path of the shared library
+    """
+
+    path = os.path.join(directory, 'libtt4stub.so')
+    subprocess.check_call(['cc', '-shared', '-fPIC', '-O2',
+                           '-o', path, STUB_SOURCE])
+    return path
+
+
+class LegacyTT4:
+    """The calls as they were made before the signatures were declared.
+    """
+
+    def __init__(self, path):
+        self._library = ctypes.CDLL(path)
+        self._instance = self._library.TT_InitTeamTalkPoll()
+
+    def get_message(self, wait_ms=-1):
+        message = structs.TTMessage()
+        wait_ms_ptr = ctypes.pointer(ctypes.c_int32(wait_ms))
+        ret_code = self._library.TT_GetMessage(
+            self._instance, ctypes.pointer(message), wait_ms_ptr)
+        if ret_code <= 0:
+            result = None
+        else:
+            result = Message(message.code, message.first_param,
+                             message.second_param, 1)
+        return result
+
+    def get_user(self, user_id):
+        user = structs.User()
+        self._library.TT_GetUser(self._instance, user_id, ctypes.pointer(user))
+        return user
+
+    def get_user_video_format(self, user_id):
+        video_format = structs.CaptureFormat()
+        ret_code = self._library.TT_GetUserVideoFrame(
+            self._instance, user_id, None, 0, ctypes.pointer(video_format))
+        return bool(ret_code) and video_format
+
+    def get_user_video_frame(self, user_id, data, bytes_number, video_format):
+        format_ptr = ctypes.pointer(video_format)
+        data_ptr = ctypes.c_void_p(data.ctypes.data)
+        ret_code = self._library.TT_GetUserVideoFrame(
+            self._instance, user_id, data_ptr, bytes_number, format_ptr)
+        return bool(ret_code)
+
+
+def measure(tt4, calls):
+    """@return: {call name: microseconds per call} dict
+    """
+
+    data = numpy.empty(320 * 240, dtype=numpy.int32)
+    data_arg = data if isinstance(tt4, LegacyTT4) else ctypes.c_void_p(
+        data.ctypes.data)
+    video_format = tt4.get_user_video_format(1)
+    benchmarks = [
+        ('get_message', lambda: tt4.get_message(0)),
+        ('get_user', lambda: tt4.get_user(1)),
+        ('get_user_video_format', lambda: tt4.get_user_video_format(1)),
+        ('get_user_video_frame', lambda: tt4.get_user_video_frame(
+            1, data_arg, data.nbytes, video_format)),
+    ]
+    return [(name, min(timeit.repeat(function, number=calls, repeat=5)) /
+             calls * 1e6)
+            for name, function in benchmarks]
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument('--calls', type=int, default=100000,
+                           help="calls per measurement")
+    args = argparser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = build_stub(directory)
+        before = measure(LegacyTT4(path), args.calls)
+        after = measure(TT4({}, load_library(path)), args.calls)
+
+    print("{:>24} {:>10} {:>10}".format("call", "before", "after"))
+    for (name, legacy), (name, current) in zip(before, after):
+        print("{:>24} {:>8.2f}us {:>8.2f}us".format(name, legacy, current))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+/* Stand-in for the TT4 library measuring the cost of the Python side of
+ * the calls: every function returns immediately. */
+
+#include <stdint.h>
+#include <string.h>
+
+#define TT_STRLEN 512
+
+typedef struct {
+    int code;
+    uint32_t first_param;
+    uint32_t second_param;
+} TTMessage;
+
+typedef struct {
+    int32_t width;
+    int32_t height;
+    int32_t fps_numerator;
+    int32_t fps_denominator;
+    int32_t four_cc;
+} CaptureFormat;
+
+typedef struct {
+    int32_t id;
+    char nickname[TT_STRLEN];
+} UserHead;
+
+static int instance;
+
+void *TT_InitTeamTalkPoll(void) { return &instance; }
+int32_t TT_CloseTeamTalk(void *inst) { return 1; }
+uint32_t TT_GetFlags(void *inst) { return 0; }
+int32_t TT_Connect(void *inst, const char *host, int32_t tcp_port,
+                   int32_t udp_port, int32_t local_tcp_port,
+                   int32_t local_udp_port) { return 1; }
+int32_t TT_Disconnect(void *inst) { return 1; }
+int32_t TT_DoLogin(void *inst, const char *nickname,
+                   const char *server_password, const char *user_name,
+                   const char *user_password) { return 1; }
+int32_t TT_DoChangeStatus(void *inst, int32_t mode,
+                          const char *message) { return 1; }
+int32_t TT_GetChannelIDFromPath(void *inst, const char *path) { return 1; }
+int32_t TT_DoJoinChannelByID(void *inst, int32_t channel_id,
+                             const char *password) { return 1; }
+int32_t TT_GetVideoCaptureDevices(void *inst, void *devices,
+                                  int32_t *number) { *number = 0; return 1; }
+int32_t TT_InitVideoCaptureDevice(void *inst, const char *device_id,
+                                  void *format, void *codec) { return 1; }
+int32_t TT_EnableTransmission(void *inst, uint32_t types,
+                              int32_t enable) { return 1; }
+int32_t TT_DoUnsubscribe(void *inst, int32_t user_id,
+                         uint32_t subscriptions) { return 1; }
+
+int32_t TT_GetMessage(void *inst, TTMessage *message, int32_t *wait_ms)
+{
+    message->code = 1;
+    message->first_param = 2;
+    message->second_param = 1;
+    return 1;
+}
+
+int32_t TT_GetUser(void *inst, int32_t user_id, UserHead *user)
+{
+    user->id = user_id;
+    strcpy(user->nickname, "user");
+    return 1;
+}
+
+int32_t TT_GetUserVideoFrame(void *inst, int32_t user_id, void *picture,
+                             int32_t size, CaptureFormat *format)
+{
+    format->width = 320;
+    format->height = 240;
+    return 1;
+}
@@ -1,53 +1,220 @@
-from datetime import datetime
-import re
-import os
-import fcntl
-import ctypes
+import threading
+from time import monotonic
 
-import v4l2
 import cairo
 import numpy
 
+from groupcam import metrics
 from groupcam.conf import config
-from groupcam.core import options, fail_with_error
+from groupcam.core import options
+from groupcam.device import device_factory, output_factory
+from groupcam.expiry import expiry
 from groupcam.preset import preset_factory
+from groupcam.scaler import scaler_factory
+from groupcam.snapshot import FrameCache
+from groupcam.text import TextCache
+
+
+class Canvas:
+    """Pixel buffer a camera composites frames into.
+
+    Every canvas remembers the layout it has been drawn with and the users
+    updated since then, so that it can be brought up to date incrementally.
+    """
+
+    def __init__(self, data, width, height, scaler):
+        self.data = data
+        self.surface = cairo.ImageSurface.create_for_data(
+            data, cairo.FORMAT_ARGB32, width, height, width * 4)
+        self.context = cairo.Context(self.surface)
+        self.scaler = scaler_factory(scaler, self.surface,
+                                     self.data, self.context)
+        self.layout = None
+        self.dirty_users = set()
+        self.full_repaint = True
 
 
 class Camera:
-    def __init__(self, camera):
+    def __init__(self, camera, device=None):
+        """@param camera: camera document
+        @param device: output device, the camera's v4l2 device by default
+        """
+
         self._users = {}
+        # Ids of the users sending frames, expired by the expiry heap
+        self._alive = set()
+        self._alive_users = []
+        # Held while rendering, the users and the dirty state are guarded
+        # by the dirty lock alone, so that the frames keep coming in
+        self._lock = threading.RLock()
+        self._dirty_lock = threading.Lock()
+        self._dirty = False
+        self._closed = False
+        self.frames_rendered = 0
+        self.frames_coalesced = 0
 
         self._camera = camera
-        self._lib = self._get_v4l2_lib()
         self._load_settings()
-        self._init_device()
-        self._init_surface()
+        self._init_metrics()
+        self._init_device(device)
+        self._init_canvases()
+        self._init_base_layer()
+        self.frame_cache = FrameCache(self.width, self.height,
+                                      self._mark_dirty)
         self._set_initial_preset()
 
     def add_user(self, user):
-        self._users[user.user_id] = user
+        with self._dirty_lock:
+            self._users[user.user_id] = user
+            self._update_alive_users()
 
     def remove_user(self, user_id):
-        if user_id in self._users:
+        with self._dirty_lock:
+            if user_id not in self._users:
+                return
             del self._users[user_id]
-            self._update()
+            self._alive.discard(user_id)
+            self._update_alive_users()
+            self._set_dirty(full_repaint=True)
+        expiry.discard((self, user_id))
 
     def update_if_has_user(self, user_id):
-        if user_id in self._users:
-            self._update()
-
-    def activate_preset(self, preset):
-        self._preset = preset_factory(self, preset)
-        self._update()
-
-    def _get_v4l2_lib(self):
-        try:
-            lib = ctypes.cdll.LoadLibrary('libv4l2.so.0')
-        except OSError:
-            fail_with_error("Unable to load libv4l2, is it installed?")
-        return lib
+        if user_id not in self._users:
+            return
+
+        expiry.touch((self, user_id), self._user_timeout, self._expire_user)
+        with self._dirty_lock:
+            if user_id not in self._alive:
+                self._alive.add(user_id)
+                self._update_alive_users()
+            self._set_dirty(user_id)
+
+    def activate_preset(self, preset, requested=None):
+        """Switches to the preset at the next output tick. The layout of
+        the current users is calculated right away, off the render path.
+
+        @param preset: preset document
+        @param requested: monotonic time the switch has been requested
+        at, the switch latency is measured from it
+        """
+
+        compiled = preset_factory(self, preset)
+        compiled.get_user_display_rects(self._alive_users)
+        with self._dirty_lock:
+            self._active_preset = preset
+            self._next_preset = compiled, requested or monotonic()
+        self._mark_dirty(full_repaint=True)
+
+    def update(self, camera, requested=None):
+        """Applies the changed camera document.
+
+        @param camera: camera document with a new title or presets
+        """
+
+        title_changed = camera['title'] != self._camera['title']
+        self._camera = camera
+        # The viewers reconnect to the reconfigured camera
+        self.frame_cache.close_streams()
+        if title_changed:
+            with self._lock:
+                self._init_base_layer()
+            self._mark_dirty(full_repaint=True)
+        self.update_presets(camera['presets'], requested)
+
+    def update_presets(self, presets, requested=None):
+        """Applies the changed presets of the camera, switching to the
+        active one if it has changed.
+
+        @param presets: list of preset documents
+        """
+
+        self._camera = dict(self._camera, presets=presets)
+        preset = self._get_active_preset()
+        if preset != self._active_preset:
+            self.activate_preset(preset, requested)
+
+    def render_if_dirty(self):
+        """Composites and writes out a frame if the camera has changed
+        since the previous call.
+
+        @return: True if a frame has been rendered
+        """
+
+        with self._lock:
+            if not self._dirty or self._closed:
+                return False
+            index = self._output.acquire()
+            if index is None:
+                # All the buffers are busy, the camera stays dirty until
+                # the next tick
+                return False
+
+            self._canvas = canvas = self._canvases[index]
+            with self._dirty_lock:
+                dirty_users, canvas.dirty_users = canvas.dirty_users, set()
+                full_repaint, canvas.full_repaint = canvas.full_repaint, False
+                self._dirty = False
+                switch, self._next_preset = self._next_preset, None
+                if switch is not None:
+                    self._preset, requested = switch
+            started = monotonic()
+            self._update(dirty_users, full_repaint)
+            self._composition_time.observe(monotonic() - started)
+            if self.frame_cache.wanted:
+                self.frame_cache.publish(canvas.data)
+            self._output.submit(index)
+            self.frames_rendered += 1
+            if switch is not None:
+                self._preset_switch_time.observe(monotonic() - requested)
+        return True
+
+    @property
+    def dirty(self):
+        return self._dirty
+
+    @property
+    def geometry(self):
+        return (self.width, self.height, self.title_height, self.padding)
+
+    @property
+    def stats(self):
+        return dict(frames_rendered=self.frames_rendered,
+                    frames_coalesced=self.frames_coalesced,
+                    text_cache=self._text_cache.stats,
+                    output=self._output.stats)
+
+    def _mark_dirty(self, user_id=None, full_repaint=False):
+        with self._dirty_lock:
+            self._set_dirty(user_id, full_repaint)
+
+    def _set_dirty(self, user_id=None, full_repaint=False):
+        # Must be called with the dirty lock held
+        # Frames arriving between two ticks are merged into one render
+        if self._dirty:
+            self.frames_coalesced += 1
+        self._dirty = True
+        for canvas in self._canvases:
+            canvas.full_repaint |= full_repaint
+            if user_id is not None:
+                canvas.dirty_users.add(user_id)
+
+    def _expire_user(self, key):
+        # Called from the expiry thread once the user's frames stop coming
+        user_id = key[1]
+        with self._dirty_lock:
+            if user_id in self._alive:
+                self._alive.discard(user_id)
+                self._update_alive_users()
+                self._set_dirty()
+
+    def _update_alive_users(self):
+        # Must be called with the dirty lock held
+        self._alive_users = [user for user_id, user in self._users.items()
+                             if user_id in self._alive]
+        self._preset.invalidate()
 
     def _load_settings(self):
+        self._user_timeout = config['camera']['user_timeout']
         self._title_padding = config['camera']['title_padding'] / 100.
         self.width = config['camera']['width']
         self.height = config['camera']['height']
@@ -59,58 +226,77 @@ class Camera:
         self.display_height = (self.height
                                - self.title_height
                                - self.padding * 2)
-        self.nick_regexp = re.compile(self._camera['regexp'], re.IGNORECASE)
-
-    def _init_device(self):
-        self._device_fd = None
-        device_name = self._camera['device']
-        device_name_buf = device_name.encode('utf8')
-        self._device_fd = self._lib.v4l2_open(device_name_buf, os.O_RDWR)
-        if self._device_fd == -1:
-            fail_with_error("Unable to open device {}".format(device_name))
-        self._capability = self._get_device_capability()
-        self._set_device_format()
-
-    def _init_surface(self):
-        self._data = numpy.empty(
-            self.width * self.height, dtype=numpy.int32)
-        self._surface = cairo.ImageSurface.create_for_data(
-            self._data, cairo.FORMAT_ARGB32,
-            self.width, self.height, self.width * 4)
-        self._context = cairo.Context(self._surface)
-
-    def _get_device_capability(self):
-        capability = v4l2.v4l2_capability()
-        ret_code = fcntl.ioctl(self._device_fd,
-                               v4l2.VIDIOC_QUERYCAP, capability)
-        if ret_code == -1:
-            fail_with_error("Unable to get device capabilities")
-        return capability
-
-    def _set_device_format(self):
-        fmt = v4l2.v4l2_format()
-        fmt.type = v4l2.V4L2_BUF_TYPE_VIDEO_OUTPUT
-        fmt.fmt.pix.pixelformat = v4l2.V4L2_PIX_FMT_BGR32
-        fmt.fmt.pix.width = self.width
-        fmt.fmt.pix.height = self.height
-        fmt.fmt.pix.field = v4l2.V4L2_FIELD_NONE
-        fmt.fmt.pix.bytesperline = fmt.fmt.pix.width * 4
-        fmt.fmt.pix.sizeimage = fmt.fmt.pix.width * fmt.fmt.pix.height * 4
-        fmt.fmt.pix.colorspace = v4l2.V4L2_COLORSPACE_SRGB
-        ret_code = fcntl.ioctl(self._device_fd, v4l2.VIDIOC_S_FMT, fmt)
-        if ret_code == -1:
-            fail_with_error("Unable to get device capabilities")
-
-    def _update(self):
+
+    def _init_metrics(self):
+        camera_id = self._camera['id']
+        self._layout_time = metrics.LAYOUT_TIME.child(camera_id)
+        self._composition_time = metrics.COMPOSITION_TIME.child(camera_id)
+        self._preset_switch_time = metrics.PRESET_SWITCH_TIME.child(
+            camera_id)
+        self._text_render_time = metrics.TEXT_RENDER_TIME.child(camera_id)
+        self._text_cache = TextCache(
+            self.height, config['camera']['text_cache_size'],
+            self._text_render_time)
+        metrics.TEXT_CACHE_HITS.track([camera_id], self._text_cache, 'hits')
+        metrics.TEXT_CACHE_MISSES.track([camera_id], self._text_cache,
+                                        'misses')
+        metrics.FRAMES_RENDERED.track([camera_id], self, 'frames_rendered')
+        metrics.FRAMES_COALESCED.track([camera_id], self, 'frames_coalesced')
+
+    def _init_device(self, device):
+        if device is None:
+            device = device_factory(config['camera']['device_type'],
+                                    self._camera['device'],
+                                    self.width, self.height)
+        self._output = output_factory(device, config['camera']['output'],
+                                      config['camera']['output_buffers'])
+
+    def _init_canvases(self):
+        scaler = self._camera.get('scaler', config['camera']['scaler'])
+        self._canvases = [Canvas(data, self.width, self.height, scaler)
+                          for data in self._output.buffers]
+
+    def _init_base_layer(self):
+        # The title bar and the background never change between layouts,
+        # so they are drawn once and then copied over on full repaints
+        data = numpy.empty(self.width * self.height, dtype=numpy.int32)
+        self._canvas = Canvas(data, self.width, self.height, 'cairo')
         self._draw_title()
         self._draw_background()
-        self._draw_users() or self._draw_no_users()
-        os.write(self._device_fd, self._data)
+        self._canvas.surface.flush()
+        self._base_data = data
+
+    def _update(self, dirty_users, full_repaint):
+        alive_users = self._alive_users
+        if alive_users:
+            started = monotonic()
+            display_rects = self._preset.get_user_display_rects(alive_users)
+            self._layout_time.observe(monotonic() - started)
+        else:
+            display_rects = []
+
+        layout = [(user.user_id, rect) for user, rect in display_rects]
+        if full_repaint or layout != self._canvas.layout:
+            self._canvas.layout = layout
+            self._draw_base_layer()
+            self._draw_users(display_rects) or self._draw_no_users()
+        else:
+            # Only the tiles of users with new frames have to be redrawn
+            self._draw_users([
+                (user, display_rect) for user, display_rect in display_rects
+                if user.user_id in dirty_users
+            ])
+        self._canvas.surface.flush()
+
+    def _draw_base_layer(self):
+        self._canvas.surface.flush()
+        numpy.copyto(self._canvas.data, self._base_data)
+        self._canvas.surface.mark_dirty()
 
     def _draw_title(self):
-        self._context.set_source_rgb(0, 0, 1.)
-        self._context.rectangle(0, 0, self.width, self.title_height)
-        self._context.fill()
+        self._canvas.context.set_source_rgb(0, 0, 1.)
+        self._canvas.context.rectangle(0, 0, self.width, self.title_height)
+        self._canvas.context.fill()
 
         horizontal_padding = self.width * self._title_padding
         vertical_padding = self.title_height * self._title_padding
@@ -120,10 +306,10 @@ class Camera:
         self._fit_text_to_rect(self._camera['title'], title_rect)
 
     def _draw_background(self):
-        self._context.set_source_rgb(0, 0, 0)
-        self._context.rectangle(0, self.title_height,
-                                self.width, self.height)
-        self._context.fill()
+        self._canvas.context.set_source_rgb(0, 0, 0)
+        self._canvas.context.rectangle(0, self.title_height,
+                                       self.width, self.height)
+        self._canvas.context.fill()
 
     def _draw_no_users(self):
         message = config['camera']['no_users_message']
@@ -131,69 +317,89 @@ class Camera:
                         self.width * 0.8, self.height - self.title_height)
         self._fit_text_to_rect(message, display_rect)
 
-    def _draw_users(self):
-        alive_users = [user for user in self._users.values()
-                       if self._user_is_alive(user)]
-        display_rects = self._preset.get_user_display_rects(alive_users)
+    def _draw_users(self, display_rects):
         for user, display_rect in display_rects:
             self._draw_user(user, display_rect)
-        return bool(alive_users)
+        return bool(display_rects)
 
     def _draw_user(self, user, display_rect):
-        self._context.save()
+        self._canvas.scaler.draw(user, display_rect)
         left, top, width, height = display_rect
-        self._context.translate(left, top)
-        self._context.scale(width / user.img_width,
-                            height / user.img_height)
-        self._context.set_source_surface(user.surface)
-        self._context.paint()
-        self._context.restore()
-
         self._draw_user_label(user, left, top, width, height)
 
     def _draw_user_label(self, user, left, top, width, height):
-        label_rect = (width / 3., 0, width * 2 / 3., height * 0.15)
+        if user.label is None:
+            return
+
+        # The label is kept inside the user's tile, so that the tile can be
+        # recomposed on its own
+        label_rect = (left + width / 3., top, width * 2 / 3., height * 0.15)
         label_left, label_top, label_width, label_height = label_rect
 
-        self._context.set_source_rgb(0, 0, 1.)
-        self._context.rectangle(label_left, 0, label_width, label_height)
-        self._context.fill()
+        self._canvas.context.set_source_rgb(0, 0, 1.)
+        self._canvas.context.rectangle(label_left, label_top,
+                                       label_width, label_height)
+        self._canvas.context.fill()
 
         self._fit_text_to_rect(user.label.upper(), label_rect)
 
-    def _user_is_alive(self, user):
-        if user.updated is None:
-            result = False
-        else:
-            seconds = (datetime.now() - user.updated).seconds
-            result = seconds <= config['camera']['user_timeout']
-        return result
-
     def _fit_text_to_rect(self, text, rect, color=(1., 1., 1.)):
         rect_left, rect_top, rect_width, rect_height = rect
+        text_surface = self._text_cache.get(text, rect_width, rect_height,
+                                            color)
+        self._canvas.context.set_source_surface(text_surface,
+                                                rect_left, rect_top)
+        self._canvas.context.paint()
 
-        self._context.set_font_size(self.height)
-        text_width, text_height = self._context.text_extents(text)[2:4]
-
-        factor = min(rect_width / text_width, rect_height / text_height)
-        font_size = self.height * factor
-        self._context.set_font_size(font_size)
-
-        left = rect_left + rect_width - (rect_width + text_width * factor) / 2
-        top = rect_top + rect_height - (rect_height - text_height * factor) / 2
-
-        self._context.move_to(left, top)
-        self._context.set_source_rgb(*color)
-        self._context.show_text(text)
-
-    def _set_initial_preset(self):
+    def _get_active_preset(self):
         active_presets = [preset for preset in self._camera['presets']
                           if preset['active']]
         if active_presets:
             active_preset = active_presets[0]
         else:
             active_preset = dict(type='auto', layout={})
-        self.activate_preset(active_preset)
+        return active_preset
+
+    def _set_initial_preset(self):
+        self._active_preset = self._get_active_preset()
+        self._preset = preset_factory(self, self._active_preset)
+        self._next_preset = None
+        self._mark_dirty(full_repaint=True)
+
+    def close(self):
+        """Stops rendering and releases the device. The camera must have
+        been removed from the render scheduler.
+        """
+
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            with self._dirty_lock:
+                user_ids = list(self._users)
+                self._users.clear()
+                self._alive.clear()
+                self._alive_users = []
+            for user_id in user_ids:
+                expiry.discard((self, user_id))
+            self._release_canvases()
+            self._output.close()
+        self.frame_cache.close_streams()
+
+        camera_id = self._camera['id']
+        metrics.LAYOUT_TIME.release(self._layout_time, camera_id)
+        metrics.COMPOSITION_TIME.release(self._composition_time, camera_id)
+        metrics.PRESET_SWITCH_TIME.release(self._preset_switch_time,
+                                           camera_id)
+        metrics.TEXT_RENDER_TIME.release(self._text_render_time, camera_id)
+
+    def _release_canvases(self):
+        # The output buffers can only be unmapped once no canvas refers
+        # to them
+        for canvas in self._canvases:
+            canvas.surface.finish()
+        self._canvases = []
+        self._canvas = None
 
     def __del__(self):
-        self._lib.v4l2_close(self._device_fd)
+        self.close()
@@ -1,165 +1,344 @@
-from time import sleep
-
-import re
-
-import glob
-
+import threading
 from threading import Thread
-from multiprocessing.pool import ThreadPool
-
-import motor
+from time import monotonic
 
 import tornado.gen
 
 from groupcam.conf import config
-from groupcam.core import fail_with_error
-from groupcam.db import db
 from groupcam.tt4 import consts
-from groupcam.tt4.client import BaseClient
-from groupcam.camera import Camera
+from groupcam.tt4.client import BaseClient, POLL_WAIT_MS
+from groupcam.tt4.poller import ClientPoller
+from groupcam.compositor import camera_factory
+from groupcam.pool import DevicePool
+from groupcam.registry import camera_registry
+from groupcam.routing import RoutingIndex
 from groupcam.user import User
+from groupcam.scheduler import RenderScheduler
+
+
+# Camera document keys which can be changed at runtime
+UPDATABLE_KEYS = ('title', 'nickname', 'regexp', 'presets')
+
+# Seconds stop waits for every client thread to exit
+STOP_TIMEOUT = 5.
 
 
 class ClientManager:
     def __init__(self):
-        self._run_client = lambda inst: inst.run()
-
-    def run_async(self):
-        cameras = list(db.sync.cameras.find())
+        self._poller = None
+        self._threads = []
+
+    def run_async(self, cameras=None):
+        """Starts the clients in the background, each on its own thread or
+        all on the poller, depending on the events config.
+
+        @param cameras: camera documents, the stored ones by default
+        """
+
+        if cameras is None:
+            cameras = camera_registry.load()
+        if config['server']['events'] == 'loop':
+            self._poller = ClientPoller(config['server']['poller_workers'])
+            self._poller.start()
+        self.device_pool = DevicePool(config['camera']['device_name_format'],
+                                      config['camera']['device_intervals'])
+        self.device_pool.start(camera.get('device') for camera in cameras)
         self.src_client = SourceClient(cameras)
-        self.dest_clients = []
+        self.dest_clients = {}
+
+        self._start_client(self.src_client)
         for camera in cameras:
-            self.dest_clients.append(DestinationClient(camera))
+            self._start_destination(camera)
+
+    def stop(self):
+        """Stops all the clients and waits for their threads to exit.
+        """
 
-        clients = [self.src_client] + self.dest_clients
-        pool = ThreadPool(len(clients))
-        pool.map_async(self._run_client, clients)
+        for client in list(self.dest_clients.values()) + [self.src_client]:
+            client.stop()
+        if self._poller is not None:
+            self._poller.stop(STOP_TIMEOUT)
+        for thread in self._threads:
+            thread.join(STOP_TIMEOUT)
+        self._threads = []
+        self.device_pool.stop()
 
     @tornado.gen.coroutine
     def add(self, camera):
-        camera['device'] = yield self._find_free_device()
-        yield motor.Op(db.async.cameras.insert, camera)
-        client = DestinationClient(camera)
-        self.dest_clients.append(client)
-        thread = Thread(target=self._run_client, args=[client])
-        thread.start()
+        """Stores and starts the camera on a free device.
+
+        @return: True if there has been a free device for the camera
+        """
+
+        camera['device'] = self.device_pool.allocate()
+        if camera['device'] is None:
+            return False
+        try:
+            yield camera_registry.insert(camera)
+        except Exception:
+            self.device_pool.release(camera['device'])
+            raise
+        self.src_client.add_camera(camera)
+        self._start_destination(camera)
+        return True
 
-    def update(self, camera):
-        pass
+    @tornado.gen.coroutine
+    def update(self, camera, requested=None):
+        """Stores and applies the changes to the running camera, the other
+        cameras are not affected.
+
+        @param camera: camera document, only UPDATABLE_KEYS are applied
+        @param requested: monotonic time of the change request
+        @return: updated camera document, None if there is no such camera
+        """
+
+        stored = yield camera_registry.get(camera['id'])
+        if stored is None:
+            return None
+
+        changes = {key: camera[key] for key in UPDATABLE_KEYS
+                   if key in camera and camera[key] != stored.get(key)}
+        if not changes:
+            return stored
+        updated = yield camera_registry.update(camera['id'],
+                                               {'$set': changes})
+        if updated is None:
+            return None
+
+        self.src_client.update_camera(updated, requested)
+        if 'nickname' in changes:
+            # The broadcasting user has to log in again under the new name
+            self._stop_destination(updated['id'])
+            self._start_destination(updated)
+        return updated
 
-    def remove(self, id):
-        pass
+    @tornado.gen.coroutine
+    def remove(self, camera_id):
+        """Stops the camera and releases its device.
+
+        @return: True if the camera has been removed
+        """
+
+        camera = yield camera_registry.get(camera_id)
+        if camera is None:
+            return False
+        yield camera_registry.remove(camera_id)
+        self._stop_destination(camera_id)
+        self.src_client.remove_camera(camera_id)
+        if camera.get('device') is not None:
+            self.device_pool.release(camera['device'])
+        return True
 
     def get_camera(self, camera_id):
-        pass
-
-    def _parse_device_intervals(self):
-        range_from, range_to = self._find_device_ranges()
-        intervals = config['camera']['device_intervals']
-        splitted = map(str.strip, intervals.split(','))
-        splitted_twice = (interval.split('-') for interval in splitted)
-        numbers = set()
-        for interval in splitted_twice:
-            number_from = int(interval[0] or range_from)
-            number_to = int(interval[-1] or range_to) + 1
-            for number in range(number_from, number_to):
-                numbers.add(number)
-        return list(numbers)
-
-    def _find_device_ranges(self):
-        file_mask = (config['camera']['device_name_format']
-                     .replace('{number}', '*'))
-        devices = glob.glob(file_mask)
-        numbers = sorted(self._get_numbers_from_devices(devices))
-        if not numbers:
-            fail_with_error("No video devices found!")
-        return numbers[0], numbers[-1]
-
-    def _get_numbers_from_devices(self, devices):
-        numbers = []
-        for device in devices:
-            found = re.findall(r'\d+', device)
-            if found:
-                numbers.append(int(found[0]))
-        return numbers
+        """@return: Future resolving to the camera document, None if there
+        is no such camera
+        """
+        return camera_registry.get(camera_id)
+
+    def update_presets(self, camera_id, presets, requested=None):
+        """Applies the changed presets to the running camera.
+
+        @param requested: monotonic time of the change request
+        """
+        self.src_client.update_camera_presets(camera_id, presets, requested)
+
+    @property
+    def stats(self):
+        return dict(threads=len(self._threads),
+                    poller=(self._poller.stats
+                            if self._poller is not None else None),
+                    source=self.src_client.stats)
+
+    def _start_client(self, client):
+        if self._poller is not None:
+            self._poller.add(client)
+            return
+
+        # The threads of the removed cameras have exited by now
+        self._threads = [thread for thread in self._threads
+                         if thread.is_alive()]
+        thread = Thread(target=client.run, daemon=True)
+        thread.start()
+        self._threads.append(thread)
 
-    @tornado.gen.coroutine
-    def _find_free_device(self):
-        possible_numbers = set(self._parse_device_intervals())
-        cursor = db.async.cameras.find(fields=['device'])
-        devices = yield motor.Op(cursor.to_list)
-        occupied_numbers = set(self._get_numbers_from_devices(devices))
-        available_numbers = possible_numbers - occupied_numbers
-        if available_numbers:
-            number = min(available_numbers)
-            result = (config['camera']['device_name_format']
-                      .format(number=number))
-        else:
-            result = None
-        raise tornado.gen.Return(result)
+    def _start_destination(self, camera):
+        client = DestinationClient(camera, self.device_pool)
+        self.dest_clients[camera['id']] = client
+        self._start_client(client)
+
+    def _stop_destination(self, camera_id):
+        client = self.dest_clients.pop(camera_id, None)
+        if client is not None:
+            # Disconnected and dropped by the thread polling it
+            client.stop()
 
 
 class SourceClient(BaseClient):
     def __init__(self, cameras):
         super().__init__(config['server']['source'])
         self._users = {}
-        self._cameras = {
-            camera['id']: Camera(camera)
-            for camera in cameras
-        }
+        self._cameras = {}
+        self._routing = RoutingIndex()
+        # Guards the users, the cameras and the routing, which are changed
+        # from the API too; frames are routed without it
+        self._lock = threading.Lock()
+        self._scheduler = RenderScheduler(
+            config['camera']['fps'], config['camera']['compositor_workers'])
+        for camera in cameras:
+            self.add_camera(camera)
+
+    def start(self):
+        self._scheduler.start()
+
+    def stop(self):
+        self._scheduler.stop()
+        super().stop()
+
+    @property
+    def stats(self):
+        return dict(super().stats, scheduler=self._scheduler.stats)
 
     def on_command_user_logged_in(self, message):
         user_id = message.first_param
         profile = self._tt4.get_user(user_id)
         user = User(profile, self._tt4)
-        self._users[user_id] = user
 
         subscription = self._subscription
-        cameras = self._get_user_cameras(profile)
-        if cameras:
-            [camera.add_user(user) for camera in cameras]
-            subscription &= not consts.SUBSCRIBE_VIDEO
+        with self._lock:
+            self._users[user_id] = user
+            if profile.id == self._user_id:
+                cameras = ()
+            else:
+                nickname = str(profile.nickname, 'utf8')
+                cameras = self._routing.add_user(user_id, nickname)
+            if cameras:
+                [camera.add_user(user) for camera in cameras]
+                subscription &= not consts.SUBSCRIBE_VIDEO
 
         self._tt4.unsubscribe(user_id, subscription)
 
+    def on_command_user_logged_out(self, message):
+        user_id = message.first_param
+        with self._lock:
+            for camera in self._routing.get_cameras(user_id):
+                camera.remove_user(user_id)
+            self._routing.remove_user(user_id)
+            self._users.pop(user_id, None)
+
     def on_user_video_frame(self, message):
-        user = self._users[message.first_param]
-        user.update(message.second_param)
-        assert user.img_width > 0
-        assert user.img_height > 0
-        for camera in self._cameras.values():
-            camera.update_if_has_user(user.user_id)
+        user = self._users.get(message.first_param)
+        if user is None:
+            # Logged out while the frame was waiting in the queue
+            return
+        if user.update(message.second_param, message.count):
+            assert user.img_width > 0
+            assert user.img_height > 0
+            for camera in self._routing.get_cameras(user.user_id):
+                camera.update_if_has_user(user.user_id)
+
+    def on_command_user_joined(self, message):
+        super().on_command_user_joined(message)
+        user_id = message.first_param
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is not None:
+                for camera in self._routing.get_cameras(user_id):
+                    camera.add_user(user)
 
     def on_command_user_left(self, message):
-        # TODO: immidiately hide user on leaving the channel
-        # user = self._users[message.first_param]
-        # user.hide()
-        pass
-
-    def _get_user_cameras(self, profile):
-        if profile.id == self._user_id:
-            cameras = []
-        else:
-            nickname = str(profile.nickname, 'utf8')
-            cameras = [
-                camera for camera in self._cameras.values()
-                if camera.nick_regexp.match(nickname)
-            ]
-        return cameras
+        # The user is hidden right away, but stays routed in case they
+        # join again
+        user_id = message.first_param
+        self.users.pop(user_id, None)
+        with self._lock:
+            for camera in self._routing.get_cameras(user_id):
+                camera.remove_user(user_id)
+
+    def add_camera(self, camera):
+        """Starts compositing the camera, may be called from any thread.
+
+        @param camera: camera document
+        @return: the camera compositor
+        """
+
+        # Opening the device takes a while, the routing isn't locked
+        compositor = camera_factory(camera)
+        with self._lock:
+            self._cameras[camera['id']] = compositor
+            user_ids = self._routing.add_camera(camera['id'], compositor,
+                                                camera['regexp'])
+            for user_id in user_ids:
+                compositor.add_user(self._users[user_id])
+        self._scheduler.add(compositor)
+        return compositor
+
+    def update_camera(self, camera, requested=None):
+        """Applies the changed camera document to its compositor and
+        reroutes the users if the regexp has changed.
+        """
+
+        with self._lock:
+            compositor = self._cameras.get(camera['id'])
+            if compositor is None:
+                return
+            added, removed = self._routing.update_camera(camera['id'],
+                                                         camera['regexp'])
+            for user_id in added:
+                compositor.add_user(self._users[user_id])
+            for user_id in removed:
+                compositor.remove_user(user_id)
+        compositor.update(camera, requested)
+
+    def update_camera_presets(self, camera_id, presets, requested=None):
+        compositor = self._cameras.get(camera_id)
+        if compositor is not None:
+            compositor.update_presets(presets, requested)
+
+    def remove_camera(self, camera_id):
+        """Stops compositing the camera and releases its device.
+        """
+
+        with self._lock:
+            compositor = self._cameras.pop(camera_id, None)
+            if compositor is None:
+                return
+            self._routing.remove_camera(camera_id)
+        self._scheduler.remove(compositor)
+        compositor.close()
+
+    def get_compositor(self, camera_id):
+        """@return: the compositor rendering the camera, None if there is
+        no such camera
+        """
+        return self._cameras.get(camera_id)
 
 
 class DestinationClient(BaseClient):
-    def __init__(self, camera):
+    def __init__(self, camera, device_pool):
         server_config = dict(config['server']['destination'],
                              nickname=camera['nickname'])
         super().__init__(server_config)
         self._device = camera['device']
+        self._device_pool = device_pool
+        self._device_ready = False
+        self._device_deadline = monotonic() + config['camera']['device_wait']
 
     def run(self):
-        # TODO: connect on device has been created instead of the timeout
-        # sleep(5.)
+        while not self._stopped and not self.is_ready():
+            self._device_pool.wait_ready(self._device, POLL_WAIT_MS / 1000.)
         super().run()
 
+    def is_ready(self):
+        # The broadcast can only be started on an existing device
+        if not self._device_ready:
+            if self._device_pool.is_ready(self._device):
+                self._device_ready = True
+            elif monotonic() >= self._device_deadline:
+                self._logger.error("Device {} is not ready after {}s".format(
+                    self._device, config['camera']['device_wait']))
+                self._device_ready = True
+        return self._device_ready
+
     def on_complete_join_channel(self):
         self._tt4.start_broadcast(self._device)
         self._status_mode |= consts.STATUS_VIDEOTX
@@ -0,0 +1,247 @@
+"""Compositing cameras in separate processes.
+
+User frames live in shared memory written by the source process, every
+compositor process maps them and renders its camera on its own render
+scheduler, so the aggregate throughput scales with the number of cores.
+"""
+
+import threading
+import multiprocessing
+
+import numpy
+import cairo
+
+from groupcam.camera import Camera
+from groupcam.conf import config
+from groupcam.core import get_child_logger
+
+
+def camera_factory(camera):
+    """Creates the camera compositor according to the configured mode.
+
+    @param camera: camera document
+    """
+
+    if config['camera']['compositor'] == 'process':
+        result = CompositorProcess(camera)
+    else:
+        result = Camera(camera)
+    return result
+
+
+class CompositorProcess:
+    """Source process side of a camera composited in a child process.
+
+    Mimics the Camera interface used by SourceClient and forwards users
+    and frame-ready notifications to the child over a pipe.
+    """
+
+    def __init__(self, camera):
+        self._camera = camera
+        self._users = {}
+        self._shared_names = {}
+        self._logger = get_child_logger('compositor/{}'.format(camera['id']))
+        self.messages_sent = 0
+        self._send_lock = threading.Lock()
+
+        context = multiprocessing.get_context('spawn')
+        # The first end only receives, the second one only sends
+        child_conn, self._conn = context.Pipe(duplex=False)
+        self._process = context.Process(
+            target=_run_compositor, args=(dict(config), camera, child_conn),
+            name='compositor/{}'.format(camera['id']), daemon=True)
+        self._process.start()
+        child_conn.close()
+
+    def add_user(self, user):
+        self._users[user.user_id] = user
+
+    def remove_user(self, user_id):
+        if self._users.pop(user_id, None) is not None:
+            self._shared_names.pop(user_id, None)
+            self._send('remove', user_id)
+
+    def update_if_has_user(self, user_id):
+        user = self._users.get(user_id)
+        if user is None:
+            return
+
+        if self._shared_names.get(user_id) != user.shared_name:
+            # The user's buffer has been created or resized
+            self._shared_names[user_id] = user.shared_name
+            self._send('user', user_id, user.label, user.shared_name,
+                       user.img_width, user.img_height)
+        self._send('frame', user_id, user.updated)
+
+    def activate_preset(self, preset, requested=None):
+        self._send('preset', preset, requested)
+
+    def update(self, camera, requested=None):
+        self._camera = camera
+        self._send('camera', camera, requested)
+
+    def update_presets(self, presets, requested=None):
+        # The monotonic clock is shared by all the processes
+        self._send('presets', presets, requested)
+
+    @property
+    def dirty(self):
+        # Rendering happens in the compositor process
+        return False
+
+    def render_if_dirty(self):
+        return False
+
+    def close(self):
+        self._send('stop')
+        self._process.join(timeout=5.)
+
+    @property
+    def stats(self):
+        return dict(pid=self._process.pid,
+                    alive=self._process.is_alive(),
+                    messages_sent=self.messages_sent)
+
+    def _send(self, *message):
+        try:
+            with self._send_lock:
+                self._conn.send(message)
+                self.messages_sent += 1
+        except OSError as e:
+            self._logger.error("Compositor process is gone: {}".format(e))
+
+
+class SharedUser:
+    """Compositor process side of a user, reads the frames written by
+    the source process without copying them.
+
+    The frame is followed by a sequence number, which the source process
+    increments before and after writing a frame. A frame read while the
+    number is odd or has changed meanwhile may be torn.
+    """
+
+    def __init__(self, user_id, label, shared_name, width, height):
+        # Python 3.8+, only needed in the process compositing mode
+        from multiprocessing import shared_memory
+
+        self.user_id = user_id
+        self.label = label
+        self.img_width = width
+        self.img_height = height
+        self.updated = None
+        self._shm = shared_memory.SharedMemory(shared_name)
+        self.data = numpy.ndarray(width * height, dtype=numpy.int32,
+                                  buffer=self._shm.buf)
+        self._sequence = numpy.ndarray(1, dtype=numpy.int32,
+                                       buffer=self._shm.buf,
+                                       offset=width * height * 4)
+        self.surface = cairo.ImageSurface.create_for_data(
+            self.data, cairo.FORMAT_ARGB32, width, height)
+
+    @property
+    def sequence(self):
+        return int(self._sequence[0])
+
+    def close(self):
+        # The memory can only be unmapped once nothing refers to it
+        self.surface.finish()
+        self.surface = self.data = self._sequence = None
+        self._shm.close()
+
+
+class SharedCamera(Camera):
+    """Camera drawing SharedUsers, the tiles drawn while the source
+    process was writing the frame are redrawn on the next tick.
+    """
+
+    def __init__(self, camera, device=None):
+        self.frames_torn = 0
+        super().__init__(camera, device)
+
+    def _draw_user(self, user, display_rect):
+        sequence = user.sequence
+        super()._draw_user(user, display_rect)
+        if sequence % 2 or user.sequence != sequence:
+            self.frames_torn += 1
+            self._mark_dirty(user.user_id)
+
+
+def _run_compositor(parent_config, camera, conn):
+    # Spawned processes start from scratch, so the configuration is
+    # passed over explicitly
+    config.update(parent_config)
+
+    from groupcam.scheduler import RenderScheduler
+
+    logger = get_child_logger('compositor/{}'.format(camera['id']))
+    compositor = SharedCamera(camera)
+    scheduler = RenderScheduler(config['camera']['fps'])
+    scheduler.add(compositor)
+    scheduler.start()
+
+    users = {}
+    # (user, frames rendered) of the replaced and removed users, which a
+    # render in progress may still be drawing
+    retired = []
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+
+        command, args = message[0], message[1:]
+        if command == 'user':
+            try:
+                user = SharedUser(*args)
+            except FileNotFoundError:
+                # Resized again before we got here, a newer buffer follows
+                continue
+            old_user, users[user.user_id] = users.get(user.user_id), user
+            compositor.add_user(user)
+            if old_user is not None:
+                user.updated = old_user.updated
+                retired.append((old_user, compositor.frames_rendered))
+        elif command == 'frame':
+            user_id, updated = args
+            if user_id in users:
+                users[user_id].updated = updated
+                compositor.update_if_has_user(user_id)
+        elif command == 'remove':
+            compositor.remove_user(args[0])
+            user = users.pop(args[0], None)
+            if user is not None:
+                retired.append((user, compositor.frames_rendered))
+        elif command == 'preset':
+            compositor.activate_preset(*args)
+        elif command == 'presets':
+            compositor.update_presets(*args)
+        elif command == 'camera':
+            compositor.update(*args)
+        elif command == 'stop':
+            break
+        else:
+            logger.error("Unknown command {}".format(command))
+        retired = _close_retired(retired, compositor.frames_rendered)
+
+    scheduler.stop()
+    compositor.close()
+    for user, rendered in retired:
+        user.close()
+    for user in users.values():
+        user.close()
+
+
+def _close_retired(retired, frames_rendered):
+    """Closes the retired users once a frame has been rendered after they
+    were retired, no render can be drawing them anymore.
+
+    @return: list of the users still retired
+    """
+
+    kept = []
+    for user, rendered in retired:
+        if frames_rendered > rendered:
+            user.close()
+        else:
+            kept.append((user, rendered))
+    return kept
@@ -25,14 +25,14 @@ def load_config(config_path=None):
 def _load_defaults():
     defaults_path = get_project_path('misc/defaults.yaml')
     with open(defaults_path) as defaults_file:
-        defaults = yaml.load(defaults_file)
+        defaults = yaml.safe_load(defaults_file)
     return defaults
 
 
 def _load_custom_config(config_path):
     with open(config_path) as config_file:
         try:
-            custom_config = yaml.load(config_file)
+            custom_config = yaml.safe_load(config_file)
         except IOError:
             fail_with_error("Config file not found ({})".format(config_path))
         except yaml.YAMLError:
@@ -0,0 +1,376 @@
+import os
+import time
+import mmap
+import errno
+import fcntl
+import ctypes
+import threading
+
+import v4l2
+import numpy
+
+from groupcam import metrics
+from groupcam.core import fail_with_error, get_child_logger
+
+
+class StreamingError(Exception):
+    """Raised when the device doesn't support streaming I/O.
+    """
+
+
+class V4L2Device:
+    """Video output device, normally a v4l2loopback one.
+    """
+
+    def __init__(self, name, width, height):
+        self.name = name
+        self.width = width
+        self.height = height
+        self._fd = None
+        self._lib = self._get_v4l2_lib()
+        self._open()
+        self.capability = self._get_capability()
+        self._set_format()
+
+    def write(self, data):
+        os.write(self._fd, data)
+
+    def ioctl(self, request, arg):
+        return fcntl.ioctl(self._fd, request, arg)
+
+    def mmap(self, length, offset):
+        return mmap.mmap(self._fd, length, mmap.MAP_SHARED,
+                         mmap.PROT_READ | mmap.PROT_WRITE, offset=offset)
+
+    def set_blocking(self, blocking):
+        os.set_blocking(self._fd, blocking)
+
+    def close(self):
+        if self._fd is not None:
+            self._lib.v4l2_close(self._fd)
+            self._fd = None
+
+    def _get_v4l2_lib(self):
+        try:
+            lib = ctypes.cdll.LoadLibrary('libv4l2.so.0')
+        except OSError:
+            fail_with_error("Unable to load libv4l2, is it installed?")
+        return lib
+
+    def _open(self):
+        name_buf = self.name.encode('utf8')
+        fd = self._lib.v4l2_open(name_buf, os.O_RDWR)
+        if fd == -1:
+            fail_with_error("Unable to open device {}".format(self.name))
+        self._fd = fd
+
+    def _get_capability(self):
+        capability = v4l2.v4l2_capability()
+        ret_code = self.ioctl(v4l2.VIDIOC_QUERYCAP, capability)
+        if ret_code == -1:
+            fail_with_error("Unable to get device capabilities")
+        return capability
+
+    def _set_format(self):
+        fmt = v4l2.v4l2_format()
+        fmt.type = v4l2.V4L2_BUF_TYPE_VIDEO_OUTPUT
+        fmt.fmt.pix.pixelformat = v4l2.V4L2_PIX_FMT_BGR32
+        fmt.fmt.pix.width = self.width
+        fmt.fmt.pix.height = self.height
+        fmt.fmt.pix.field = v4l2.V4L2_FIELD_NONE
+        fmt.fmt.pix.bytesperline = fmt.fmt.pix.width * 4
+        fmt.fmt.pix.sizeimage = fmt.fmt.pix.width * fmt.fmt.pix.height * 4
+        fmt.fmt.pix.colorspace = v4l2.V4L2_COLORSPACE_SRGB
+        ret_code = self.ioctl(v4l2.VIDIOC_S_FMT, fmt)
+        if ret_code == -1:
+            fail_with_error("Unable to set device format")
+
+    def __del__(self):
+        self.close()
+
+
+class FileDevice:
+    """Frame sink overwriting a file with every frame, such as /dev/null or
+    a file on tmpfs, for running the pipeline without v4l2loopback.
+    """
+
+    def __init__(self, name, width, height):
+        self.name = name
+        self.width = width
+        self.height = height
+        # No streaming I/O, so frames are always written
+        self.capability = v4l2.v4l2_capability()
+        self._fd = os.open(name, os.O_WRONLY | os.O_CREAT, 0o644)
+
+    def write(self, data):
+        os.pwrite(self._fd, data, 0)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __del__(self):
+        self.close()
+
+
+class DeviceWriter:
+    """Multi-buffered output stage writing frames from its own thread.
+
+    The camera composites into a free buffer, submits it and goes on with
+    the next one while the writer thread is busy with the device. At most
+    one submitted buffer waits for the writer: when a newer frame is
+    submitted, the waiting one is dropped instead of queued.
+    """
+
+    def __init__(self, device, buffers_number=2):
+        self._device = device
+        self.buffers = [
+            numpy.empty(device.width * device.height, dtype=numpy.int32)
+            for index in range(buffers_number)
+        ]
+        self._free = list(range(buffers_number))
+        self._pending = None
+        self._writing = None
+        self._stopped = False
+        self._condition = threading.Condition()
+        self._logger = get_child_logger('writer/{}'.format(device.name))
+
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.write_time = 0.
+        self.write_time_max = 0.
+        self._write_time = metrics.DEVICE_WRITE_TIME.child(device.name)
+        metrics.FRAMES_WRITTEN.track([device.name], self, 'frames_written')
+        metrics.FRAMES_DROPPED.track([device.name], self, 'frames_dropped')
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def acquire(self):
+        """Returns the index of a buffer to composite the next frame into.
+
+        @return: buffer index or None if all the buffers are busy
+        """
+
+        with self._condition:
+            if self._free:
+                index = self._free.pop()
+            elif self._pending is not None:
+                # The waiting frame is outdated by the one about to be
+                # composited
+                index, self._pending = self._pending, None
+                self.frames_dropped += 1
+            else:
+                index = None
+        return index
+
+    def submit(self, index):
+        """Hands the composited buffer over to the writer thread.
+        """
+
+        with self._condition:
+            if self._pending is not None:
+                self._free.append(self._pending)
+                self.frames_dropped += 1
+            self._pending = index
+            self._condition.notify()
+
+    def close(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        # The descriptor may be reused by another device once closed, so
+        # the frame being written has to be finished first
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._device.close()
+        metrics.DEVICE_WRITE_TIME.release(self._write_time,
+                                          self._device.name)
+
+    @property
+    def stats(self):
+        written = self.frames_written
+        return dict(frames_written=written,
+                    frames_dropped=self.frames_dropped,
+                    write_time_avg=self.write_time / written if written else 0,
+                    write_time_max=self.write_time_max)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    break
+                self._writing, self._pending = self._pending, None
+
+            started = time.monotonic()
+            try:
+                self._device.write(self.buffers[self._writing])
+            except OSError as e:
+                self._logger.error("Write failed: {}".format(e))
+            elapsed = time.monotonic() - started
+            self._write_time.observe(elapsed)
+
+            with self._condition:
+                self._free.append(self._writing)
+                self._writing = None
+                self.frames_written += 1
+                self.write_time += elapsed
+                self.write_time_max = max(self.write_time_max, elapsed)
+
+
+class StreamingOutput:
+    """Streaming I/O output stage.
+
+    Frames are composited straight into the device's mmap'ed buffers,
+    which are then queued to the driver without any intermediate copy.
+    When the driver holds all the buffers, the frame is dropped.
+    """
+
+    def __init__(self, device, buffers_number=2):
+        if not device.capability.capabilities & v4l2.V4L2_CAP_STREAMING:
+            raise StreamingError("Streaming I/O is not supported")
+
+        self._device = device
+        self._streaming = False
+        self._logger = get_child_logger('streaming/{}'.format(device.name))
+        self._frame_size = device.width * device.height * 4
+        self._maps = []
+        # Error the last dequeue failed with, repeated errors are logged once
+        self._dequeue_errno = None
+        self.frames_queued = 0
+        # Not dropped, the camera stays dirty and renders on the next tick
+        self.frames_deferred = 0
+        self._write_time = metrics.DEVICE_WRITE_TIME.child(device.name)
+        metrics.FRAMES_WRITTEN.track([device.name], self, 'frames_queued')
+        metrics.FRAMES_DEFERRED.track([device.name], self,
+                                      'frames_deferred')
+
+        self._request_buffers(buffers_number)
+        self.buffers = [self._map_buffer(index)
+                        for index in range(self._buffers_number)]
+        # All the buffers belong to us until queued for the first time
+        self._free = list(range(self._buffers_number))
+        device.set_blocking(False)
+
+    def acquire(self):
+        if self._free:
+            return self._free.pop()
+
+        buf = self._create_buffer()
+        try:
+            self._device.ioctl(v4l2.VIDIOC_DQBUF, buf)
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, self._dequeue_errno):
+                self._logger.error("Unable to dequeue buffer: {}".format(e))
+            self._dequeue_errno = e.errno
+            self.frames_deferred += 1
+            return None
+        self._dequeue_errno = None
+        return buf.index
+
+    def submit(self, index):
+        buf = self._create_buffer(index)
+        buf.bytesused = self._frame_size
+        buf.field = v4l2.V4L2_FIELD_NONE
+        started = time.monotonic()
+        try:
+            self._device.ioctl(v4l2.VIDIOC_QBUF, buf)
+        except OSError as e:
+            self._logger.error("Unable to queue buffer: {}".format(e))
+            self._free.append(index)
+            return
+        self._write_time.observe(time.monotonic() - started)
+
+        self.frames_queued += 1
+        if not self._streaming:
+            self._set_streaming(v4l2.VIDIOC_STREAMON)
+
+    def close(self):
+        """Stops streaming and unmaps the buffers, which must not be
+        referenced anymore, before closing the device.
+        """
+
+        if self._streaming:
+            self._set_streaming(v4l2.VIDIOC_STREAMOFF)
+        self.buffers = []
+        for memory in self._maps:
+            try:
+                memory.close()
+            except BufferError:
+                # Unmapped along with the last array referring to it
+                self._logger.warning("Buffer still in use, not unmapped")
+        self._maps = []
+        self._device.close()
+        metrics.DEVICE_WRITE_TIME.release(self._write_time,
+                                          self._device.name)
+
+    @property
+    def stats(self):
+        return dict(frames_written=self.frames_queued,
+                    frames_deferred=self.frames_deferred)
+
+    def _request_buffers(self, buffers_number):
+        request = v4l2.v4l2_requestbuffers()
+        request.count = buffers_number
+        request.type = v4l2.V4L2_BUF_TYPE_VIDEO_OUTPUT
+        request.memory = v4l2.V4L2_MEMORY_MMAP
+        try:
+            self._device.ioctl(v4l2.VIDIOC_REQBUFS, request)
+        except OSError as e:
+            raise StreamingError("Unable to request buffers: {}".format(e))
+        if request.count < 1:
+            raise StreamingError("No buffers have been allocated")
+        self._buffers_number = request.count
+
+    def _map_buffer(self, index):
+        buf = self._create_buffer(index)
+        self._device.ioctl(v4l2.VIDIOC_QUERYBUF, buf)
+        memory = self._device.mmap(buf.length, buf.m.offset)
+        self._maps.append(memory)
+        return numpy.frombuffer(memory, dtype=numpy.int32,
+                                count=self._frame_size // 4)
+
+    def _create_buffer(self, index=0):
+        buf = v4l2.v4l2_buffer()
+        buf.index = index
+        buf.type = v4l2.V4L2_BUF_TYPE_VIDEO_OUTPUT
+        buf.memory = v4l2.V4L2_MEMORY_MMAP
+        return buf
+
+    def _set_streaming(self, request):
+        buf_type = ctypes.c_int(v4l2.V4L2_BUF_TYPE_VIDEO_OUTPUT)
+        self._device.ioctl(request, buf_type)
+        self._streaming = request == v4l2.VIDIOC_STREAMON
+
+
+DEVICES = {
+    'v4l2': V4L2Device,
+    'file': FileDevice,
+}
+
+
+def device_factory(device_type, name, width, height):
+    """@param device_type: "v4l2" for video devices, "file" for frame sinks
+    """
+
+    device_class = DEVICES[device_type]
+    return device_class(name, width, height)
+
+
+def output_factory(device, mode, buffers_number):
+    """Creates the output stage of the given mode for the device.
+
+    @param mode: "mmap" for streaming I/O, "write" for write() calls,
+    streaming falls back to write() if the driver doesn't support it
+    """
+
+    if mode == 'mmap':
+        try:
+            return StreamingOutput(device, buffers_number)
+        except StreamingError as e:
+            logger = get_child_logger('streaming/{}'.format(device.name))
+            logger.warning("{}, falling back to write()".format(e))
+    return DeviceWriter(device, buffers_number)
@@ -0,0 +1,101 @@
+import heapq
+import itertools
+import threading
+from time import monotonic
+
+from groupcam.core import get_child_logger
+
+
+class ExpiryHeap:
+    """Fires callbacks when keys haven't been touched for a timeout.
+
+    Deadlines are kept on the monotonic clock in a heap served by a single
+    thread, which sleeps until the earliest one. Touching a key only moves
+    its deadline; every key has at most one heap entry, which is pushed
+    back on expiry if the key has been touched meanwhile.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._deadlines = {}
+        self._callbacks = {}
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._logger = get_child_logger('expiry')
+        self.expired = 0
+
+    def touch(self, key, timeout, callback):
+        """Postpones the key's expiry.
+
+        @param key: hashable key
+        @param timeout: seconds from now until the expiry
+        @param callback: called with the key from the expiry thread
+        """
+
+        deadline = monotonic() + timeout
+        with self._condition:
+            scheduled = key in self._deadlines
+            self._deadlines[key] = deadline
+            self._callbacks[key] = callback
+            if not scheduled:
+                self._push(deadline, key)
+
+    def discard(self, key):
+        with self._condition:
+            # The heap entry is dropped once it comes up
+            self._deadlines.pop(key, None)
+            self._callbacks.pop(key, None)
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def _push(self, deadline, key):
+        earliest = self._heap[0][0] if self._heap else None
+        heapq.heappush(self._heap, (deadline, next(self._counter), key))
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        elif earliest is None or deadline < earliest:
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                callback = None
+                while callback is None:
+                    callback, key = self._pop_expired()
+            try:
+                callback(key)
+            except Exception:
+                self._logger.exception("Expiry callback failed")
+
+    def _pop_expired(self):
+        # Must be called with the condition held
+        if not self._heap:
+            self._condition.wait()
+            return None, None
+
+        deadline, counter, key = self._heap[0]
+        now = monotonic()
+        if deadline > now:
+            self._condition.wait(deadline - now)
+            return None, None
+
+        heapq.heappop(self._heap)
+        current = self._deadlines.get(key)
+        if current is None:
+            # Discarded
+            return None, None
+        if current > deadline:
+            # Touched since the entry has been pushed
+            heapq.heappush(self._heap, (current, counter, key))
+            return None, None
+
+        del self._deadlines[key]
+        self.expired += 1
+        return self._callbacks.pop(key), key
+
+
+# Expiry heap shared by all the cameras of the process
+expiry = ExpiryHeap()
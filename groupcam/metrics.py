@@ -0,0 +1,261 @@
+"""Pipeline metrics in the Prometheus text exposition format.
+
+Observing a value is a couple of attribute lookups and an addition, all
+the formatting happens when the metrics are scraped. Counters already kept
+by the pipeline objects are tracked by reference and only read on scrape.
+"""
+
+import bisect
+import weakref
+
+
+# Upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025,
+                   .05, .1, .25, .5, 1.)
+
+
+def _escape(value):
+    return (str(value).replace('\\', r'\\').replace('"', r'\"')
+            .replace('\n', r'\n'))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(name, _escape(value)) for name, value in labels))
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Metric family, holds a child per label values combination.
+    """
+
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+
+    def child(self, *values):
+        """Creates the child for the label values. The previous child with
+        the same values, if any, is replaced.
+        """
+
+        child = self._create_child()
+        self._children[self._key(values)] = child
+        return child
+
+    def remove(self, *values):
+        self._children.pop(self._key(values), None)
+
+    def release(self, child, *values):
+        """Removes the child unless it has been replaced meanwhile.
+        """
+
+        key = self._key(values)
+        if self._children.get(key) is child:
+            del self._children[key]
+
+    def samples(self):
+        """Yields (suffix, labels, value) tuples.
+        """
+
+        for values, child in list(self._children.items()):
+            labels = list(zip(self.labelnames, values))
+            yield from self._child_samples(child, labels)
+
+    def _key(self, values):
+        if len(values) != len(self.labelnames):
+            raise ValueError("Expected labels {}".format(self.labelnames))
+        return tuple(str(value) for value in values)
+
+    def _create_child(self):
+        raise NotImplementedError
+
+    def _child_samples(self, child, labels):
+        raise NotImplementedError
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class _TrackedChild:
+    def __init__(self, obj, attribute):
+        self._ref = weakref.ref(obj)
+        self._attribute = attribute
+
+    @property
+    def value(self):
+        obj = self._ref()
+        return None if obj is None else getattr(obj, self._attribute)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def track(self, values, obj, attribute):
+        """Exposes the counter kept in the object's attribute, which is
+        read on scrape only. The child goes away with the object.
+
+        @param values: label values
+        @return: the child, to release it before the object goes away
+        """
+
+        child = _TrackedChild(obj, attribute)
+        self._children[self._key(values)] = child
+        return child
+
+    def _create_child(self):
+        return _CounterChild()
+
+    def _child_samples(self, child, labels):
+        value = child.value
+        if value is None:
+            self.release(child, *(value for name, value in labels))
+        else:
+            yield '', labels, value
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self._buckets, value)] += 1
+        self.sum += value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _create_child(self):
+        return _HistogramChild(self.buckets)
+
+    def _child_samples(self, child, labels):
+        counts, total = list(child.counts), child.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            yield ('_bucket', labels + [('le', _format_value(bound))],
+                   cumulative)
+        yield '_sum', labels, total
+        yield '_count', labels, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """@return: metrics in the Prometheus text format
+        """
+
+        lines = []
+        for metric in self._metrics:
+            name = metric.name
+            lines.append('# HELP {} {}'.format(name, metric.help))
+            lines.append('# TYPE {} {}'.format(name, metric.type))
+            for suffix, labels, value in metric.samples():
+                lines.append('{}{}{} {}'.format(
+                    name, suffix, _format_labels(labels),
+                    _format_value(value)))
+        lines.append('')
+        return '\n'.join(lines)
+
+
+registry = Registry()
+
+FRAME_FETCH_TIME = registry.register(Histogram(
+    'groupcam_frame_fetch_seconds',
+    "Time taken to fetch a user's frames from TT4", ['user']))
+LAYOUT_TIME = registry.register(Histogram(
+    'groupcam_layout_seconds',
+    "Time taken to lay out the users of a camera", ['camera']))
+COMPOSITION_TIME = registry.register(Histogram(
+    'groupcam_composition_seconds',
+    "Time taken to composite a camera frame", ['camera']))
+TEXT_RENDER_TIME = registry.register(Histogram(
+    'groupcam_text_render_seconds',
+    "Time taken to render a title or a label", ['camera']))
+PRESET_SWITCH_TIME = registry.register(Histogram(
+    'groupcam_preset_switch_seconds',
+    "Time from a preset change request to the first frame in the new "
+    "layout", ['camera']))
+DEVICE_WRITE_TIME = registry.register(Histogram(
+    'groupcam_device_write_seconds',
+    "Time taken to hand a frame over to the device", ['device']))
+
+MESSAGES_RECEIVED = registry.register(Counter(
+    'groupcam_tt4_messages_received_total',
+    "TT4 messages received", ['client']))
+MESSAGES_COLLAPSED = registry.register(Counter(
+    'groupcam_tt4_messages_collapsed_total',
+    "TT4 video frame messages collapsed into earlier ones", ['client']))
+MESSAGE_BATCHES = registry.register(Counter(
+    'groupcam_tt4_message_batches_total',
+    "TT4 message batches processed", ['client']))
+FFI_CALLS = registry.register(Counter(
+    'groupcam_tt4_ffi_calls_total',
+    "TT4 library calls made to fetch a user's frames", ['user']))
+FRAMES_FETCHED = registry.register(Counter(
+    'groupcam_user_frames_fetched_total',
+    "User frames fetched from TT4", ['user']))
+FRAMES_SKIPPED = registry.register(Counter(
+    'groupcam_user_frames_skipped_total',
+    "User frames replaced by newer ones before being composited",
+    ['user']))
+SCHEDULER_TICKS = registry.register(Counter(
+    'groupcam_scheduler_ticks_total', "Output ticks run"))
+TICKS_DROPPED = registry.register(Counter(
+    'groupcam_scheduler_ticks_dropped_total',
+    "Output ticks skipped, rendering having taken longer than the output "
+    "interval"))
+RENDERS_DEFERRED = registry.register(Counter(
+    'groupcam_scheduler_renders_deferred_total',
+    "Camera renders put off to the next tick, the previous render of the "
+    "camera still running"))
+TEXT_CACHE_HITS = registry.register(Counter(
+    'groupcam_text_cache_hits_total',
+    "Titles and labels found rendered already", ['camera']))
+TEXT_CACHE_MISSES = registry.register(Counter(
+    'groupcam_text_cache_misses_total',
+    "Titles and labels rendered", ['camera']))
+FRAMES_RENDERED = registry.register(Counter(
+    'groupcam_frames_rendered_total',
+    "Camera frames composited", ['camera']))
+FRAMES_COALESCED = registry.register(Counter(
+    'groupcam_frames_coalesced_total',
+    "User frames merged into a single camera frame", ['camera']))
+FRAMES_WRITTEN = registry.register(Counter(
+    'groupcam_frames_written_total',
+    "Camera frames handed over to the device", ['device']))
+FRAMES_DROPPED = registry.register(Counter(
+    'groupcam_frames_dropped_total',
+    "Camera frames dropped before reaching the device", ['device']))
+FRAMES_DEFERRED = registry.register(Counter(
+    'groupcam_frames_deferred_total',
+    "Camera frames put off to the next tick, every buffer being busy",
+    ['device']))
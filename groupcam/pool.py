@@ -0,0 +1,245 @@
+"""Pool of the output video devices.
+
+The device directory is scanned once, then kept current through inotify,
+so allocating a device is a heap pop and clients are notified as soon as
+a loopback device node appears and becomes writable. Where inotify isn't
+available the directory is rescanned periodically instead.
+"""
+
+import os
+import re
+import heapq
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+
+from groupcam.core import get_child_logger
+
+
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+# Seconds between directory rescans without inotify, and between checks
+# of the stop flag with it
+POLL_INTERVAL = 1.
+
+
+def parse_intervals(intervals):
+    """Parses the device number intervals, e.g. "1-3, 5, 10-".
+
+    @return: list of (first, last) tuples, last is None if open-ended
+    """
+
+    result = []
+    for interval in intervals.split(','):
+        bounds = [bound.strip() for bound in interval.split('-')]
+        first = int(bounds[0] or 0)
+        last = bounds[-1]
+        result.append((first, int(last) if last else None))
+    return result
+
+
+class _Inotify:
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        watch = libc.inotify_add_watch(self.fd, directory.encode(),
+                                       WATCH_MASK)
+        if watch < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "Unable to watch {}".format(directory))
+
+    def read(self, timeout):
+        """@return: list of the names of the changed files, empty if
+        nothing has changed within the timeout
+        """
+
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+
+        data = os.read(self.fd, 65536)
+        names, offset = [], 0
+        while offset < len(data):
+            watch, mask, cookie, length = _EVENT_HEADER.unpack_from(
+                data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            names.append(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DevicePool:
+    """Free output devices within the configured number intervals.
+    """
+
+    def __init__(self, name_format, intervals):
+        """@param name_format: device path with a {number} placeholder
+        @param intervals: device number intervals string
+        """
+
+        self._directory = os.path.dirname(name_format)
+        pattern = re.escape(os.path.basename(name_format)).replace(
+            re.escape('{number}'), r'(\d+)')
+        self._name_regexp = re.compile(pattern + '$')
+        self._intervals = parse_intervals(intervals)
+
+        self._condition = threading.Condition()
+        self._ready = set()
+        self._occupied = set()
+        self._free = []
+        self._thread = None
+        self._stopped = False
+        self._logger = get_child_logger('pool')
+
+    def start(self, occupied=()):
+        """Scans the device directory and starts watching it.
+
+        @param occupied: device paths already allocated
+        """
+
+        with self._condition:
+            self._occupied = set(occupied)
+        # Watching first, so that nothing changed during the scan is missed
+        try:
+            inotify = _Inotify(self._directory)
+        except OSError as e:
+            self._logger.warning("Polling {} for devices: {}".format(
+                self._directory, e))
+            inotify = None
+        self._scan()
+        self._thread = threading.Thread(target=self._run, args=[inotify],
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+
+    def allocate(self):
+        """@return: path of a free ready device, the lowest numbered one,
+        None if there are none
+        """
+
+        with self._condition:
+            while self._free:
+                number, name = heapq.heappop(self._free)
+                # Entries are left in the heap when devices go away
+                if name in self._ready and name not in self._occupied:
+                    self._occupied.add(name)
+                    return name
+        return None
+
+    def release(self, name):
+        with self._condition:
+            self._occupied.discard(name)
+            self._push_if_free(name)
+
+    def is_ready(self, name):
+        """@return: True if the device exists and is writable
+        """
+
+        with self._condition:
+            return self._is_ready_locked(name)
+
+    def wait_ready(self, name, timeout=None):
+        """Blocks until the device exists and is writable.
+
+        @return: True if the device is ready
+        """
+
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: self._is_ready_locked(name), timeout)
+
+    @property
+    def stats(self):
+        with self._condition:
+            return dict(ready=len(self._ready), occupied=len(self._occupied))
+
+    def _run(self, inotify):
+        while not self._stopped:
+            if inotify is None:
+                threading.Event().wait(POLL_INTERVAL)
+                self._scan()
+                continue
+            names = inotify.read(POLL_INTERVAL)
+            for name in names:
+                self._update(name)
+            if not names:
+                with self._condition:
+                    self._condition.notify_all()
+
+        if inotify is not None:
+            inotify.close()
+
+    def _scan(self):
+        try:
+            names = os.listdir(self._directory)
+        except OSError as e:
+            self._logger.error("Unable to list {}: {}".format(
+                self._directory, e))
+            return
+
+        paths = {os.path.join(self._directory, name) for name in names}
+        with self._condition:
+            for path in self._ready - paths:
+                self._ready.discard(path)
+            for path in paths:
+                self._update_locked(path)
+            self._condition.notify_all()
+
+    def _update(self, name):
+        with self._condition:
+            self._update_locked(os.path.join(self._directory, name))
+            self._condition.notify_all()
+
+    def _update_locked(self, path):
+        if self._get_number(path) is None:
+            return
+        if _is_ready(path):
+            if path not in self._ready:
+                self._ready.add(path)
+                self._push_if_free(path)
+        else:
+            self._ready.discard(path)
+
+    def _is_ready_locked(self, name):
+        if os.path.dirname(name) != self._directory:
+            # Not watched, rechecked every POLL_INTERVAL by wait_ready
+            return _is_ready(name)
+        return name in self._ready
+
+    def _push_if_free(self, path):
+        if path in self._ready and path not in self._occupied:
+            heapq.heappush(self._free, (self._get_number(path), path))
+
+    def _get_number(self, path):
+        match = self._name_regexp.match(os.path.basename(path))
+        if match is None or os.path.dirname(path) != self._directory:
+            return None
+        number = int(match.group(1))
+        for first, last in self._intervals:
+            if first <= number and (last is None or number <= last):
+                return number
+        return None
+
+
+def _is_ready(path):
+    return os.access(path, os.R_OK | os.W_OK)
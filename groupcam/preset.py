@@ -6,13 +6,45 @@ class BasePreset:
     def __init__(self, camera, layout):
         self._camera = camera
         self._layout = layout
+        self._rects_cache = {}
 
     def get_user_display_rects(self, users):
+        """Returns bounding rectangles to draw users according to
+        current preset.
+
+        The rectangles are only calculated when the set of users or
+        the camera geometry changes.
+
+        @param users: list of User objects
+        @return: list of (user, rectangle) tuples
+        """
+
+        key = (tuple(user.user_id for user in users), self._camera.geometry)
+        rects = self._rects_cache.get(key)
+        if rects is None:
+            # The users have joined, left or timed out, so the tables
+            # calculated for other sets of users are stale
+            self._rects_cache.clear()
+            rects = [(user.user_id, display_rect) for user, display_rect
+                     in self.calculate_display_rects(users)]
+            self._rects_cache[key] = rects
+        # Only the ids are cached, the user objects may have been replaced
+        # under the same ids since
+        users = {user.user_id: user for user in users}
+        return [(users[user_id], display_rect)
+                for user_id, display_rect in rects]
+
+    def invalidate(self):
+        """Drops all the calculated rectangles.
+        """
+        self._rects_cache.clear()
+
+    def calculate_display_rects(self, users):
         """Calculates bounding rectangles to draw users according to
         current preset.
 
         @param users: list of User objects
-        @return: list of rectangles
+        @return: list of (user, rectangle) tuples
         """
         raise NotImplementedError
 
@@ -21,7 +53,7 @@ class AutoPreset(BasePreset):
     """The very basic preset, fits all given users into the frame.
     """
 
-    def get_user_display_rects(self, users):
+    def calculate_display_rects(self, users):
         display_rects = []
 
         display_area = self._camera.display_width * self._camera.display_height
@@ -74,7 +106,7 @@ class FixedSizePreset(BasePreset):
         horiz_middle = (self._camera.display_width + cols_width) / 2
         self.left_margin = self._camera.display_width - horiz_middle
 
-    def get_user_display_rects(self, users):
+    def calculate_display_rects(self, users):
         display_rects = []
 
         for index, user in enumerate(users[:self.size * self.size]):
@@ -0,0 +1,157 @@
+import motor
+
+import tornado.gen
+import tornado.ioloop
+from tornado.concurrent import Future
+
+from groupcam.core import get_child_logger
+from groupcam.db import db
+
+
+class CameraRegistry:
+    """Process-local copy of the camera documents.
+
+    Loaded once at startup and updated write-through: every mutation is
+    written to the database and then applied to the copy, so reads never
+    reach the database unless a camera is missing. Other processes writing
+    to the same database are picked up by the periodic refresh, which
+    bounds the staleness by its interval.
+
+    Cached documents are replaced rather than changed in place and must
+    not be modified by the callers. Updates of a camera are serialized and
+    cache the document as the database returns it, so concurrent updates
+    don't overwrite each other in the copy.
+    """
+
+    def __init__(self):
+        self._cameras = {}
+        self._loaded = False
+        self._generation = 0
+        # camera_id: generation of the latest local write
+        self._written = {}
+        self._refresher = None
+        # camera_id: Future resolved once the latest update is done
+        self._updating = {}
+        self._logger = get_child_logger('registry')
+
+    def load(self):
+        """Loads all the cameras, blocking.
+
+        @return: list of the camera documents
+        """
+
+        self._cameras = {camera['id']: camera
+                         for camera in db.sync.cameras.find()}
+        self._loaded = True
+        return list(self._cameras.values())
+
+    def start_refreshing(self, interval):
+        """Reloads the cameras every interval seconds on the IOLoop.
+        """
+
+        self._refresher = tornado.ioloop.PeriodicCallback(
+            self._refresh, interval * 1000)
+        self._refresher.start()
+
+    def stop_refreshing(self):
+        if self._refresher is not None:
+            self._refresher.stop()
+            self._refresher = None
+
+    @tornado.gen.coroutine
+    def get(self, camera_id):
+        """@return: camera document, None if there is no such camera
+        """
+
+        camera = self._cameras.get(camera_id)
+        if camera is None:
+            camera = yield motor.Op(db.async.cameras.find_one,
+                                    {'id': camera_id})
+            if camera is not None:
+                self._cameras.setdefault(camera_id, camera)
+        return camera
+
+    @tornado.gen.coroutine
+    def get_all(self):
+        """@return: list of all the camera documents
+        """
+
+        if not self._loaded:
+            yield self._refresh()
+        return list(self._cameras.values())
+
+    @tornado.gen.coroutine
+    def insert(self, camera):
+        yield motor.Op(db.async.cameras.insert, camera)
+        self._store(camera)
+
+    @tornado.gen.coroutine
+    def update(self, camera_id, operation, condition=None):
+        """Writes the operation and stores the camera as it is after it.
+
+        @param operation: MongoDB update operation
+        @param condition: query the stored document has to match, e.g. the
+        cached values the operation has been computed from
+        @return: updated camera document, None if there is no such camera
+        or it doesn't match the condition, which reloads it
+        """
+
+        previous = self._updating.get(camera_id)
+        done = self._updating[camera_id] = Future()
+        try:
+            if previous is not None:
+                yield previous
+            query = dict(condition or {}, id=camera_id)
+            camera = yield motor.Op(db.async.cameras.find_and_modify,
+                                    query, operation, new=True)
+            if camera is None:
+                stored = yield motor.Op(db.async.cameras.find_one,
+                                        {'id': camera_id})
+                self._store(stored, camera_id)
+            else:
+                self._store(camera)
+        finally:
+            if self._updating.get(camera_id) is done:
+                del self._updating[camera_id]
+            done.set_result(None)
+        return camera
+
+    @tornado.gen.coroutine
+    def remove(self, camera_id):
+        yield motor.Op(db.async.cameras.remove, {'id': camera_id})
+        self._store(None, camera_id)
+
+    def _store(self, camera, camera_id=None):
+        camera_id = camera['id'] if camera is not None else camera_id
+        self._generation += 1
+        self._written[camera_id] = self._generation
+        if camera is None:
+            self._cameras.pop(camera_id, None)
+        else:
+            self._cameras[camera_id] = camera
+
+    @tornado.gen.coroutine
+    def _refresh(self):
+        started = self._generation
+        try:
+            cursor = db.async.cameras.find()
+            cameras = yield motor.Op(cursor.to_list)
+        except Exception:
+            self._logger.exception("Failed to refresh the cameras")
+            return
+
+        # The cameras written while loading are already up to date
+        kept = {camera_id for camera_id, generation in self._written.items()
+                if generation > started}
+        refreshed = {camera['id']: camera for camera in cameras
+                     if camera['id'] not in kept}
+        refreshed.update((camera_id, self._cameras[camera_id])
+                         for camera_id in kept
+                         if camera_id in self._cameras)
+        self._cameras = refreshed
+        self._written = {camera_id: self._written[camera_id]
+                         for camera_id in kept}
+        self._loaded = True
+
+
+camera_registry = CameraRegistry()
@@ -0,0 +1,127 @@
+import re
+
+
+# Maximum number of nicknames the regexp matches are cached for
+MATCHES_CACHE_SIZE = 4096
+
+
+class RoutingIndex:
+    """Maps users to the cameras they appear on.
+
+    Camera regexps are matched once per nickname, the results are cached
+    and only the changed camera is rematched when cameras are added,
+    removed or get a new regexp. Frame fan-out is a single dict lookup.
+    """
+
+    def __init__(self):
+        self._cameras = {}
+        self._regexps = {}
+        # nickname: set of the ids of the matching cameras
+        self._matches = {}
+        self._nicknames = {}
+        # user_id: tuple of the cameras showing the user
+        self._routes = {}
+
+    def add_camera(self, camera_id, camera, regexp):
+        """Registers the camera.
+
+        @param regexp: nickname regexp string
+        @return: list of the ids of the users shown on the camera
+        """
+
+        self._cameras[camera_id] = camera
+        return self.update_camera(camera_id, regexp)[0]
+
+    def update_camera(self, camera_id, regexp):
+        """Rematches the users against the camera's new regexp.
+
+        @return: (added user ids, removed user ids) tuple
+        """
+
+        nick_regexp = re.compile(regexp, re.IGNORECASE)
+        self._regexps[camera_id] = nick_regexp
+
+        changed = set()
+        for nickname, camera_ids in self._matches.items():
+            matched = nick_regexp.match(nickname) is not None
+            if matched != (camera_id in camera_ids):
+                if matched:
+                    camera_ids.add(camera_id)
+                else:
+                    camera_ids.discard(camera_id)
+                changed.add(nickname)
+
+        added, removed = [], []
+        for user_id, nickname in self._nicknames.items():
+            if nickname in changed:
+                self._update_route(user_id)
+                if camera_id in self._matches[nickname]:
+                    added.append(user_id)
+                else:
+                    removed.append(user_id)
+        return added, removed
+
+    def remove_camera(self, camera_id):
+        """@return: list of the ids of the users shown on the camera
+        """
+
+        removed = [user_id
+                   for user_id, nickname in self._nicknames.items()
+                   if camera_id in self._matches[nickname]]
+
+        del self._cameras[camera_id]
+        del self._regexps[camera_id]
+        for camera_ids in self._matches.values():
+            camera_ids.discard(camera_id)
+        for user_id in removed:
+            self._update_route(user_id)
+        return removed
+
+    def add_user(self, user_id, nickname):
+        """Routes the user to the cameras matching the nickname.
+
+        @return: tuple of the cameras
+        """
+
+        if nickname not in self._matches:
+            if len(self._matches) >= MATCHES_CACHE_SIZE:
+                self._evict_matches()
+            self._matches[nickname] = {
+                camera_id
+                for camera_id, nick_regexp in self._regexps.items()
+                if nick_regexp.match(nickname)
+            }
+        self._nicknames[user_id] = nickname
+        return self._update_route(user_id)
+
+    def remove_user(self, user_id):
+        self._nicknames.pop(user_id, None)
+        self._routes.pop(user_id, None)
+
+    def get_cameras(self, user_id):
+        """@return: tuple of the cameras showing the user
+        """
+        return self._routes.get(user_id, ())
+
+    @property
+    def stats(self):
+        return dict(cameras=len(self._cameras),
+                    users=len(self._nicknames),
+                    nicknames_cached=len(self._matches))
+
+    def _update_route(self, user_id):
+        camera_ids = self._matches[self._nicknames[user_id]]
+        cameras = tuple(self._cameras[camera_id]
+                        for camera_id in sorted(camera_ids, key=str))
+        if cameras:
+            self._routes[user_id] = cameras
+        else:
+            self._routes.pop(user_id, None)
+        return cameras
+
+    def _evict_matches(self):
+        # Only the nicknames of the users still online are kept
+        online = set(self._nicknames.values())
+        self._matches = {nickname: camera_ids
+                         for nickname, camera_ids in self._matches.items()
+                         if nickname in online}
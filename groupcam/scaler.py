@@ -0,0 +1,171 @@
+import numpy
+
+
+# Maximum number of index maps kept by a NumPy scaler
+MAPS_CACHE_SIZE = 64
+
+
+class CairoScaler:
+    """Scales user frames into tiles with cairo transformations.
+    """
+
+    def __init__(self, surface, data, context):
+        self._context = context
+
+    def draw(self, user, display_rect):
+        """Paints the user's frame scaled to the display rectangle.
+
+        @param user: User object
+        @param display_rect: (left, top, width, height) tuple
+        """
+
+        self._context.save()
+        left, top, width, height = display_rect
+        self._context.translate(left, top)
+        self._context.scale(width / user.img_width,
+                            height / user.img_height)
+        self._context.set_source_surface(user.surface)
+        self._context.paint()
+        self._context.restore()
+
+
+class NearestScaler:
+    """Scales user frames by writing resampled pixels straight into
+    the camera's pixel array.
+
+    Index maps are precomputed for each source size and tile rectangle
+    pair, so scaling a frame is a single fancy-indexing operation.
+    """
+
+    def __init__(self, surface, data, context):
+        self._surface = surface
+        self._pixels = data.reshape(surface.get_height(), surface.get_width())
+        self._maps = {}
+
+    def draw(self, user, display_rect):
+        tile_width, tile_height, column, row, visible = self._clip(
+            display_rect)
+        left, top, width, height = visible
+        if width <= 0 or height <= 0:
+            return
+
+        key = (user.img_width, user.img_height, tile_width, tile_height,
+               column, row, width, height)
+        index_map = self._maps.get(key)
+        if index_map is None:
+            if len(self._maps) >= MAPS_CACHE_SIZE:
+                self._maps.clear()
+            index_map = self.calculate_map(*key[:4])
+            if (width, height) != (tile_width, tile_height):
+                index_map = self.crop_map(index_map, column, row,
+                                          width, height)
+            self._maps[key] = index_map
+
+        self._surface.flush()
+        tile = self._pixels[top:top + height, left:left + width]
+        self.resample(user.data, index_map, tile)
+        self._surface.mark_dirty_rectangle(left, top, width, height)
+
+    def calculate_map(self, src_width, src_height, width, height):
+        """Calculates the index map for the given sizes.
+
+        @return: array of flat source pixel indexes shaped as the tile
+        """
+
+        rows = numpy.arange(height) * src_height // height
+        cols = numpy.arange(width) * src_width // width
+        return rows[:, numpy.newaxis] * src_width + cols
+
+    def crop_map(self, index_map, column, row, width, height):
+        """Cuts the part of the index map drawn into the canvas out of it.
+
+        @param column: left offset of the part in the tile
+        @param row: top offset of the part in the tile
+        """
+        return index_map[row:row + height, column:column + width]
+
+    def resample(self, src, index_map, tile):
+        """Writes the scaled source pixels into the tile view.
+        """
+        tile[...] = src[index_map]
+
+    def _clip(self, display_rect):
+        # The tiles sticking out of the canvas are cropped, not squeezed,
+        # so the index map of the whole tile is cut to the visible part
+        left, top, width, height = (int(round(value))
+                                    for value in display_rect)
+        canvas_height, canvas_width = self._pixels.shape
+        column, row = max(-left, 0), max(-top, 0)
+        visible_left, visible_top = left + column, top + row
+        visible = (visible_left, visible_top,
+                   min(left + width, canvas_width) - visible_left,
+                   min(top + height, canvas_height) - visible_top)
+        return width, height, column, row, visible
+
+
+class BilinearScaler(NearestScaler):
+    """Same as NearestScaler, but interpolates between the four nearest
+    source pixels.
+
+    Rows are interpolated first and columns next, both with 8-bit fixed
+    point weights.
+    """
+
+    def calculate_map(self, src_width, src_height, width, height):
+        """@return: (src_width, src_height, row map, column map) tuple,
+        each map holding lower indexes, upper indexes and upper weights
+        """
+
+        def axis(src_size, size):
+            coords = (numpy.arange(size) + .5) * src_size / size - .5
+            coords = numpy.clip(coords, 0, src_size - 1)
+            lower = coords.astype(numpy.intp)
+            upper = numpy.minimum(lower + 1, src_size - 1)
+            weights = numpy.round((coords - lower) * 256)
+            return lower, upper, weights
+
+        top_rows, bottom_rows, row_weights = axis(src_height, height)
+        left_cols, right_cols, col_weights = axis(src_width, width)
+        row_weights = row_weights.astype(numpy.uint16).reshape(-1, 1, 1)
+        col_weights = col_weights.astype(numpy.uint32).reshape(1, -1, 1)
+        return (src_width, src_height,
+                (top_rows, bottom_rows, row_weights),
+                (left_cols, right_cols, col_weights))
+
+    def crop_map(self, index_map, column, row, width, height):
+        src_width, src_height, row_map, col_map = index_map
+        rows = slice(row, row + height)
+        columns = slice(column, column + width)
+        top_rows, bottom_rows, row_weights = row_map
+        left_cols, right_cols, col_weights = col_map
+        return (src_width, src_height,
+                (top_rows[rows], bottom_rows[rows], row_weights[rows]),
+                (left_cols[columns], right_cols[columns],
+                 col_weights[:, columns]))
+
+    def resample(self, src, index_map, tile):
+        src_width, src_height, row_map, col_map = index_map
+        top_rows, bottom_rows, row_weights = row_map
+        left_cols, right_cols, col_weights = col_map
+
+        # Interpolating every ARGB channel separately
+        channels = src.view(numpy.uint8).reshape(src_height, src_width, 4)
+        rows = (channels[top_rows] * (256 - row_weights) +
+                channels[bottom_rows] * row_weights)
+        result = (rows[:, left_cols] * (256 - col_weights) +
+                  rows[:, right_cols] * col_weights)
+        result += 1 << 15
+        result >>= 16
+        tile[...] = result.astype(numpy.uint8).view(numpy.int32)[..., 0]
+
+
+SCALERS = {
+    'cairo': CairoScaler,
+    'nearest': NearestScaler,
+    'bilinear': BilinearScaler,
+}
+
+
+def scaler_factory(name, surface, data, context):
+    scaler_class = SCALERS[name]
+    return scaler_class(surface, data, context)
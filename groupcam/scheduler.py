@@ -0,0 +1,119 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from groupcam import metrics
+from groupcam.core import get_child_logger
+
+
+class RenderScheduler:
+    """Composites cameras at a fixed output rate.
+
+    Incoming frames only mark cameras dirty, the scheduler thread renders
+    every dirty camera at most once per output tick. With more than one
+    worker, dirty cameras are rendered in parallel on a thread pool; cairo
+    and NumPy release the GIL while filling, painting and copying pixels.
+    """
+
+    def __init__(self, fps, workers=1, clock=time.monotonic):
+        """@param fps: output ticks per second
+        @param workers: number of cameras rendered at once
+        @param clock: monotonic clock the ticks are scheduled on
+        """
+
+        self._interval = 1. / fps
+        self._clock = clock
+        self._cameras = ()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._logger = get_child_logger('scheduler')
+        if workers > 1:
+            self._executor = ThreadPoolExecutor(workers)
+        else:
+            self._executor = None
+        self._rendering = set()
+        self._rendering_lock = threading.Lock()
+        self.ticks = 0
+        self.ticks_dropped = 0
+        self.renders_deferred = 0
+        metrics.SCHEDULER_TICKS.track([], self, 'ticks')
+        metrics.TICKS_DROPPED.track([], self, 'ticks_dropped')
+        metrics.RENDERS_DEFERRED.track([], self, 'renders_deferred')
+
+    def add(self, camera):
+        self._cameras = self._cameras + (camera,)
+
+    def remove(self, camera):
+        self._cameras = tuple(item for item in self._cameras
+                              if item is not camera)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def tick(self):
+        """Renders all the cameras changed since the previous tick.
+        """
+
+        self.ticks += 1
+        if self._executor is None:
+            for camera in self._cameras:
+                self._render(camera)
+            return
+
+        for camera in self._cameras:
+            if not camera.dirty:
+                continue
+            with self._rendering_lock:
+                if camera in self._rendering:
+                    # Renders of the same camera must never overlap, it
+                    # stays dirty until the next tick
+                    self.renders_deferred += 1
+                    continue
+                self._rendering.add(camera)
+            self._executor.submit(self._render_in_pool, camera)
+
+    @property
+    def stats(self):
+        return dict(ticks=self.ticks, ticks_dropped=self.ticks_dropped,
+                    renders_deferred=self.renders_deferred)
+
+    def _render(self, camera):
+        try:
+            camera.render_if_dirty()
+        except Exception:
+            self._logger.exception("Unable to render camera")
+
+    def _render_in_pool(self, camera):
+        try:
+            self._render(camera)
+        finally:
+            with self._rendering_lock:
+                self._rendering.discard(camera)
+
+    def _tick_at(self, deadline):
+        # Runs the tick due at the deadline, returns the next deadline and
+        # the current time
+        self.tick()
+        deadline += self._interval
+        now = self._clock()
+        if now > deadline:
+            # Composition took longer than the output interval, skipping
+            # the ticks we are late for
+            missed = int((now - deadline) / self._interval) + 1
+            self.ticks_dropped += missed
+            deadline += missed * self._interval
+            self._logger.debug("Dropped {} ticks".format(missed))
+        return deadline, now
+
+    def _run(self):
+        deadline = self._clock()
+        while not self._stopped.is_set():
+            deadline, now = self._tick_at(deadline)
+            self._stopped.wait(deadline - now)
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
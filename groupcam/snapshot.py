@@ -0,0 +1,240 @@
+"""Composited camera frames for HTTP viewers.
+
+A camera copies its frame into its FrameCache only while someone is
+watching. Each frame is downscaled and encoded at most once per format
+and width, on a shared encoder thread pool, and the result is shared by
+all the viewers until the next frame is rendered.
+"""
+
+import io
+import threading
+from time import monotonic
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy
+import cairo
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from groupcam.conf import config
+
+
+# Seconds a snapshot request keeps the frames coming
+SNAPSHOT_INTEREST = 10.
+
+# Threads encoding frames for all the cameras
+ENCODER_THREADS = 2
+
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+}
+
+_executor = ThreadPoolExecutor(ENCODER_THREADS)
+
+
+def _downscale(pixels, width, height, scaled_width):
+    """@return: (pixels, height) of the frame scaled to the width
+    """
+
+    scaled_height = max(1, height * scaled_width // width)
+    source = cairo.ImageSurface.create_for_data(
+        pixels, cairo.FORMAT_RGB24, width, height, width * 4)
+    scaled_pixels = numpy.empty(scaled_width * scaled_height * 4,
+                                dtype=numpy.uint8)
+    surface = cairo.ImageSurface.create_for_data(
+        scaled_pixels, cairo.FORMAT_RGB24, scaled_width, scaled_height,
+        scaled_width * 4)
+    context = cairo.Context(surface)
+    context.scale(scaled_width / width, scaled_height / height)
+    context.set_source_surface(source)
+    context.paint()
+    surface.finish()
+    source.finish()
+    return scaled_pixels, scaled_height
+
+
+def _encode_png(pixels, width, height):
+    surface = cairo.ImageSurface.create_for_data(
+        pixels, cairo.FORMAT_RGB24, width, height, width * 4)
+    output = io.BytesIO()
+    surface.write_to_png(output)
+    surface.finish()
+    return output.getvalue()
+
+
+def _encode_jpeg(pixels, width, height):
+    image = Image.frombuffer('RGB', (width, height), pixels,
+                             'raw', 'BGRX', 0, 1)
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=config['camera']['snapshot_quality'])
+    return output.getvalue()
+
+
+def get_encoders():
+    """@return: {extension: encoder} of the available formats, JPEG
+    requires Pillow
+    """
+
+    encoders = dict(png=_encode_png)
+    if Image is not None:
+        encoders['jpg'] = _encode_jpeg
+    return encoders
+
+
+def get_stream_format():
+    return 'jpg' if Image is not None else 'png'
+
+
+class FrameCache:
+    """Latest frame of a camera, encoded on demand.
+    """
+
+    def __init__(self, width, height, request_frame):
+        """@param request_frame: function making the camera render
+        another frame
+        """
+
+        self.width = width
+        self.height = height
+        self._request_frame = request_frame
+        self._lock = threading.Lock()
+        self._pixels = None
+        self._encoded = {}
+        self._pending = {}
+        self._listeners = set()
+        self._interested_until = 0.
+        self.sequence = 0
+        self.frames_published = 0
+        self.frames_encoded = 0
+        # Frames stream viewers missed while sending the previous ones
+        self.frames_skipped = 0
+
+    @property
+    def wanted(self):
+        """True if the rendered frames have to be published.
+        """
+        return bool(self._listeners) or monotonic() < self._interested_until
+
+    def publish(self, data):
+        """Stores a copy of the rendered frame, called by the camera while
+        the frame's buffer is not reused yet.
+        """
+
+        pixels = numpy.copy(data)
+        with self._lock:
+            self._pixels = pixels
+            self.sequence += 1
+            self.frames_published += 1
+            # Requests waiting for a frame are served with this one
+            self._encoded, self._pending = self._pending, {}
+            pending = list(self._encoded.items())
+            listeners = list(self._listeners)
+
+        for key, future in pending:
+            self._encode(key, future)
+        for listener in listeners:
+            listener(self.sequence)
+
+    def get(self, extension, width=None):
+        """Returns the latest frame encoded.
+
+        @param extension: one of the get_encoders() keys
+        @param width: width to downscale the frame to, see preview_width,
+        None for the full frame
+        @return: Future resolving to (sequence, encoded bytes) once the
+        frame is encoded, or the next frame if there is none yet
+        """
+
+        key = extension, width
+        with self._lock:
+            if not self.wanted:
+                # The frames rendered meanwhile haven't been published
+                self._pixels = None
+                self._encoded = {}
+            self._interested_until = monotonic() + SNAPSHOT_INTEREST
+            future = self._encoded.get(key) or self._pending.get(key)
+            if future is not None:
+                return future
+
+            future = Future()
+            waiting = self._pixels is None
+            if waiting:
+                self._pending[key] = future
+            else:
+                self._encoded[key] = future
+
+        if waiting:
+            self._request_frame()
+        else:
+            self._encode(key, future)
+        return future
+
+    def preview_width(self, requested):
+        """Snaps the requested width to the configured preview widths, so
+        that the viewers share the downscaled frames.
+
+        @return: width to pass to get, None for the full frame
+        """
+
+        widths = sorted(config['camera']['preview_widths'])
+        fitting = [width for width in widths if width <= requested]
+        width = fitting[-1] if fitting else widths[0]
+        return width if width < self.width else None
+
+    def add_listener(self, listener):
+        """@param listener: called with the sequence number of every new
+        frame, from the rendering thread, and with None once the stream
+        is closed
+        """
+
+        with self._lock:
+            self._listeners.add(listener)
+        self._request_frame()
+
+    def remove_listener(self, listener):
+        with self._lock:
+            self._listeners.discard(listener)
+
+    def close_streams(self):
+        """Ends the streams of all the viewers when the camera is removed
+        or reconfigured, the frames encoded so far are dropped.
+        """
+
+        with self._lock:
+            listeners, self._listeners = list(self._listeners), set()
+            self._pixels = None
+            self._encoded = {}
+        for listener in listeners:
+            listener(None)
+
+    @property
+    def stats(self):
+        return dict(sequence=self.sequence,
+                    frames_published=self.frames_published,
+                    frames_encoded=self.frames_encoded,
+                    frames_skipped=self.frames_skipped,
+                    listeners=len(self._listeners))
+
+    def _encode(self, key, future):
+        with self._lock:
+            sequence, pixels = self.sequence, self._pixels
+        _executor.submit(self._run_encoder, key, future, sequence, pixels)
+
+    def _run_encoder(self, key, future, sequence, pixels):
+        extension, width = key
+        try:
+            if width is None:
+                width, height = self.width, self.height
+            else:
+                pixels, height = _downscale(pixels, self.width,
+                                            self.height, width)
+            encoded = get_encoders()[extension](pixels, width, height)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            self.frames_encoded += 1
+            future.set_result((sequence, encoded))
@@ -0,0 +1,120 @@
+import time
+
+from groupcam.conf import config, load_config
+from groupcam.camera import Camera
+from groupcam.device import FileDevice
+from groupcam.preset import AutoPreset, Static3x3Preset
+from groupcam.bench.synthetic import SyntheticUser
+
+
+class TestPresetSwitch:
+    def setup_method(self, method):
+        load_config()
+        config['camera'].update(width=64, height=48)
+        self.presets = [dict(name="Auto", type='auto', layout={},
+                             active=True),
+                        dict(name="Grid", type='3x3', layout={},
+                             active=False)]
+        camera = dict(id='test', title="Test", presets=self.presets)
+        self.camera = Camera(camera, FileDevice('/dev/null', 64, 48))
+        self.camera.add_user(SyntheticUser(8, 6))
+        self.render()
+
+    def render(self):
+        while self.camera.dirty and not self.camera.render_if_dirty():
+            pass
+
+    def switches(self):
+        return sum(self.camera._preset_switch_time.counts)
+
+    def test_switch_on_next_frame(self):
+        self.camera.activate_preset(self.presets[1])
+        assert isinstance(self.camera._preset, AutoPreset)
+        assert self.camera.dirty
+        self.render()
+        assert isinstance(self.camera._preset, Static3x3Preset)
+        assert self.switches() == 1
+
+    def test_update_presets(self):
+        presets = [dict(self.presets[0], active=False),
+                   dict(self.presets[1], active=True)]
+        self.camera.update_presets(presets)
+        self.render()
+        assert isinstance(self.camera._preset, Static3x3Preset)
+        assert self.switches() == 1
+
+    def test_update_inactive_preset(self):
+        presets = [self.presets[0], dict(self.presets[1], name="Renamed")]
+        self.camera.update_presets(presets)
+        assert not self.camera.dirty
+        self.render()
+        assert self.switches() == 0
+
+
+class TestDirtyTiles:
+    def setup_method(self, method):
+        load_config()
+        config['camera'].update(width=64, height=48, scaler='nearest')
+        camera = dict(id='test', title="Test", presets=[])
+        self.camera = Camera(camera, FileDevice('/dev/null', 64, 48))
+        self.users = [SyntheticUser(8, 6), SyntheticUser(8, 6)]
+        for user in self.users:
+            self.camera.add_user(user)
+            self.camera.update_if_has_user(user.user_id)
+        self.drawn = []
+        draw_user = self.camera._draw_user
+
+        def record_user(user, display_rect):
+            self.drawn.append(user.user_id)
+            draw_user(user, display_rect)
+        self.camera._draw_user = record_user
+        self.render()
+
+    def teardown_method(self, method):
+        self.camera.close()
+
+    def render(self):
+        self.drawn = []
+        while self.camera.dirty and not self.camera.render_if_dirty():
+            pass
+        # Once written, the buffer is the first one acquired again, so
+        # every render goes into the same canvas
+        writer = self.camera._output
+        while writer._pending is not None or writer._writing is not None:
+            time.sleep(.001)
+
+    def get_tile(self, user):
+        rects = self.camera._preset.get_user_display_rects(self.users)
+        left, top, width, height = (int(round(value)) for value
+                                    in dict(rects)[user])
+        pixels = self.camera._canvas.data.reshape(48, 64)
+        return pixels[top:top + height, left:left + width].copy()
+
+    def test_only_dirty_tile_repainted(self):
+        first_user, second_user = self.users
+        second_tile = self.get_tile(second_user)
+        first_user.data[:] = 0x11223344
+        self.camera.update_if_has_user(first_user.user_id)
+        self.render()
+        assert self.drawn == [first_user.user_id]
+        assert (self.get_tile(first_user) == 0x11223344).any()
+        assert (self.get_tile(second_user) == second_tile).all()
+
+    def test_layout_change_repaints_all(self):
+        self.camera.remove_user(self.users[1].user_id)
+        self.render()
+        assert self.drawn == [self.users[0].user_id]
+        assert self.camera._canvas.layout == [
+            (self.users[0].user_id, self.camera._canvas.layout[0][1])]
+
+    def test_every_canvas_repainted(self):
+        first_user = self.users[0]
+        self.camera.update_if_has_user(first_user.user_id)
+        self.render()
+        # The other canvas has missed the update, so the tile is repainted
+        # there once the canvas is rendered into
+        canvas = self.camera._canvas
+        other_canvas = next(item for item in self.camera._canvases
+                            if item is not canvas)
+        assert not canvas.dirty_users
+        assert first_user.user_id in other_canvas.dirty_users
@@ -0,0 +1,150 @@
+from types import SimpleNamespace
+
+from groupcam import tt4
+from groupcam.conf import config, load_config
+from groupcam.core import options
+from groupcam.client import SourceClient
+from groupcam.tt4 import Message, consts
+from groupcam.tt4.client import BaseClient
+from groupcam.tt4.stub import Script, StubLibrary
+
+
+def create_camera(camera_id, regexp):
+    return dict(id=camera_id, title=camera_id, nickname=camera_id,
+                regexp=regexp, device='/dev/null', presets=[])
+
+
+SERVER_CONFIG = dict(host='localhost', tcp_port=10333, udp_port=10333,
+                     nickname='Test', server_password='', user_name='',
+                     user_password='')
+
+
+class RecordingClient(BaseClient):
+    def __init__(self, server_config):
+        super().__init__(server_config)
+        self.handled = []
+
+    def on_user_video_frame(self, message):
+        self.handled.append(message)
+
+    def on_command_user_joined(self, message):
+        self.handled.append(message)
+
+
+def frame_message(user_id, count=1):
+    return Message(consts.WM_TEAMTALK_USER_VIDEOFRAME, user_id, 1, count)
+
+
+class TestBaseClientMessages:
+    def setup_method(self, method):
+        options.debug = False
+        self.library = StubLibrary(Script(users=0))
+        tt4.use_library(self.library)
+        self.client = RecordingClient(SERVER_CONFIG)
+
+    def teardown_method(self, method):
+        self.client.stop()
+        self.client.disconnect()
+        self.library.stop()
+        tt4.use_library(None)
+
+    def test_dispatch_table(self):
+        table = RecordingClient.get_dispatch_table()
+        assert RecordingClient.get_dispatch_table() is table
+        assert (table[consts.WM_TEAMTALK_USER_VIDEOFRAME] is
+                RecordingClient.on_user_video_frame)
+        assert (table[consts.WM_TEAMTALK_CON_LOST] is
+                BaseClient.on_connection_lost)
+        # Every class gets its own table
+        base_table = BaseClient.get_dispatch_table()
+        assert (base_table[consts.WM_TEAMTALK_USER_VIDEOFRAME] is
+                BaseClient.on_user_video_frame)
+
+    def test_collapse_frames(self):
+        self.client.process_messages([
+            frame_message(1), frame_message(2), frame_message(1, 2)])
+        assert self.client.handled == [frame_message(1, 3),
+                                       frame_message(2)]
+        assert self.client.messages_collapsed == 1
+
+    def test_not_collapsed_across_commands(self):
+        joined = Message(consts.WM_TEAMTALK_CMD_USER_JOINED, 1, 0, 1)
+        messages = [frame_message(1), joined, frame_message(1)]
+        self.client.process_messages(messages)
+        assert self.client.handled == messages
+        assert self.client.messages_collapsed == 0
+
+
+class TestSourceClientCameras:
+    def setup_method(self, method):
+        options.debug = False
+        load_config()
+        config['camera'].update(width=64, height=48, device_type='file')
+        self.library = StubLibrary(Script(users=4, join_rate=1000.,
+                                          fps=1., frame_size=(8, 4)))
+        tt4.use_library(self.library)
+        self.client = SourceClient([create_camera('a', r'^user[01]$')])
+        for index in range(100):
+            if len(self.client._users) == 4:
+                break
+            messages = self.client.poll_messages(100)
+            self.client.process_messages(messages)
+        assert len(self.client._users) == 4
+
+    def teardown_method(self, method):
+        self.client.stop()
+        self.client.disconnect()
+        self.library.stop()
+        tt4.use_library(None)
+
+    def get_nicknames(self, camera_id):
+        user_ids = self.client.get_compositor(camera_id)._users
+        nicknames = self.client._routing._nicknames
+        return sorted(nicknames[user_id] for user_id in user_ids)
+
+    def get_user_id(self, nickname):
+        nicknames = self.client._routing._nicknames
+        return next(user_id for user_id, value in nicknames.items()
+                    if value == nickname)
+
+    def test_add_camera(self):
+        self.client.add_camera(create_camera('b', r'^user[23]$'))
+        assert self.get_nicknames('a') == ['user0', 'user1']
+        assert self.get_nicknames('b') == ['user2', 'user3']
+
+    def test_update_camera(self):
+        camera = create_camera('a', r'^user[12]$')
+        self.client.update_camera(camera)
+        assert self.get_nicknames('a') == ['user1', 'user2']
+
+    def test_remove_camera(self):
+        compositor = self.client.get_compositor('a')
+        self.client.remove_camera('a')
+        assert self.client.get_compositor('a') is None
+        assert compositor._closed
+        assert all(not self.client._routing.get_cameras(user_id)
+                   for user_id in self.client._users)
+
+    def test_user_left_and_joined(self):
+        message = SimpleNamespace(first_param=self.get_user_id('user0'))
+        self.client.on_command_user_left(message)
+        assert self.get_nicknames('a') == ['user1']
+        self.client.on_command_user_joined(message)
+        assert self.get_nicknames('a') == ['user0', 'user1']
+
+    def test_user_left_stays_routed(self):
+        user_id = self.get_user_id('user0')
+        compositor = self.client.get_compositor('a')
+        message = SimpleNamespace(first_param=user_id)
+        self.client.on_command_user_left(message)
+        # Frames are routed to the camera again as soon as they rejoin
+        assert self.client._routing.get_cameras(user_id) == (compositor,)
+        self.client.on_command_user_joined(message)
+        assert self.client._routing.get_cameras(user_id) == (compositor,)
+
+    def test_user_logged_out(self):
+        user_id = self.get_user_id('user0')
+        message = SimpleNamespace(first_param=user_id)
+        self.client.on_command_user_logged_out(message)
+        assert user_id not in self.client._users
+        assert self.get_nicknames('a') == ['user1']
@@ -0,0 +1,60 @@
+from multiprocessing import shared_memory
+
+from groupcam.conf import config, load_config
+from groupcam.compositor import SharedCamera, SharedUser, _close_retired
+from groupcam.device import FileDevice
+
+
+class TestSharedCamera:
+    def setup_method(self, method):
+        load_config()
+        config['camera'].update(width=64, height=48)
+        self.shm = shared_memory.SharedMemory(create=True,
+                                              size=(8 * 6 + 1) * 4)
+        self.user = SharedUser(1, None, self.shm.name, 8, 6)
+        camera = dict(id='test', title="Test", presets=[])
+        self.camera = SharedCamera(camera, FileDevice('/dev/null', 64, 48))
+        self.camera.add_user(self.user)
+
+    def teardown_method(self, method):
+        self.camera.close()
+        self.user.close()
+        self.shm.close()
+        self.shm.unlink()
+
+    def set_sequence(self, sequence):
+        self.shm.buf[8 * 6 * 4:] = sequence.to_bytes(4, 'little')
+
+    def render(self):
+        self.camera.update_if_has_user(1)
+        assert self.camera.render_if_dirty()
+
+    def test_consistent_frame(self):
+        self.set_sequence(2)
+        self.render()
+        assert not self.camera.dirty
+        assert self.camera.frames_torn == 0
+
+    def test_torn_frame_redrawn(self):
+        # Being written by the source process
+        self.set_sequence(3)
+        self.render()
+        assert self.camera.dirty
+        assert self.camera.frames_torn == 1
+
+
+class FakeUser:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class TestCloseRetired:
+    def test_closed_after_render(self):
+        users = [FakeUser(), FakeUser()]
+        retired = [(users[0], 1), (users[1], 2)]
+        retired = _close_retired(retired, 2)
+        assert users[0].closed
+        assert not users[1].closed
+        assert retired == [(users[1], 2)]
@@ -0,0 +1,227 @@
+import mmap
+import errno
+import threading
+import time
+
+import v4l2
+
+from groupcam import metrics
+from groupcam.camera import Camera
+from groupcam.conf import config, load_config
+from groupcam.device import (DeviceWriter, StreamingOutput,
+                             output_factory)
+
+
+class FakeDevice:
+    """Mimics the output side of a v4l2 driver with mmap streaming.
+    """
+
+    name = '/dev/video-fake'
+    width = 8
+    height = 4
+
+    def __init__(self, streaming=True):
+        self.capability = v4l2.v4l2_capability()
+        if streaming:
+            self.capability.capabilities = v4l2.V4L2_CAP_STREAMING
+        self.queued = []
+        self.done = []
+        self.streaming = False
+        self.blocking = True
+        self.maps = {}
+        # Error number the buffers fail to dequeue with
+        self.error = None
+
+    def ioctl(self, request, arg):
+        if request == v4l2.VIDIOC_REQBUFS:
+            self.maps = {index: mmap.mmap(-1, self.width * self.height * 4)
+                         for index in range(arg.count)}
+        elif request == v4l2.VIDIOC_QUERYBUF:
+            arg.length = len(self.maps[arg.index])
+            arg.m.offset = arg.index * 4096
+        elif request == v4l2.VIDIOC_QBUF:
+            assert arg.bytesused == self.width * self.height * 4
+            self.queued.append(arg.index)
+        elif request == v4l2.VIDIOC_DQBUF:
+            if self.error is not None:
+                raise OSError(self.error, "Dequeue failed")
+            if not self.done:
+                raise OSError(errno.EAGAIN, "Resource temporarily unavailable")
+            arg.index = self.done.pop(0)
+        elif request == v4l2.VIDIOC_STREAMON:
+            self.streaming = True
+        elif request == v4l2.VIDIOC_STREAMOFF:
+            self.streaming = False
+        return 0
+
+    def mmap(self, length, offset):
+        return self.maps[offset // 4096]
+
+    def set_blocking(self, blocking):
+        self.blocking = blocking
+
+    def consume(self):
+        """Makes the driver give all the queued buffers back.
+        """
+        self.done.extend(self.queued)
+        self.queued = []
+
+    def write(self, data):
+        pass
+
+    def close(self):
+        pass
+
+
+class BlockingDevice:
+    """Holds every write until released, recording the written frames.
+    """
+
+    name = '/dev/video-blocking'
+    width = 8
+    height = 4
+
+    def __init__(self):
+        self.written = []
+        self.writing = threading.Event()
+        self.released = threading.Event()
+
+    def write(self, data):
+        self.writing.set()
+        self.released.wait(5.)
+        self.written.append(int(data[0]))
+
+    def close(self):
+        pass
+
+
+class FakeLogger:
+    def __init__(self, errors):
+        self._errors = errors
+
+    def error(self, message):
+        self._errors.append(message)
+
+
+class TestStreamingOutput:
+    def test_fallback_to_write(self):
+        output = output_factory(FakeDevice(streaming=False), 'mmap', 2)
+        assert isinstance(output, DeviceWriter)
+        output.close()
+
+    def test_streaming_output(self):
+        output = output_factory(FakeDevice(), 'mmap', 2)
+        assert isinstance(output, StreamingOutput)
+        assert len(output.buffers) == 2
+
+    def test_composite_into_mapped_buffer(self):
+        device = FakeDevice()
+        output = StreamingOutput(device, 2)
+        index = output.acquire()
+        output.buffers[index][:] = 0x01020304
+        output.submit(index)
+        assert device.queued == [index]
+        assert device.streaming
+        assert not device.blocking
+        assert device.maps[index][:4] == b'\x04\x03\x02\x01'
+
+    def test_defer_when_driver_holds_buffers(self):
+        device = FakeDevice()
+        output = StreamingOutput(device, 2)
+        for index in range(2):
+            output.submit(output.acquire())
+        assert output.acquire() is None
+        assert output.frames_deferred == 1
+
+        device.consume()
+        assert output.acquire() is not None
+        assert output.frames_queued == 2
+
+    def test_close(self):
+        device = FakeDevice()
+        output = StreamingOutput(device, 2)
+        output.submit(output.acquire())
+        output.close()
+        assert not device.streaming
+        assert all(memory.closed for memory in device.maps.values())
+        assert ('groupcam_device_write_seconds_count{{device="{}"}}'.format(
+            device.name) not in metrics.registry.render())
+
+    def test_camera_close(self):
+        load_config()
+        config['camera'].update(width=8, height=4, output='mmap')
+        device = FakeDevice()
+        camera = Camera(dict(id='test', title="Test", presets=[]), device)
+        assert camera.render_if_dirty()
+        # The canvases are dropped, so the buffers can be unmapped
+        camera.close()
+        assert all(memory.closed for memory in device.maps.values())
+
+    def test_dequeue_error_logged_once(self):
+        device = FakeDevice()
+        output = StreamingOutput(device, 2)
+        errors = []
+        output._logger = FakeLogger(errors)
+        for index in range(2):
+            output.submit(output.acquire())
+
+        device.error = errno.EIO
+        for index in range(3):
+            assert output.acquire() is None
+        assert len(errors) == 1
+        # Logged again if the error comes back after a recovery
+        device.error = None
+        device.consume()
+        assert output.acquire() is not None
+        device.error = errno.EIO
+        assert output.acquire() is None
+        assert len(errors) == 2
+
+
+class TestDeviceWriter:
+    def setup_method(self, method):
+        self.device = BlockingDevice()
+        self.writer = DeviceWriter(self.device, 3)
+
+    def teardown_method(self, method):
+        self.device.released.set()
+        self.writer.close()
+
+    def submit(self, value):
+        index = self.writer.acquire()
+        self.writer.buffers[index][:] = value
+        self.writer.submit(index)
+
+    def wait_written(self, count):
+        self.device.released.set()
+        deadline = time.monotonic() + 5.
+        while (self.writer.frames_written < count and
+               time.monotonic() < deadline):
+            time.sleep(.001)
+
+    def start_writing(self, value):
+        self.submit(value)
+        assert self.device.writing.wait(5.)
+
+    def test_drop_oldest(self):
+        self.start_writing(1)
+        # The frame waiting for the writer is replaced by the newer one
+        self.submit(2)
+        self.submit(3)
+        assert self.writer.frames_dropped == 1
+        self.wait_written(2)
+        assert self.device.written == [1, 3]
+
+    def test_acquire_waiting_buffer(self):
+        self.start_writing(1)
+        self.submit(2)
+        assert self.writer.acquire() is not None
+        # The only buffer left is the waiting one, it is taken over by
+        # the next frame
+        index = self.writer.acquire()
+        assert index is not None
+        assert self.writer.frames_dropped == 1
+        self.writer.buffers[index][:] = 3
+        self.writer.submit(index)
+        self.wait_written(2)
+        assert self.device.written == [1, 3]
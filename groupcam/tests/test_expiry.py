@@ -0,0 +1,42 @@
+import time
+import threading
+
+from groupcam.expiry import ExpiryHeap
+
+
+class TestExpiryHeap:
+    def setup_method(self, method):
+        self.heap = ExpiryHeap()
+        self.expired = []
+        self.event = threading.Event()
+
+    def callback(self, key):
+        self.expired.append(key)
+        self.event.set()
+
+    def test_expire(self):
+        self.heap.touch('user', 0.05, self.callback)
+        assert self.event.wait(1.)
+        assert self.expired == ['user']
+        assert len(self.heap) == 0
+
+    def test_touch_postpones_expiry(self):
+        started = time.monotonic()
+        self.heap.touch('user', 0.1, self.callback)
+        time.sleep(0.05)
+        self.heap.touch('user', 0.1, self.callback)
+        assert self.event.wait(1.)
+        assert time.monotonic() - started >= 0.15
+        assert self.expired == ['user']
+
+    def test_earlier_deadline_wakes_up_thread(self):
+        self.heap.touch('late', 10., self.callback)
+        self.heap.touch('early', 0.05, self.callback)
+        assert self.event.wait(1.)
+        assert self.expired == ['early']
+
+    def test_discard(self):
+        self.heap.touch('user', 0.05, self.callback)
+        self.heap.discard('user')
+        assert not self.event.wait(0.2)
+        assert self.expired == []
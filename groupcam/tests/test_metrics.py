@@ -0,0 +1,42 @@
+from groupcam.metrics import Counter, Histogram, Registry
+
+
+class Source:
+    def __init__(self):
+        self.frames = 0
+
+
+class TestMetrics:
+    def setup_method(self, method):
+        self.registry = Registry()
+        self.histogram = self.registry.register(Histogram(
+            'test_seconds', "Test timings", ['camera'], buckets=[.1, 1.]))
+        self.counter = self.registry.register(Counter(
+            'test_frames_total', "Test frames", ['camera']))
+
+    def test_histogram(self):
+        child = self.histogram.child('cam"1')
+        for value in (.05, .5, .5, 5.):
+            child.observe(value)
+        lines = self.registry.render().splitlines()
+        assert '# TYPE test_seconds histogram' in lines
+        assert 'test_seconds_bucket{camera="cam\\"1",le="0.1"} 1' in lines
+        assert 'test_seconds_bucket{camera="cam\\"1",le="1.0"} 3' in lines
+        assert 'test_seconds_bucket{camera="cam\\"1",le="+Inf"} 4' in lines
+        assert 'test_seconds_sum{camera="cam\\"1"} 6.05' in lines
+        assert 'test_seconds_count{camera="cam\\"1"} 4' in lines
+
+    def test_tracked_counter(self):
+        source = Source()
+        self.counter.track(['1'], source, 'frames')
+        source.frames = 5
+        assert 'test_frames_total{camera="1"} 5' in self.registry.render()
+        del source
+        assert 'test_frames_total{' not in self.registry.render()
+
+    def test_release_replaced_child(self):
+        old_child = self.histogram.child('1')
+        new_child = self.histogram.child('1')
+        self.histogram.release(old_child, '1')
+        new_child.observe(.5)
+        assert 'test_seconds_count{camera="1"} 1' in self.registry.render()
@@ -0,0 +1,145 @@
+import time
+import queue
+import threading
+
+from groupcam.tt4.poller import PASS_WAIT_MS, ClientPoller
+
+
+class FakeIOLoop:
+    def __init__(self):
+        self.callbacks = queue.Queue()
+
+    def add_callback(self, callback, *args):
+        self.callbacks.put((callback, args))
+
+    def run_callback(self, timeout=5.):
+        callback, args = self.callbacks.get(timeout=timeout)
+        callback(*args)
+
+
+class FakeClient:
+    def __init__(self, messages=(), ready=True):
+        self.pending = list(messages)
+        self.processed = []
+        self.ready = ready
+        self.started = False
+        self.stopped = False
+        self.polled = threading.Event()
+        self.waits = []
+        # Name of the thread the client has been disconnected from
+        self.disconnected = None
+
+    def stop(self):
+        self.stopped = True
+
+    def disconnect(self):
+        self.disconnected = threading.current_thread().name
+
+    def start(self):
+        self.started = True
+
+    def is_ready(self):
+        return self.ready
+
+    def poll_messages(self, wait_ms=-1):
+        assert wait_ms >= 0
+        self.waits.append(wait_ms)
+        self.polled.set()
+        messages, self.pending = self.pending[:2], self.pending[2:]
+        if not messages:
+            time.sleep(wait_ms / 1000.)
+        return messages
+
+    def process_messages(self, messages):
+        self.processed.extend(messages)
+
+
+class TestClientPoller:
+    def setup_method(self, method):
+        self.io_loop = FakeIOLoop()
+        self.poller = ClientPoller(2, self.io_loop)
+        self.threads = threading.active_count()
+
+    def teardown_method(self, method):
+        self.poller.stop(5.)
+
+    def test_dispatch(self):
+        client = FakeClient([1, 2, 3])
+        self.poller.add(client)
+        self.poller.start()
+        assert client.started
+        self.io_loop.run_callback()
+        assert client.processed == [1, 2]
+        self.io_loop.run_callback()
+        assert client.processed == [1, 2, 3]
+        assert self.poller.stats['batches_dispatched'] == 2
+
+    def test_one_batch_at_a_time(self):
+        client = FakeClient([1, 2, 3])
+        self.poller.add(client)
+        self.poller.start()
+        callback, args = self.io_loop.callbacks.get(timeout=5.)
+        threading.Event().wait(.05)
+        # Not polled again before the batch is handled
+        assert self.io_loop.callbacks.empty()
+        assert client.pending == [3]
+        callback(*args)
+        self.io_loop.run_callback()
+        assert client.processed == [1, 2, 3]
+
+    def test_not_ready(self):
+        client = FakeClient([1], ready=False)
+        self.poller.add(client)
+        self.poller.start()
+        threading.Event().wait(.05)
+        assert not client.polled.is_set()
+        client.ready = True
+        self.io_loop.run_callback()
+        assert client.processed == [1]
+
+    def test_fixed_threads(self):
+        self.poller.start()
+        clients = [FakeClient() for index in range(20)]
+        for client in clients:
+            self.poller.add(client)
+        assert threading.active_count() == self.threads + 2
+        assert self.poller.stats['clients'] == 20
+        self.poller.remove(clients[0])
+        assert self.poller.stats['clients'] == 19
+
+        self.poller.stop(5.)
+        assert threading.active_count() == self.threads
+
+    def test_blocking_wait(self):
+        clients = [FakeClient() for index in range(2)]
+        self.poller = ClientPoller(1, self.io_loop)
+        for client in clients:
+            self.poller.add(client)
+        self.poller.start()
+        for client in clients:
+            assert client.polled.wait(5.)
+        self.poller.stop(5.)
+        # The idle clients share the wait of a pass
+        for client in clients:
+            assert client.waits[0] == PASS_WAIT_MS // 2
+
+    def test_stop_client(self):
+        client = FakeClient()
+        self.poller.add(client)
+        self.poller.start()
+        assert client.polled.wait(5.)
+        client.stop()
+        for index in range(500):
+            if client.disconnected is not None:
+                break
+            time.sleep(.01)
+        assert client.disconnected.startswith('poller/')
+        assert self.poller.stats['clients'] == 0
+
+    def test_disconnect_on_stop(self):
+        client = FakeClient()
+        self.poller.add(client)
+        self.poller.start()
+        assert client.polled.wait(5.)
+        self.poller.stop(5.)
+        assert client.disconnected.startswith('poller/')
@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import threading
+
+from groupcam.pool import DevicePool, parse_intervals
+
+
+class TestDevicePool:
+    def setup_method(self, method):
+        self.directory = tempfile.mkdtemp()
+        for number in (1, 2, 3, 7):
+            self.create(number)
+        self.pool = DevicePool(self.path('{number}'), '2-5, 7-')
+
+    def teardown_method(self, method):
+        self.pool.stop()
+        shutil.rmtree(self.directory)
+
+    def path(self, number):
+        return os.path.join(self.directory, 'video{}'.format(number))
+
+    def create(self, number):
+        open(self.path(number), 'w').close()
+
+    def test_parse_intervals(self):
+        assert parse_intervals('1-3, 5, 10-') == [(1, 3), (5, 5),
+                                                  (10, None)]
+        assert parse_intervals('-2') == [(0, 2)]
+
+    def test_allocate(self):
+        self.pool.start([self.path(2)])
+        assert self.pool.allocate() == self.path(3)
+        assert self.pool.allocate() == self.path(7)
+        assert self.pool.allocate() is None
+
+    def test_release(self):
+        self.pool.start()
+        device = self.pool.allocate()
+        self.pool.release(device)
+        assert self.pool.allocate() == device
+
+    def test_is_ready(self):
+        self.pool.start()
+        assert self.pool.is_ready(self.path(2))
+        assert not self.pool.is_ready(self.path(9))
+
+    def test_device_appears(self):
+        self.pool.start()
+        waiter = threading.Thread(target=self.create, args=[9])
+        threading.Timer(.05, waiter.start).start()
+        assert self.pool.wait_ready(self.path(9), 5.)
+        assert [self.pool.allocate() for index in range(4)] == [
+            self.path(2), self.path(3), self.path(7), self.path(9)]
+
+    def test_device_disappears(self):
+        self.pool.start()
+        os.remove(self.path(2))
+        assert self.pool.wait_ready(self.path(3), 5.)
+        for index in range(50):
+            if self.pool.stats['ready'] == 2:
+                break
+            threading.Event().wait(.1)
+        assert self.pool.allocate() == self.path(3)
+
+    def test_wait_timeout(self):
+        self.pool.start()
+        assert not self.pool.wait_ready(self.path(4), .1)
@@ -0,0 +1,70 @@
+from types import SimpleNamespace
+
+from groupcam.preset import AutoPreset
+
+
+class FakeCamera:
+    width = display_width = 64
+    height = 48
+    title_height = 0
+    display_height = 48
+    padding = 0
+    aspect_ratio = 64 / 48
+
+    @property
+    def geometry(self):
+        return (self.width, self.height, self.title_height, self.padding)
+
+
+class CountingPreset(AutoPreset):
+    calculations = 0
+
+    def calculate_display_rects(self, users):
+        self.calculations += 1
+        return super().calculate_display_rects(users)
+
+
+def create_users(*user_ids):
+    return [SimpleNamespace(user_id=user_id) for user_id in user_ids]
+
+
+class TestPresetMemo:
+    def setup_method(self, method):
+        self.camera = FakeCamera()
+        self.preset = CountingPreset(self.camera, {})
+
+    def test_hit(self):
+        users = create_users(1, 2)
+        first = self.preset.get_user_display_rects(users)
+        second = self.preset.get_user_display_rects(users)
+        assert first == second
+        assert self.preset.calculations == 1
+
+    def test_miss_on_users(self):
+        self.preset.get_user_display_rects(create_users(1, 2))
+        display_rects = self.preset.get_user_display_rects(
+            create_users(1, 2, 3))
+        assert len(display_rects) == 3
+        assert self.preset.calculations == 2
+
+    def test_miss_on_geometry(self):
+        users = create_users(1, 2)
+        self.preset.get_user_display_rects(users)
+        self.camera.padding = 2
+        self.preset.get_user_display_rects(users)
+        assert self.preset.calculations == 2
+
+    def test_invalidate(self):
+        users = create_users(1, 2)
+        self.preset.get_user_display_rects(users)
+        self.preset.invalidate()
+        self.preset.get_user_display_rects(users)
+        assert self.preset.calculations == 2
+
+    def test_replaced_users(self):
+        self.preset.get_user_display_rects(create_users(1, 2))
+        users = create_users(1, 2)
+        display_rects = self.preset.get_user_display_rects(users)
+        assert self.preset.calculations == 1
+        assert all(cached is user for (cached, display_rect), user
+                   in zip(display_rects, users))
@@ -0,0 +1,44 @@
+from groupcam.routing import RoutingIndex
+
+
+class TestRoutingIndex:
+    def setup_method(self, method):
+        self.index = RoutingIndex()
+        self.index.add_camera(1, 'camera1', r'^alice')
+        self.index.add_camera(2, 'camera2', r'.*{')
+
+    def test_route_user(self):
+        assert self.index.add_user(10, 'Alice {A}') == ('camera1', 'camera2')
+        assert self.index.add_user(11, 'bob') == ()
+        assert self.index.get_cameras(10) == ('camera1', 'camera2')
+        assert self.index.get_cameras(11) == ()
+
+    def test_matches_are_cached_per_nickname(self):
+        self.index.add_user(10, 'alice')
+        self.index.add_user(11, 'alice')
+        assert self.index.stats['nicknames_cached'] == 1
+        assert self.index.get_cameras(11) == ('camera1',)
+
+    def test_add_camera(self):
+        self.index.add_user(10, 'bob')
+        assert self.index.add_camera(3, 'camera3', r'bob') == [10]
+        assert self.index.get_cameras(10) == ('camera3',)
+
+    def test_update_camera(self):
+        self.index.add_user(10, 'alice')
+        self.index.add_user(11, 'bob')
+        added, removed = self.index.update_camera(1, r'bob')
+        assert added == [11]
+        assert removed == [10]
+        assert self.index.get_cameras(10) == ()
+        assert self.index.get_cameras(11) == ('camera1',)
+
+    def test_remove_camera(self):
+        self.index.add_user(10, 'alice {A}')
+        assert self.index.remove_camera(1) == [10]
+        assert self.index.get_cameras(10) == ('camera2',)
+
+    def test_remove_user(self):
+        self.index.add_user(10, 'alice')
+        self.index.remove_user(10)
+        assert self.index.get_cameras(10) == ()
@@ -0,0 +1,63 @@
+import numpy
+
+from groupcam.scaler import BilinearScaler, CairoScaler, NearestScaler
+from groupcam.bench.synthetic import SyntheticUser, create_canvas
+
+
+# Scaling factor, odd so that the middle of every source pixel falls on
+# the middle of a canvas pixel
+SCALE = 11
+
+
+def create_user():
+    # Opaque pixels, all the channels differing between the neighbours
+    user = SyntheticUser(4, 3)
+    values = numpy.arange(12, dtype=numpy.uint32) * 0x152a3f + 0xff000000
+    user.data[:] = values.view(numpy.int32)
+    return user
+
+
+def draw(scaler_class, user, display_rect, width, height):
+    data, surface, context = create_canvas(width, height)
+    scaler_class(surface, data, context).draw(user, display_rect)
+    surface.flush()
+    return data.reshape(height, width)
+
+
+class TestScalers:
+    def test_against_cairo(self):
+        user = create_user()
+        width, height = user.img_width * SCALE, user.img_height * SCALE
+        rect = (0, 0, width, height)
+        # Sampled at the middle of the source pixels, where nothing is
+        # interpolated
+        samples = numpy.ix_(numpy.arange(SCALE // 2, height, SCALE),
+                            numpy.arange(SCALE // 2, width, SCALE))
+        reference = draw(CairoScaler, user, rect, width, height)
+        expected = reference[samples].copy().view(numpy.uint8)
+        for scaler_class in (NearestScaler, BilinearScaler):
+            pixels = draw(scaler_class, user, rect, width, height)
+            result = pixels[samples].copy().view(numpy.uint8)
+            difference = numpy.abs(result.astype(int) - expected)
+            assert difference.max() <= 1, scaler_class.__name__
+
+    def test_clipped_tile_cropped(self):
+        user = create_user()
+        width, height = user.img_width * SCALE, user.img_height * SCALE
+        for scaler_class in (NearestScaler, BilinearScaler):
+            whole = draw(scaler_class, user, (0, 0, width, height),
+                         width, height)
+            # Sticking out by 15 pixels on the left and 5 at the bottom
+            clipped = draw(scaler_class, user, (-15, 0, width, height),
+                           width - 15, height - 5)
+            assert (clipped == whole[:height - 5, 15:]).all()
+
+    def test_map_cached(self):
+        user = create_user()
+        data, surface, context = create_canvas(40, 30)
+        scaler = NearestScaler(surface, data, context)
+        scaler.draw(user, (0, 0, 20, 15))
+        scaler.draw(user, (20, 15, 20, 15))
+        assert len(scaler._maps) == 1
+        scaler.draw(user, (30, 15, 20, 15))
+        assert len(scaler._maps) == 2
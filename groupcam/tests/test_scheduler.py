@@ -0,0 +1,155 @@
+import threading
+
+from groupcam import metrics
+from groupcam.conf import config, load_config
+from groupcam.camera import Camera
+from groupcam.device import FileDevice
+from groupcam.scheduler import RenderScheduler
+from groupcam.bench.synthetic import SyntheticUser
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+
+class SlowCamera:
+    """Takes the given time on the fake clock to render.
+    """
+
+    def __init__(self, clock, duration):
+        self.dirty = True
+        self.renders = 0
+        self._clock = clock
+        self._duration = duration
+
+    def render_if_dirty(self):
+        if not self.dirty:
+            return False
+        self.dirty = False
+        self.renders += 1
+        self._clock.now += self._duration
+        return True
+
+
+class BlockingCamera:
+    """Renders once the event is set, in the pool's threads.
+    """
+
+    def __init__(self, event=None, barrier=None):
+        self.dirty = True
+        self.renders = 0
+        self.rendered = threading.Event()
+        self._event = event
+        self._barrier = barrier
+
+    def render_if_dirty(self):
+        if self._barrier is not None:
+            self._barrier.wait(5.)
+        if self._event is not None:
+            self._event.wait(5.)
+        self.renders += 1
+        self.rendered.set()
+        return True
+
+
+class TestRenderScheduler:
+    def setup_method(self, method):
+        load_config()
+        config['camera'].update(width=64, height=48)
+        self.clock = FakeClock()
+        # Ticks every .1 second
+        self.scheduler = RenderScheduler(10, clock=self.clock)
+
+    def test_on_time(self):
+        camera = SlowCamera(self.clock, .05)
+        self.scheduler.add(camera)
+        deadline, now = self.scheduler._tick_at(0.)
+        assert (deadline, now) == (.1, .05)
+        assert self.scheduler.ticks_dropped == 0
+
+    def test_overrun(self):
+        camera = SlowCamera(self.clock, .25)
+        self.scheduler.add(camera)
+        deadline, now = self.scheduler._tick_at(0.)
+        # The ticks due at .1 and .2 are skipped
+        assert round(deadline, 6) == .3
+        assert self.scheduler.ticks_dropped == 2
+        assert camera.renders == 1
+        lines = metrics.registry.render().splitlines()
+        assert 'groupcam_scheduler_ticks_dropped_total 2' in lines
+
+    def test_render_once_per_tick(self):
+        camera = Camera(dict(id='test', title="Test", presets=[]),
+                        FileDevice('/dev/null', 64, 48))
+        user = SyntheticUser(8, 6)
+        camera.add_user(user)
+        self.scheduler.add(camera)
+        self.scheduler.tick()
+        rendered = camera.frames_rendered
+
+        for index in range(3):
+            camera.update_if_has_user(user.user_id)
+        self.scheduler.tick()
+        self.scheduler.tick()
+        assert camera.frames_rendered == rendered + 1
+        assert camera.frames_coalesced >= 2
+        camera.close()
+
+    def test_update_while_rendering(self):
+        camera = Camera(dict(id='test', title="Test", presets=[]),
+                        FileDevice('/dev/null', 64, 48))
+        user = SyntheticUser(8, 6)
+        camera.add_user(user)
+        updater = threading.Thread(target=camera.update_if_has_user,
+                                   args=(user.user_id,))
+        # The render lock doesn't hold the frames back
+        with camera._lock:
+            updater.start()
+            updater.join(5.)
+            assert not updater.is_alive()
+        camera.close()
+
+
+class TestParallelRenderScheduler:
+    def setup_method(self, method):
+        load_config()
+        self.scheduler = RenderScheduler(10, workers=2)
+
+    def teardown_method(self, method):
+        self.scheduler._executor.shutdown()
+
+    def test_concurrent(self):
+        # Both renders have to be in progress to get past the barrier
+        barrier = threading.Barrier(2)
+        cameras = [BlockingCamera(barrier=barrier) for index in range(2)]
+        for camera in cameras:
+            self.scheduler.add(camera)
+        self.scheduler.tick()
+        for camera in cameras:
+            assert camera.rendered.wait(5.)
+        assert not barrier.broken
+
+    def test_slow_camera(self):
+        released = threading.Event()
+        slow_camera, camera = BlockingCamera(released), BlockingCamera()
+        self.scheduler.add(slow_camera)
+        self.scheduler.add(camera)
+        self.scheduler.tick()
+        assert camera.rendered.wait(5.)
+
+        # The slow camera is still rendering, so it is deferred while the
+        # other one renders again
+        camera.rendered.clear()
+        self.scheduler.tick()
+        assert camera.rendered.wait(5.)
+        assert self.scheduler.renders_deferred == 1
+        assert slow_camera.renders == 0
+        lines = metrics.registry.render().splitlines()
+        assert 'groupcam_scheduler_renders_deferred_total 1' in lines
+
+        released.set()
+        assert slow_camera.rendered.wait(5.)
@@ -0,0 +1,73 @@
+import numpy
+
+from groupcam.conf import config, load_config
+from groupcam.snapshot import FrameCache
+
+
+class TestFrameCache:
+    def setup_method(self, method):
+        load_config()
+        self.requests = 0
+        self.cache = FrameCache(4, 2, self.request_frame)
+        self.frame = numpy.zeros(4 * 2 * 4, dtype=numpy.uint8)
+
+    def request_frame(self):
+        self.requests += 1
+
+    def test_not_wanted_initially(self):
+        assert not self.cache.wanted
+
+    def test_get_waits_for_frame(self):
+        future = self.cache.get('png')
+        assert self.requests == 1
+        assert not future.done()
+        assert self.cache.wanted
+        self.cache.publish(self.frame)
+        sequence, encoded = future.result(1.)
+        assert sequence == 1
+        assert encoded.startswith(b'\x89PNG')
+
+    def test_frame_encoded_once(self):
+        future = self.cache.get('png')
+        self.cache.publish(self.frame)
+        future.result(1.)
+        assert self.cache.get('png') is future
+        assert self.cache.frames_encoded == 1
+
+    def test_published_frame_is_copied(self):
+        self.cache.get('png')
+        self.cache.publish(self.frame)
+        self.frame[:] = 0xff
+        self.cache.get('png').result(1.)
+        assert self.cache._pixels.max() == 0
+
+    def test_listener(self):
+        sequences = []
+        self.cache.add_listener(sequences.append)
+        assert self.requests == 1
+        assert self.cache.wanted
+        self.cache.publish(self.frame)
+        self.cache.publish(self.frame)
+        assert sequences == [1, 2]
+        self.cache.remove_listener(sequences.append)
+        assert self.cache.stats['listeners'] == 0
+
+    def test_close_streams(self):
+        sequences = []
+        self.cache.add_listener(sequences.append)
+        self.cache.publish(self.frame)
+        self.cache.close_streams()
+        assert sequences == [1, None]
+        assert self.cache.stats['listeners'] == 0
+        assert not self.cache.wanted
+
+    def test_downscaled_frame(self):
+        config['camera']['preview_widths'] = [2, 8]
+        assert self.cache.preview_width(3) == 2
+        assert self.cache.preview_width(1) == 2
+        assert self.cache.preview_width(100) is None
+        future = self.cache.get('png', 2)
+        self.cache.publish(self.frame)
+        future.result(1.)
+        assert self.cache.get('png', 2) is future
+        assert self.cache.get('png') is not future
@@ -0,0 +1,48 @@
+from groupcam import metrics
+from groupcam.camera import Camera
+from groupcam.conf import config, load_config
+from groupcam.device import FileDevice
+from groupcam.text import TextCache
+
+
+WHITE = (1., 1., 1.)
+
+
+class TestTextCache:
+    def setup_method(self, method):
+        self.cache = TextCache(20, 2)
+
+    def test_hit(self):
+        surface = self.cache.get("Title", 100, 20, WHITE)
+        assert self.cache.get("Title", 100.2, 20, WHITE) is surface
+        assert (self.cache.hits, self.cache.misses) == (1, 1)
+
+    def test_miss(self):
+        self.cache.get("Title", 100, 20, WHITE)
+        self.cache.get("Other", 100, 20, WHITE)
+        self.cache.get("Title", 80, 20, WHITE)
+        self.cache.get("Title", 100, 16, WHITE)
+        self.cache.get("Title", 100, 20, (0., 0., 1.))
+        assert (self.cache.hits, self.cache.misses) == (0, 5)
+
+    def test_eviction(self):
+        self.cache.get("First", 100, 20, WHITE)
+        self.cache.get("Second", 100, 20, WHITE)
+        # Used last, so the second one is evicted instead
+        self.cache.get("First", 100, 20, WHITE)
+        self.cache.get("Third", 100, 20, WHITE)
+        assert self.cache.stats['size'] == 2
+        self.cache.get("First", 100, 20, WHITE)
+        assert (self.cache.hits, self.cache.misses) == (2, 3)
+        self.cache.get("Second", 100, 20, WHITE)
+        assert self.cache.misses == 4
+
+    def test_metrics(self):
+        load_config()
+        config['camera'].update(width=64, height=48)
+        camera = Camera(dict(id='text', title="Test", presets=[]),
+                        FileDevice('/dev/null', 64, 48))
+        lines = metrics.registry.render().splitlines()
+        assert 'groupcam_text_cache_misses_total{camera="text"} 1' in lines
+        assert 'groupcam_text_cache_hits_total{camera="text"} 0' in lines
+        camera.close()
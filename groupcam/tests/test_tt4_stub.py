@@ -0,0 +1,65 @@
+import ctypes
+
+import numpy
+
+from groupcam.tt4 import TT4, consts
+from groupcam.tt4.stub import FIRST_USER_ID, Script, StubLibrary
+
+
+SERVER_CONFIG = dict(host='localhost', tcp_port=10333, udp_port=10333,
+                     nickname='Test', server_password='', user_name='',
+                     user_password='')
+
+
+class TestStubLibrary:
+    def setup_method(self, method):
+        self.library = StubLibrary(Script(users=2, join_rate=1000., fps=100.,
+                                          frame_size=(8, 4)))
+        self.tt4 = TT4(SERVER_CONFIG, self.library)
+
+    def teardown_method(self, method):
+        self.library.stop()
+
+    def wait_for(self, code):
+        for index in range(1000):
+            message = self.tt4.get_message(100)
+            if message is not None and message.code == code:
+                return message
+        raise AssertionError("No message with code {}".format(code))
+
+    def test_connect_and_login(self):
+        self.tt4.connect()
+        assert self.tt4.is_connected()
+        self.wait_for(consts.WM_TEAMTALK_CON_SUCCESS)
+        self.tt4.login()
+        message = self.wait_for(consts.WM_TEAMTALK_CMD_MYSELF_LOGGEDIN)
+        assert message.first_param < FIRST_USER_ID
+
+    def test_video_frames(self):
+        self.tt4.connect()
+        self.tt4.login()
+        self.tt4.join_channel_by_id(1)
+        message = self.wait_for(consts.WM_TEAMTALK_USER_VIDEOFRAME)
+        user_id = message.first_param
+
+        assert self.tt4.get_user(user_id).nickname in (b'user0', b'user1')
+        video_format = self.tt4.get_user_video_format(user_id)
+        assert (video_format.width, video_format.height) == (8, 4)
+
+        data = numpy.zeros(8 * 4, dtype=numpy.int32)
+        data_ptr = ctypes.c_void_p(data.ctypes.data)
+        assert self.tt4.get_user_video_frame(user_id, data_ptr, data.nbytes,
+                                             video_format)
+        assert data.all()
+        assert self.library.take_latencies()
+
+    def test_unsubscribe(self):
+        self.tt4.connect()
+        self.tt4.login()
+        user_id = self.wait_for(
+            consts.WM_TEAMTALK_CMD_USER_LOGGEDIN).first_param
+        self.tt4.unsubscribe(user_id, consts.SUBSCRIBE_VIDEO)
+        self.tt4.join_channel_by_id(1)
+        senders = {self.wait_for(consts.WM_TEAMTALK_USER_VIDEOFRAME)
+                   .first_param for index in range(10)}
+        assert user_id not in senders
@@ -0,0 +1,99 @@
+import ctypes
+from types import SimpleNamespace
+
+import numpy
+
+from groupcam import metrics
+from groupcam.conf import config, load_config
+from groupcam.user import User
+
+
+class FakeTT4:
+    """Serves the queued frames, a frame is only fetched if it fits into
+    the buffer, like in TT4.
+    """
+
+    def __init__(self, frames):
+        # (width, height, pixel value) of the queued frames
+        self.frames = list(frames)
+        # The same format is returned for all the users
+        self.video_format = SimpleNamespace(width=0, height=0)
+        self.format_queries = 0
+
+    def get_user_video_format(self, user_id):
+        width, height, value = self.frames[0]
+        self.format_queries += 1
+        self.video_format.width, self.video_format.height = width, height
+        return self.video_format
+
+    def get_user_video_frame(self, user_id, data_ptr, size, video_format):
+        if not self.frames:
+            return False
+        width, height, value = self.frames[0]
+        if width * height * 4 > size:
+            return False
+        self.frames.pop(0)
+        pixels = numpy.full(width * height, value, dtype=numpy.int32)
+        ctypes.memmove(data_ptr, pixels.ctypes.data, pixels.nbytes)
+        video_format.width, video_format.height = width, height
+        return True
+
+
+class TestUser:
+    def setup_method(self, method):
+        load_config()
+        config['camera']['frame_ingest'] = 'latest'
+
+    def create_user(self, frames, user_id=1, tt4=None):
+        profile = SimpleNamespace(id=user_id, nickname=b'user')
+        return User(profile, tt4 or FakeTT4(frames))
+
+    def test_drain_latest(self):
+        user = self.create_user([(4, 2, 1), (4, 2, 2), (4, 2, 3)])
+        assert user.update(messages_count=3)
+        assert user.frames_skipped == 2
+        assert (user._data == 3).all()
+
+    def test_drained_frame_resized(self):
+        user = self.create_user([(4, 2, 1), (2, 2, 2)])
+        assert user.update(messages_count=2)
+        assert (user.img_width, user.img_height) == (2, 2)
+        assert len(user._data) == 4
+        assert (user._data == 2).all()
+
+    def test_format_cached(self):
+        config['camera']['frame_ingest'] = 'all'
+        user = self.create_user([(4, 2, 1), (4, 2, 2), (4, 2, 3)])
+        for index in range(3):
+            assert user.update()
+        assert user._tt4.format_queries == 1
+        assert user.ffi_calls == 4
+
+    def test_format_requeried_on_resize(self):
+        config['camera']['frame_ingest'] = 'all'
+        user = self.create_user([(2, 2, 1), (4, 2, 2)])
+        assert user.update()
+        assert user.update()
+        assert user._tt4.format_queries == 2
+        assert (user.img_width, user.img_height) == (4, 2)
+        assert (user._data == 2).all()
+
+    def test_format_per_user(self):
+        config['camera']['frame_ingest'] = 'all'
+        tt4 = FakeTT4([(4, 2, 1), (2, 2, 2)])
+        first_user = self.create_user(None, 1, tt4)
+        second_user = self.create_user(None, 2, tt4)
+        assert first_user.update()
+        assert second_user.update()
+        video_format = first_user._video_format
+        assert (video_format.width, video_format.height) == (4, 2)
+
+    def test_metrics(self):
+        user = self.create_user([(4, 2, 1), (4, 2, 2)])
+        assert user.update(messages_count=2)
+        lines = metrics.registry.render().splitlines()
+        assert 'groupcam_tt4_ffi_calls_total{user="1"} 4' in lines
+        assert 'groupcam_user_frames_fetched_total{user="1"} 2' in lines
+        assert 'groupcam_user_frames_skipped_total{user="1"} 1' in lines
+        del user
+        assert '{user="1"}' not in metrics.registry.render()
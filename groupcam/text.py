@@ -0,0 +1,80 @@
+import collections
+from time import monotonic
+
+import cairo
+
+
+class TextCache:
+    """LRU cache of text rendered to fit into rectangles.
+
+    Surfaces are keyed by the text, the rectangle size and the color, so
+    unchanged titles and labels are blitted instead of shaped on every
+    redraw.
+    """
+
+    def __init__(self, font_size, size, render_time=None):
+        """@param font_size: font size to measure the text with
+        @param size: maximum number of cached surfaces
+        @param render_time: histogram child to observe rendering times
+        """
+
+        self._font_size = font_size
+        self._size = size
+        self._render_time = render_time
+        self._surfaces = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text, width, height, color):
+        """Returns the surface with the text fitted and centered into
+        the width x height rectangle.
+
+        @param text: text string
+        @param width: rectangle width
+        @param height: rectangle height
+        @param color: RGB tuple
+        """
+
+        key = (text, round(width), round(height), color)
+        surface = self._surfaces.get(key)
+        if surface is None:
+            self.misses += 1
+            started = monotonic()
+            surface = self._render(*key)
+            if self._render_time is not None:
+                self._render_time.observe(monotonic() - started)
+            self._surfaces[key] = surface
+            if len(self._surfaces) > self._size:
+                self._surfaces.popitem(last=False)
+        else:
+            self.hits += 1
+            self._surfaces.move_to_end(key)
+        return surface
+
+    @property
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses,
+                    size=len(self._surfaces))
+
+    def _render(self, text, width, height, color):
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32,
+                                     max(width, 1), max(height, 1))
+        context = cairo.Context(surface)
+
+        context.set_font_size(self._font_size)
+        x_bearing, y_bearing, text_width, text_height = (
+            context.text_extents(text)[:4])
+        if not text_width or not text_height:
+            return surface
+
+        factor = min(width / text_width, height / text_height)
+        context.set_font_size(self._font_size * factor)
+
+        left = (width - text_width * factor) / 2 - x_bearing * factor
+        top = (height - text_height * factor) / 2 - y_bearing * factor
+
+        context.move_to(left, top)
+        context.set_source_rgb(*color)
+        context.show_text(text)
+        surface.flush()
+        return surface
@@ -1,5 +1,6 @@
 import os
 import platform
+import collections
 
 import ctypes
 
@@ -12,14 +13,144 @@ from groupcam.tt4 import structs
 _ttstr = lambda val: (val or '').encode('utf8')
 
 
+# TT4 event, count is the number of events of the same kind collapsed
+# into this one
+Message = collections.namedtuple(
+    'Message', ['code', 'first_param', 'second_param', 'count'])
+
+# User properties copied out of the library's User struct
+UserProfile = collections.namedtuple(
+    'UserProfile', ['id', 'nickname', 'username', 'status_mode',
+                    'channel_id', 'user_type'])
+
+
+_instance_p = ctypes.c_void_p
+_bool = ctypes.c_int32
+
+# Library functions in use, name: (restype, argtypes)
+SIGNATURES = {
+    'TT_InitTeamTalkPoll': (_instance_p, []),
+    'TT_CloseTeamTalk': (_bool, [_instance_p]),
+    'TT_GetFlags': (ctypes.c_uint32, [_instance_p]),
+    'TT_Connect': (_bool, [_instance_p, ctypes.c_char_p, ctypes.c_int32,
+                           ctypes.c_int32, ctypes.c_int32, ctypes.c_int32]),
+    'TT_Disconnect': (_bool, [_instance_p]),
+    'TT_GetMessage': (_bool, [_instance_p,
+                              ctypes.POINTER(structs.TTMessage),
+                              ctypes.POINTER(ctypes.c_int32)]),
+    'TT_DoLogin': (ctypes.c_int32, [_instance_p, ctypes.c_char_p,
+                                    ctypes.c_char_p, ctypes.c_char_p,
+                                    ctypes.c_char_p]),
+    'TT_DoChangeStatus': (ctypes.c_int32, [_instance_p, ctypes.c_int32,
+                                           ctypes.c_char_p]),
+    'TT_GetChannelIDFromPath': (ctypes.c_int32, [_instance_p,
+                                                 ctypes.c_char_p]),
+    'TT_DoJoinChannelByID': (ctypes.c_int32, [_instance_p, ctypes.c_int32,
+                                              ctypes.c_char_p]),
+    'TT_GetUser': (_bool, [_instance_p, ctypes.c_int32,
+                           ctypes.POINTER(structs.User)]),
+    'TT_GetUserVideoFrame': (_bool, [_instance_p, ctypes.c_int32,
+                                     ctypes.c_void_p, ctypes.c_int32,
+                                     ctypes.POINTER(structs.CaptureFormat)]),
+    'TT_GetVideoCaptureDevices': (
+        _bool, [_instance_p, ctypes.POINTER(structs.VideoCaptureDevice),
+                ctypes.POINTER(ctypes.c_int32)]),
+    'TT_InitVideoCaptureDevice': (
+        _bool, [_instance_p, ctypes.c_char_p,
+                ctypes.POINTER(structs.CaptureFormat),
+                ctypes.POINTER(structs.VideoCodec)]),
+    'TT_EnableTransmission': (_bool, [_instance_p, ctypes.c_uint32,
+                                      _bool]),
+    'TT_DoUnsubscribe': (ctypes.c_int32, [_instance_p, ctypes.c_int32,
+                                          ctypes.c_uint32]),
+}
+
+# Functions called for every event or frame. Their arguments are always
+# passed as ready ctypes objects, so their argtypes are not set: checking
+# and converting every argument costs about as much as the call itself.
+UNCHECKED_FUNCTIONS = {'TT_GetMessage', 'TT_GetUser', 'TT_GetUserVideoFrame'}
+
+_libraries = {}
+
+# Library used by TT4 instances created without one, such as a stub
+_default_library = None
+
+
+def get_library_path():
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    base_path = os.path.dirname(module_dir)
+    arch = 'amd64' if platform.machine() == 'x86_64' else 'i386'
+    lib_rel_path = 'misc/libTeamTalk4_{}.so'.format(arch)
+    return os.path.join(base_path, lib_rel_path)
+
+
+def load_library(path=None):
+    """Loads the TT4 library and declares its function signatures.
+
+    Every library is only loaded once, so the signatures are declared
+    once per process rather than per call or per instance.
+
+    @param path: library path, the bundled library by default
+    """
+
+    if path is None:
+        path = get_library_path()
+    library = _libraries.get(path)
+    if library is None:
+        library = _libraries[path] = declare_signatures(
+            ctypes.cdll.LoadLibrary(path))
+    return library
+
+
+def use_library(library):
+    """Makes the TT4 instances created from now on use the library
+    instead of the bundled one, None restores the bundled one.
+    """
+
+    global _default_library
+    _default_library = library
+
+
+def declare_signatures(library):
+    """Sets argtypes and restype of the library functions, so ctypes
+    neither guesses argument conversions nor truncates pointers returned
+    on 64-bit platforms.
+    """
+
+    for name, (restype, argtypes) in SIGNATURES.items():
+        function = getattr(library, name)
+        function.restype = restype
+        if name not in UNCHECKED_FUNCTIONS:
+            function.argtypes = argtypes
+    return library
+
+
 class TT4:
     """TT4 API wrapper.
+
+    Structs passed to the library are allocated once per instance and
+    reused by every call, so an instance must only be used from a single
+    thread at a time.
     """
 
-    def __init__(self, server_config):
+    def __init__(self, server_config, library=None):
+        """@param library: library loaded with load_library, the one set
+        with use_library or the bundled one by default
+        """
+
         self._server_config = server_config
-        self._library = self._get_library()
-        self._instance = self._library.TT_InitTeamTalkPoll()
+        self._library = library or _default_library or load_library()
+        self._instance = ctypes.c_void_p(
+            self._library.TT_InitTeamTalkPoll())
+
+        self._message = structs.TTMessage()
+        self._message_ref = ctypes.byref(self._message)
+        self._wait_ms = ctypes.c_int32()
+        self._wait_ms_ref = ctypes.byref(self._wait_ms)
+        self._user = structs.User()
+        self._user_ref = ctypes.byref(self._user)
+        self._video_format = structs.CaptureFormat()
+        self._video_format_ref = ctypes.byref(self._video_format)
 
     def connect(self):
         flags = self._library.TT_GetFlags(self._instance)
@@ -39,12 +170,22 @@ class TT4:
         flags = self._library.TT_GetFlags(self._instance)
         return flags & consts.CLIENT_CONNECTION
 
-    def get_message(self):
-        message = structs.TTMessage()
-        wait_ms_ptr = ctypes.pointer(ctypes.c_int32(-1))
+    def get_message(self, wait_ms=-1):
+        """Waits for the next event.
+
+        @param wait_ms: milliseconds to wait, -1 to wait infinitely
+        @return: Message or None if there were no events
+        """
+
+        self._wait_ms.value = wait_ms
         ret_code = self._library.TT_GetMessage(
-            self._instance, ctypes.pointer(message), wait_ms_ptr)
-        result = None if ret_code <= 0 else message
+            self._instance, self._message_ref, self._wait_ms_ref)
+        if ret_code <= 0:
+            result = None
+        else:
+            message = self._message
+            result = Message(message.code, message.first_param,
+                             message.second_param, 1)
         return result
 
     def login(self):
@@ -81,21 +222,38 @@ class TT4:
         return command_id
 
     def get_user(self, user_id):
-        user = structs.User()
-        self._library.TT_GetUser(self._instance, user_id, ctypes.pointer(user))
-        return user
+        """@return: UserProfile, zeroed if there is no such user
+        """
+
+        user = self._user
+        self._library.TT_GetUser(self._instance, user_id, self._user_ref)
+        return UserProfile(user.id, user.nickname, user.username,
+                           user.status_mode, user.channel_id, user.user_type)
 
     def get_user_video_format(self, user_id):
-        video_format = structs.CaptureFormat()
+        """@return: CaptureFormat of the user's next frame or False, the
+        struct is reused by the next format query or frame fetch
+        """
+
         ret_code = self._library.TT_GetUserVideoFrame(
-            self._instance, user_id, None, 0, ctypes.pointer(video_format))
-        return bool(ret_code) and video_format
+            self._instance, user_id, None, 0, self._video_format_ref)
+        return bool(ret_code) and self._video_format
+
+    def get_user_video_frame(self, user_id, data_ptr, bytes_number,
+                             video_format):
+        """Fetches the user's next frame.
 
-    def get_user_video_frame(self, user_id, data, bytes_number, video_format):
-        format_ptr = ctypes.pointer(video_format)
-        data_ptr = ctypes.c_void_p(data.ctypes.data)
+        @param data_ptr: c_void_p pointing to the frame buffer
+        @param bytes_number: frame buffer size
+        @param video_format: CaptureFormat to store the frame format into
+        """
+
+        if video_format is self._video_format:
+            format_ref = self._video_format_ref
+        else:
+            format_ref = ctypes.byref(video_format)
         ret_code = self._library.TT_GetUserVideoFrame(
-            self._instance, user_id, data_ptr, bytes_number, format_ptr)
+            self._instance, user_id, data_ptr, bytes_number, format_ref)
         return bool(ret_code)
 
     def start_broadcast(self, device_path):
@@ -111,33 +269,24 @@ class TT4:
     def disconnect(self):
         self._library.TT_Disconnect(self._instance)
 
-    def _get_library(self):
-        module_dir = os.path.dirname(os.path.abspath(__file__))
-        base_path = os.path.dirname(module_dir)
-        arch = 'amd64' if platform.machine() == 'x86_64' else 'i386'
-        lib_rel_path = 'misc/libTeamTalk4_{}.so'.format(arch)
-        lib_abs_path = os.path.join(base_path, lib_rel_path)
-        library = ctypes.cdll.LoadLibrary(lib_abs_path)
-        return library
-
     def _find_device(self, device_path):
         # TODO: fix me!
         return device_path + ',0'
 
         device_id = None
 
-        device_number = ctypes.c_uint32(3)
-        device_number_ptr = ctypes.pointer(device_number)
+        device_number = ctypes.c_int32(3)
+        device_number_ref = ctypes.byref(device_number)
 
         self._library.TT_GetVideoCaptureDevices(self._instance,
-                                                None, device_number_ptr)
+                                                None, device_number_ref)
 
         if device_number.value > 0:
             video_devices = (structs.VideoCaptureDevice *
                              device_number.value)()
             self._library.TT_GetVideoCaptureDevices(self._instance,
                                                     video_devices,
-                                                    device_number_ptr)
+                                                    device_number_ref)
             for index in range(device_number.value):
                 device_id = str(video_devices[index].device_id, 'utf-8')
                 if device_path == device_id.split(',')[0]:
@@ -166,8 +315,8 @@ class TT4:
         ret_code = self._library.TT_InitVideoCaptureDevice(
             self._instance,
             _ttstr(device_id),
-            ctypes.pointer(capture_format),
-            ctypes.pointer(video_codec)
+            ctypes.byref(capture_format),
+            ctypes.byref(video_codec)
         )
 
         if ret_code <= 0:
@@ -1,5 +1,6 @@
-from time import sleep
+from time import monotonic
 
+from groupcam import metrics
 from groupcam.core import get_child_logger, options
 from groupcam.tt4 import TT4, consts
 
@@ -11,6 +12,33 @@ COMPLETE_COMMANDS = {
 }
 
 
+# Handler method names by TT4 message codes
+MESSAGE_HANDLERS = {
+    consts.WM_TEAMTALK_CON_SUCCESS: 'on_connection_success',
+    consts.WM_TEAMTALK_CON_FAILED: 'on_connection_failed',
+    consts.WM_TEAMTALK_CON_LOST: 'on_connection_lost',
+    consts.WM_TEAMTALK_CMD_MYSELF_LOGGEDIN: 'on_command_myself_logged_in',
+    consts.WM_TEAMTALK_CMD_MYSELF_LOGGEDOUT: 'on_command_myself_logged_out',
+    consts.WM_TEAMTALK_CMD_USER_LOGGEDIN: 'on_command_user_logged_in',
+    consts.WM_TEAMTALK_USER_VIDEOFRAME: 'on_user_video_frame',
+    consts.WM_TEAMTALK_CMD_PROCESSING: 'on_command_processing',
+    consts.WM_TEAMTALK_CMD_ERROR: 'on_command_error',
+    consts.WM_TEAMTALK_CMD_USER_LOGGEDOUT: 'on_command_user_logged_out',
+    consts.WM_TEAMTALK_CMD_USER_JOINED: 'on_command_user_joined',
+    consts.WM_TEAMTALK_CMD_USER_LEFT: 'on_command_user_left',
+}
+
+# Maximum number of pending messages drained at once
+MAX_BATCH_SIZE = 256
+
+# Milliseconds a client running its own thread waits for a message before
+# checking whether it has been stopped
+POLL_WAIT_MS = 500
+
+# Seconds before reconnecting to the server after the connection is lost
+RECONNECT_DELAY = 5.
+
+
 class BaseClient:
     _subscription = (
         consts.SUBSCRIBE_NONE |
@@ -32,17 +60,83 @@ class BaseClient:
         self._user_id = None
         self._status_mode = consts.STATUS_AVAILABLE
         self._commands = {}
+        # Monotonic time to reconnect at after the connection is lost
+        self._reconnect_at = None
         self.users = {}
+        self._started = monotonic()
+        self.messages_received = 0
+        self.messages_collapsed = 0
+        self.batches = 0
+        self.batch_size_max = 0
+        metrics.MESSAGES_RECEIVED.track([logger_name], self,
+                                        'messages_received')
+        metrics.MESSAGES_COLLAPSED.track([logger_name], self,
+                                         'messages_collapsed')
+        metrics.MESSAGE_BATCHES.track([logger_name], self, 'batches')
         self._tt4.connect()
 
+    def start(self):
+        """Called before handling the messages, either by run or by the
+        poller.
+        """
+
     def stop(self):
+        """Asks the client to stop, may be called from any thread. The
+        thread handling the client's messages disconnects it, since a TT4
+        instance must only be used from one thread.
+        """
         self._stopped = True
 
+    @property
+    def stopped(self):
+        return self._stopped
+
+    def disconnect(self):
+        """Disconnects the stopped client, called by the thread handling
+        its messages.
+        """
+        self._tt4.disconnect()
+
     def run(self):
+        """Handles the messages on the calling thread until stopped.
+        """
+
+        self.start()
         while not self._stopped:
-            message = self._tt4.get_message()
-            if message is not None:
-                self._process_message(message)
+            messages = self.poll_messages(POLL_WAIT_MS)
+            if messages:
+                self.process_messages(messages)
+        self.disconnect()
+
+    def is_ready(self):
+        """@return: False while the client can't handle its messages yet,
+        they are left queued meanwhile
+        """
+        return True
+
+    @property
+    def stats(self):
+        received = self.messages_received
+        elapsed = monotonic() - self._started
+        return dict(messages_received=received,
+                    messages_collapsed=self.messages_collapsed,
+                    messages_per_second=received / elapsed,
+                    batches=self.batches,
+                    batch_size_avg=(received / self.batches
+                                    if self.batches else 0),
+                    batch_size_max=self.batch_size_max)
+
+    @classmethod
+    def get_dispatch_table(cls):
+        """Returns handlers by message codes, built once per class.
+        """
+
+        table = cls.__dict__.get('_dispatch_table')
+        if table is None:
+            table = {code: getattr(cls, name)
+                     for code, name in MESSAGE_HANDLERS.items()}
+            cls._dispatch_table = table
+        return table
 
     def on_connection_success(self, message):
         command_id = self._tt4.login()
@@ -55,10 +149,12 @@ class BaseClient:
         self._logger.error("Failed to connect to server")
 
     def on_connection_lost(self, message=None):
-        self._logger.error("Connection to server lost, reconnecting...")
-        self.disconnect()
-        sleep(5.)
-        self.connect()
+        self._logger.error("Connection to server lost, reconnecting in "
+                           "{}s...".format(RECONNECT_DELAY))
+        self._tt4.disconnect()
+        # Not sleeping, the thread may be handling the other clients too,
+        # the next poll reconnects once the delay is over
+        self._reconnect_at = monotonic() + RECONNECT_DELAY
 
     def on_command_myself_logged_in(self, message):
         self._user_id = message.first_param
@@ -102,36 +198,67 @@ class BaseClient:
     def on_complete_join_channel(self):
         self._logger.info("Joined the channel")
 
+    def poll_messages(self, wait_ms=-1):
+        """Waits for a message, then drains all the pending ones without
+        blocking.
+
+        @param wait_ms: milliseconds to wait, 0 not to block, -1 to wait
+        infinitely
+        @return: list of the messages, empty if there were none
+        """
+
+        if (self._reconnect_at is not None and
+                monotonic() >= self._reconnect_at):
+            self._reconnect_at = None
+            self._tt4.connect()
+
+        message = self._tt4.get_message(wait_ms)
+        if message is None:
+            return []
+
+        messages = [message]
+        while len(messages) < MAX_BATCH_SIZE:
+            message = self._tt4.get_message(0)
+            if message is None:
+                break
+            messages.append(message)
+        return messages
+
+    def process_messages(self, messages):
+        self.batches += 1
+        self.messages_received += len(messages)
+        self.batch_size_max = max(self.batch_size_max, len(messages))
+
+        # Video frame events of the same user are collapsed into the first
+        # one, keeping the latest parameters. Only the consecutive frame
+        # events are, so that none is moved across a login or a join
+        batch = []
+        frame_indexes = {}
+        for message in messages:
+            if message.code != consts.WM_TEAMTALK_USER_VIDEOFRAME:
+                frame_indexes.clear()
+            else:
+                index = frame_indexes.get(message.first_param)
+                if index is not None:
+                    count = batch[index].count + message.count
+                    batch[index] = message._replace(count=count)
+                    self.messages_collapsed += 1
+                    continue
+                frame_indexes[message.first_param] = len(batch)
+            batch.append(message)
+
+        for message in batch:
+            self._process_message(message)
+
     def _process_message(self, message):
         code = message.code
 
         if options.debug:
             self._logger.debug("Got message with code {}".format(code))
 
-        if code == consts.WM_TEAMTALK_CON_SUCCESS:
-            self.on_connection_success(message)
-        elif code == consts.WM_TEAMTALK_CON_FAILED:
-            self.on_connection_failed(message)
-        elif code == consts.WM_TEAMTALK_CON_LOST:
-            self.on_connection_lost(message)
-        elif code == consts.WM_TEAMTALK_CMD_MYSELF_LOGGEDIN:
-            self.on_command_myself_logged_in(message)
-        elif code == consts.WM_TEAMTALK_CMD_MYSELF_LOGGEDOUT:
-            self.on_command_myself_logged_out(message)
-        elif code == consts.WM_TEAMTALK_CMD_USER_LOGGEDIN:
-            self.on_command_user_logged_in(message)
-        elif code == consts.WM_TEAMTALK_USER_VIDEOFRAME:
-            self.on_user_video_frame(message)
-        elif code == consts.WM_TEAMTALK_CMD_PROCESSING:
-            self.on_command_processing(message)
-        elif code == consts.WM_TEAMTALK_CMD_ERROR:
-            self.on_command_error(message)
-        elif code == consts.WM_TEAMTALK_CMD_USER_LOGGEDOUT:
-            self.on_command_user_logged_out(message)
-        elif code == consts.WM_TEAMTALK_CMD_USER_JOINED:
-            self.on_command_user_joined(message)
-        elif code == consts.WM_TEAMTALK_CMD_USER_LEFT:
-            self.on_command_user_left(message)
+        handler = self.get_dispatch_table().get(code)
+        if handler is not None:
+            handler(self, message)
         else:
             self._logger.debug("Message with code {} is unknown".format(code))
 
@@ -0,0 +1,141 @@
+"""Polling the messages of many clients from a fixed set of threads.
+
+Every client is assigned to one of the workers, which wait for the
+messages of their clients in turn and hand the batches over to the Tornado
+IOLoop, where the clients handle them. The thread count doesn't grow with
+the number of clients, and every wait is bounded, so stopping takes effect
+right away. The stopped clients are disconnected by their worker, a TT4
+instance is never used from two threads at once.
+"""
+
+import time
+import threading
+
+import tornado.ioloop
+
+from groupcam.core import get_child_logger
+
+
+# Milliseconds an idle worker waits for messages per pass over its
+# clients, split between them
+PASS_WAIT_MS = 10
+
+
+class _Worker:
+    def __init__(self, poller, index):
+        self.clients = ()
+        self._poller = poller
+        self._thread = threading.Thread(
+            target=self._run, name='poller/{}'.format(index), daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def _run(self):
+        poller = self._poller
+        while not poller.stopped:
+            clients = self.clients
+            # Once a client has had messages, the rest of the pass doesn't
+            # block
+            wait_ms = max(PASS_WAIT_MS // max(len(clients), 1), 1)
+            waited = False
+            for client in clients:
+                if client in poller.dispatching:
+                    # Waiting for the previous batch to be handled, the
+                    # messages stay queued in the library meanwhile
+                    continue
+                if client.stopped:
+                    poller.remove(client)
+                    self._disconnect(client)
+                    continue
+                if not client.is_ready():
+                    continue
+                try:
+                    messages = client.poll_messages(wait_ms)
+                except Exception:
+                    poller.logger.exception("Unable to poll the messages")
+                    continue
+                if messages:
+                    wait_ms = 0
+                    poller.dispatch(client, messages)
+                waited = True
+            if not waited:
+                # No client could be polled
+                time.sleep(PASS_WAIT_MS / 1000.)
+
+        for client in self.clients:
+            if client not in poller.dispatching:
+                self._disconnect(client)
+
+    def _disconnect(self, client):
+        try:
+            client.disconnect()
+        except Exception:
+            self._poller.logger.exception("Unable to disconnect")
+
+
+class ClientPoller:
+    def __init__(self, workers, io_loop=None):
+        """@param workers: number of polling threads
+        @param io_loop: IOLoop handling the messages, the global one by
+        default
+        """
+
+        self._io_loop = io_loop or tornado.ioloop.IOLoop.instance()
+        self._workers = [_Worker(self, index) for index in range(workers)]
+        self._lock = threading.Lock()
+        self.dispatching = set()
+        self.stopped = False
+        self.logger = get_child_logger('poller')
+        self.batches_dispatched = 0
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+
+    def stop(self, timeout=None):
+        """Stops the workers and waits for them to exit, they disconnect
+        their clients on the way.
+        """
+
+        self.stopped = True
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def add(self, client):
+        """Starts polling the client on the least loaded worker.
+        """
+
+        client.start()
+        with self._lock:
+            worker = min(self._workers, key=lambda item: len(item.clients))
+            worker.clients = worker.clients + (client,)
+
+    def remove(self, client):
+        with self._lock:
+            for worker in self._workers:
+                worker.clients = tuple(item for item in worker.clients
+                                       if item is not client)
+
+    def dispatch(self, client, messages):
+        self.dispatching.add(client)
+        self.batches_dispatched += 1
+        self._io_loop.add_callback(self._process, client, messages)
+
+    @property
+    def stats(self):
+        return dict(workers=len(self._workers),
+                    clients=sum(len(worker.clients)
+                                for worker in self._workers),
+                    batches_dispatched=self.batches_dispatched)
+
+    def _process(self, client, messages):
+        try:
+            client.process_messages(messages)
+        except Exception:
+            self.logger.exception("Unable to process the messages")
+        finally:
+            self.dispatching.discard(client)
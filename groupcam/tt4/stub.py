@@ -0,0 +1,341 @@
+"""Stand-in for the TT4 library, serving scripted users.
+
+StubLibrary exposes the TT_* functions groupcam.tt4.TT4 calls as ctypes
+callbacks built from the same signatures, so the wrapper runs unchanged.
+A server thread brings the scripted users online at the given rate and
+announces their video frames to every subscribed instance; the frames
+are served from TT_GetUserVideoFrame.
+"""
+
+import time
+import ctypes
+import itertools
+import threading
+import collections
+
+from groupcam.tt4 import SIGNATURES, consts
+
+
+# Messages kept per instance, the oldest ones are dropped beyond that
+MAX_QUEUED_MESSAGES = 4096
+
+# Frames kept per user and instance, as the library does
+MAX_QUEUED_FRAMES = 16
+
+# Server thread tick, seconds
+TICK_INTERVAL = .005
+
+# Ids of the scripted users start after the ids of the instances
+FIRST_USER_ID = 1000
+
+
+class Script:
+    """Users brought online by the stub server.
+    """
+
+    def __init__(self, users=10, nickname='user{index}', join_rate=10.,
+                 fps=10., frame_size=(320, 240), session=None):
+        """@param users: number of users online at once
+        @param nickname: format string of the nicknames, gets the index
+        @param join_rate: users logging in per second
+        @param fps: frames per second sent by every user
+        @param frame_size: (width, height) tuple
+        @param session: seconds after which a user logs out and is
+        replaced by a new one, None to stay online
+        """
+
+        self.users = users
+        self.nickname = nickname
+        self.join_rate = join_rate
+        self.fps = fps
+        self.frame_size = frame_size
+        self.session = session
+
+
+class _ScriptedUser:
+    def __init__(self, user_id, index, nickname, joined):
+        self.user_id = user_id
+        self.index = index
+        self.nickname = nickname.encode('utf8')
+        self.joined = joined
+        self.next_frame = joined
+
+
+class _Instance:
+    def __init__(self, instance_id):
+        self.instance_id = instance_id
+        self.messages = collections.deque()
+        self.condition = threading.Condition()
+        self.connected = False
+        self.logged_in = False
+        self.in_channel = False
+        self.transmitting = False
+        self.unsubscribed = set()
+        # user_id: deque of the announce times of the queued frames
+        self.frames = {}
+        self.messages_dropped = 0
+
+
+class StubLibrary:
+    """Scripted replacement of the library loaded by load_library.
+    """
+
+    def __init__(self, script):
+        self._script = script
+        self._instances = {}
+        self._users = {}
+        self._lock = threading.Lock()
+        self._instance_ids = itertools.count(1)
+        self._user_ids = itertools.count(FIRST_USER_ID)
+        self._command_ids = itertools.count(1)
+        self._user_indexes = itertools.count()
+        self._started = None
+        self._stopped = threading.Event()
+
+        width, height = script.frame_size
+        self._frame = (ctypes.c_char * (width * height * 4))()
+        ctypes.memset(self._frame, 0x80, len(self._frame))
+
+        self.frames_announced = 0
+        self.frames_served = 0
+        self.latencies = []
+
+        for name, (restype, argtypes) in SIGNATURES.items():
+            prototype = ctypes.CFUNCTYPE(restype, *argtypes)
+            setattr(self, name, prototype(getattr(self, '_' + name)))
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def take_latencies(self):
+        """Returns the frame latencies measured since the previous call,
+        from the frame announcement to its fetch, in seconds.
+        """
+
+        with self._lock:
+            latencies, self.latencies = self.latencies, []
+        return latencies
+
+    @property
+    def stats(self):
+        return dict(users=len(self._users),
+                    frames_announced=self.frames_announced,
+                    frames_served=self.frames_served,
+                    messages_dropped=sum(
+                        instance.messages_dropped
+                        for instance in list(self._instances.values())))
+
+    # Library functions
+
+    def _TT_InitTeamTalkPoll(self):
+        instance = _Instance(next(self._instance_ids))
+        self._instances[instance.instance_id] = instance
+        return instance.instance_id
+
+    def _TT_CloseTeamTalk(self, instance_id):
+        self._instances.pop(instance_id, None)
+        return 1
+
+    def _TT_GetFlags(self, instance_id):
+        instance = self._instances[instance_id]
+        return consts.CLIENT_CONNECTION if instance.connected else 0
+
+    def _TT_Connect(self, instance_id, host, tcp_port, udp_port,
+                    local_tcp_port, local_udp_port):
+        instance = self._instances[instance_id]
+        instance.connected = True
+        self._post(instance, consts.WM_TEAMTALK_CON_SUCCESS)
+        return 1
+
+    def _TT_Disconnect(self, instance_id):
+        instance = self._instances.get(instance_id)
+        if instance is not None:
+            instance.connected = instance.logged_in = False
+            instance.in_channel = False
+        return 1
+
+    def _TT_GetMessage(self, instance_id, message_ptr, wait_ms_ptr):
+        instance = self._instances[instance_id]
+        wait_ms = wait_ms_ptr.contents.value
+        timeout = None if wait_ms < 0 else wait_ms / 1000.
+        with instance.condition:
+            if not instance.messages:
+                instance.condition.wait(timeout)
+            if not instance.messages:
+                return 0
+            code, first_param, second_param = instance.messages.popleft()
+
+        message = message_ptr.contents
+        message.code = code
+        message.first_param = first_param
+        message.second_param = second_param
+        return 1
+
+    def _TT_DoLogin(self, instance_id, nickname, server_password,
+                    user_name, user_password):
+        instance = self._instances[instance_id]
+        command_id = next(self._command_ids)
+        self._post(instance, consts.WM_TEAMTALK_CMD_PROCESSING, command_id)
+        self._post(instance, consts.WM_TEAMTALK_CMD_MYSELF_LOGGEDIN,
+                   instance_id)
+        with self._lock:
+            instance.logged_in = True
+            for user_id in self._users:
+                self._post(instance, consts.WM_TEAMTALK_CMD_USER_LOGGEDIN,
+                           user_id)
+        self._post(instance, consts.WM_TEAMTALK_CMD_PROCESSING,
+                   command_id, 1)
+        return command_id
+
+    def _TT_DoChangeStatus(self, instance_id, mode, message):
+        return next(self._command_ids)
+
+    def _TT_GetChannelIDFromPath(self, instance_id, path):
+        return 1
+
+    def _TT_DoJoinChannelByID(self, instance_id, channel_id, password):
+        instance = self._instances[instance_id]
+        command_id = next(self._command_ids)
+        self._post(instance, consts.WM_TEAMTALK_CMD_PROCESSING, command_id)
+        with self._lock:
+            instance.in_channel = True
+            for user_id in self._users:
+                self._post(instance, consts.WM_TEAMTALK_CMD_USER_JOINED,
+                           user_id)
+        self._post(instance, consts.WM_TEAMTALK_CMD_PROCESSING,
+                   command_id, 1)
+        return command_id
+
+    def _TT_GetUser(self, instance_id, user_id, user_ptr):
+        user = self._users.get(user_id)
+        if user is None:
+            return 0
+        profile = user_ptr.contents
+        profile.id = user_id
+        profile.nickname = user.nickname
+        profile.channel_id = 1
+        return 1
+
+    def _TT_GetUserVideoFrame(self, instance_id, user_id, picture, size,
+                              format_ptr):
+        instance = self._instances[instance_id]
+        if user_id not in self._users:
+            return 0
+
+        video_format = format_ptr.contents
+        video_format.width, video_format.height = self._script.frame_size
+        video_format.four_cc = consts.FOURCC_RGB32
+        if picture is None:
+            return 1
+
+        with self._lock:
+            frames = instance.frames.get(user_id)
+            if not frames or size < len(self._frame):
+                return 0
+            announced = frames.popleft()
+            self.frames_served += 1
+            self.latencies.append(time.monotonic() - announced)
+        ctypes.memmove(picture, self._frame, len(self._frame))
+        return 1
+
+    def _TT_GetVideoCaptureDevices(self, instance_id, devices, number_ptr):
+        number_ptr.contents.value = 0
+        return 1
+
+    def _TT_InitVideoCaptureDevice(self, instance_id, device_id,
+                                   format_ptr, codec_ptr):
+        return 1
+
+    def _TT_EnableTransmission(self, instance_id, transmit_types, enable):
+        instance = self._instances[instance_id]
+        if transmit_types & consts.TRANSMIT_VIDEO:
+            instance.transmitting = bool(enable)
+        return 1
+
+    def _TT_DoUnsubscribe(self, instance_id, user_id, subscriptions):
+        instance = self._instances[instance_id]
+        if subscriptions & consts.SUBSCRIBE_VIDEO:
+            with self._lock:
+                instance.unsubscribed.add(user_id)
+                instance.frames.pop(user_id, None)
+        return next(self._command_ids)
+
+    # Server side
+
+    def _post(self, instance, code, first_param=0, second_param=0):
+        with instance.condition:
+            if len(instance.messages) >= MAX_QUEUED_MESSAGES:
+                instance.messages.popleft()
+                instance.messages_dropped += 1
+            instance.messages.append((code, first_param, second_param))
+            instance.condition.notify()
+
+    def _run(self):
+        self._started = time.monotonic()
+        while not self._stopped.wait(TICK_INTERVAL):
+            now = time.monotonic()
+            with self._lock:
+                self._log_users_out(now)
+                self._log_users_in(now)
+                self._announce_frames(now)
+
+    def _log_users_in(self, now):
+        script = self._script
+        due = min(script.users,
+                  int((now - self._started) * script.join_rate) + 1)
+        while len(self._users) < due:
+            index = next(self._user_indexes)
+            user = _ScriptedUser(next(self._user_ids), index,
+                                 script.nickname.format(index=index), now)
+            self._users[user.user_id] = user
+            for instance in list(self._instances.values()):
+                if instance.logged_in:
+                    self._post(instance,
+                               consts.WM_TEAMTALK_CMD_USER_LOGGEDIN,
+                               user.user_id)
+                if instance.in_channel:
+                    self._post(instance, consts.WM_TEAMTALK_CMD_USER_JOINED,
+                               user.user_id)
+
+    def _log_users_out(self, now):
+        session = self._script.session
+        if session is None:
+            return
+
+        for user in list(self._users.values()):
+            if now - user.joined < session:
+                continue
+            del self._users[user.user_id]
+            for instance in list(self._instances.values()):
+                instance.frames.pop(user.user_id, None)
+                instance.unsubscribed.discard(user.user_id)
+                if instance.in_channel:
+                    self._post(instance, consts.WM_TEAMTALK_CMD_USER_LEFT,
+                               user.user_id)
+                if instance.logged_in:
+                    self._post(instance,
+                               consts.WM_TEAMTALK_CMD_USER_LOGGEDOUT,
+                               user.user_id)
+
+    def _announce_frames(self, now):
+        interval = 1. / self._script.fps
+        # Instances broadcasting a camera are not interested in frames
+        receivers = [instance for instance in self._instances.values()
+                     if instance.in_channel and not instance.transmitting]
+        for user in self._users.values():
+            if user.next_frame > now:
+                continue
+            user.next_frame += interval
+            self.frames_announced += 1
+            for instance in receivers:
+                if user.user_id in instance.unsubscribed:
+                    continue
+                frames = instance.frames.setdefault(
+                    user.user_id,
+                    collections.deque(maxlen=MAX_QUEUED_FRAMES))
+                frames.append(now)
+                self._post(instance, consts.WM_TEAMTALK_USER_VIDEOFRAME,
+                           user.user_id, len(frames))
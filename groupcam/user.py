@@ -1,7 +1,17 @@
+import re
+import copy
+import ctypes
+from time import monotonic
+
 import numpy
 import cairo
 
-from datetime import datetime
+from groupcam import metrics
+from groupcam.conf import config
+
+
+# Maximum number of queued frames to skip at once in the latest frame mode
+MAX_DRAINED_FRAMES = 16
 
 
 class User:
@@ -12,39 +22,205 @@ class User:
         self.updated = None
         self._tt4 = tt4
         self._data = None
+        self._data_ptr = None
+        self._shm = None
+        self._retired_shm = None
+        self._sequence = None
+        self._shared = config['camera']['compositor'] == 'process'
+        self._video_format = None
+        self._latest_only = config['camera']['frame_ingest'] == 'latest'
+        self._frames_announced = 0
+        self._frames_consumed = 0
+        self.frames_fetched = 0
+        self.frames_skipped = 0
+        self.ffi_calls = 0
+        self._fetch_time = metrics.FRAME_FETCH_TIME.child(self.user_id)
+        self._tracked = [
+            (metric, metric.track([self.user_id], self, attribute))
+            for metric, attribute in [
+                (metrics.FFI_CALLS, 'ffi_calls'),
+                (metrics.FRAMES_FETCHED, 'frames_fetched'),
+                (metrics.FRAMES_SKIPPED, 'frames_skipped')]]
         self._init_label(profile)
 
-    def update(self, frames_count=1):
+    def update(self, frames_count=1, messages_count=1):
+        """Fetches queued video frames.
+
+        @param frames_count: number of frames in the queue
+        @param messages_count: number of frame messages collapsed into
+        this update
+        @return: True if a new frame has been fetched
+        """
+
+        started = monotonic()
+        if self._video_format is None and not self._query_format():
+            return False
+
+        if self._latest_only:
+            result = self._fetch_latest_frame(messages_count)
+        else:
+            result = False
+            for index in range(frames_count):
+                result |= self._fetch_frame()
+
+        now = monotonic()
+        self._fetch_time.observe(now - started)
+        if result:
+            self.updated = now
+        return result
+
+    @property
+    def stats(self):
+        fetched = self.frames_fetched
+        return dict(frames_fetched=fetched,
+                    frames_skipped=self.frames_skipped,
+                    ffi_calls=self.ffi_calls,
+                    ffi_calls_per_frame=(self.ffi_calls / fetched
+                                         if fetched else 0))
+
+    @property
+    def data(self):
+        """Frame pixels as a flat int32 ARGB array.
+        """
+        return self._data
+
+    @property
+    def shared_name(self):
+        """Name of the shared memory block holding the frame, if the
+        cameras are composited in separate processes.
+        """
+        return self._shm.name if self._shm is not None else None
+
+    def _query_format(self):
+        # The format is only re-queried when the frame size changes, since
+        # it takes an extra library call
+        self.ffi_calls += 1
         video_format = self._tt4.get_user_video_format(self.user_id)
         if not video_format:
-            return
+            return False
 
+        # The returned struct is reused for all the users, the frames are
+        # fetched into a copy of our own
+        self._video_format = copy.copy(video_format)
         if (self._data is None or
                 self.img_width != video_format.width or
                 self.img_height != video_format.height):
-            self._init_surface(video_format)
+            self._init_surface(self._video_format)
+        return True
 
-        result = False
-        for index in range(frames_count):
-            result |= self._tt4.get_user_video_frame(
-                self.user_id, self._data, len(self._data) * 4, video_format)
-        if result:
-            self.updated = datetime.now()
+    def _fetch_latest_frame(self, messages_count):
+        # Every frame is announced with its own message, so the messages
+        # of the frames drained along with an earlier one are skipped
+        self._frames_announced += messages_count
+        if self._frames_consumed >= self._frames_announced:
+            return False
+
+        if not self._fetch_frame():
+            # The queue is empty, the library has dropped some frames
+            self._frames_consumed = self._frames_announced
+            return False
+        self._frames_consumed += 1
+
+        # There is no way to discard queued frames in TT4, so the rest of
+        # the queue is fetched into the same buffer and only the newest
+        # frame remains there
+        for index in range(MAX_DRAINED_FRAMES):
+            if not self._get_video_frame():
+                break
+            self._fit_fetched_frame()
+            self._frames_consumed += 1
+            self.frames_skipped += 1
+            self.frames_fetched += 1
         return True
 
+    def _fetch_frame(self):
+        fetched = self._get_video_frame()
+        if fetched:
+            self._fit_fetched_frame()
+        else:
+            # Either there is no frame, or it doesn't fit into the buffer
+            size = self.img_width, self.img_height
+            if not self._query_format() or size == (self.img_width,
+                                                    self.img_height):
+                return False
+            fetched = self._get_video_frame()
+
+        self.frames_fetched += fetched
+        return fetched
+
+    def _get_video_frame(self):
+        self.ffi_calls += 1
+        if self._sequence is not None:
+            # Odd while the frame is being written, so that the compositor
+            # processes can tell the frames they have drawn mid-write
+            self._sequence[0] += 1
+        fetched = self._tt4.get_user_video_frame(
+            self.user_id, self._data_ptr, self._data.nbytes,
+            self._video_format)
+        if self._sequence is not None:
+            self._sequence[0] += 1
+        return fetched
+
+    def _fit_fetched_frame(self):
+        if (self._video_format.width != self.img_width or
+                self._video_format.height != self.img_height):
+            # A smaller frame has been fetched into the old buffer
+            data = self._data
+            self._init_surface(self._video_format)
+            self._data[:] = data[:len(self._data)]
+
     def _init_surface(self, video_format):
         self.img_width = video_format.width
         self.img_height = video_format.height
-        self._data = numpy.empty(self.img_width * self.img_height,
-                                 dtype=numpy.int32)
+        pixels_number = self.img_width * self.img_height
+        if self._shared:
+            # The frame is followed by its write sequence number
+            self._init_shared_memory((pixels_number + 1) * 4)
+            self._data = numpy.ndarray(pixels_number, dtype=numpy.int32,
+                                       buffer=self._shm.buf)
+            self._sequence = numpy.ndarray(1, dtype=numpy.int32,
+                                           buffer=self._shm.buf,
+                                           offset=pixels_number * 4)
+        else:
+            self._data = numpy.empty(pixels_number, dtype=numpy.int32)
+        # Converted once, since getting the address of an array is slower
+        # than the library call it is passed to
+        self._data_ptr = ctypes.c_void_p(self._data.ctypes.data)
 
         self.surface = cairo.ImageSurface.create_for_data(
             self._data, cairo.FORMAT_ARGB32, self.img_width, self.img_height)
 
+    def _init_shared_memory(self, size):
+        # Python 3.8+, only needed in the process compositing mode
+        from multiprocessing import shared_memory
+
+        if self._retired_shm is not None:
+            self._retired_shm.close()
+        # The previous block may still be referenced by the old surface,
+        # so it is only unlinked now and closed on the next resize
+        self._retired_shm = self._shm
+        if self._retired_shm is not None:
+            self._retired_shm.unlink()
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+
     def _init_label(self, profile):
         nickname = str(profile.nickname, 'utf8')
         label_match = re.match(r'.*{(.*)}.*', nickname)
         if label_match is None:
             self.label = None
         else:
-            self.label = label_match.groups(0)
+            self.label = label_match.group(1)
+
+    def __del__(self):
+        metrics.FRAME_FETCH_TIME.release(self._fetch_time, self.user_id)
+        for metric, child in self._tracked:
+            metric.release(child, self.user_id)
+        if self._shm is not None:
+            # The memory can only be unmapped once nothing refers to it
+            self.surface.finish()
+            self.surface = self._data = self._sequence = None
+            self._shm.close()
+            self._shm.unlink()
+        if self._retired_shm is not None:
+            # Unlinked already when it was retired
+            self._retired_shm.close()
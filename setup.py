@@ -29,9 +29,14 @@ setup(
         'pytest==2.5.2',
         'numpy',
     ],
-    packages=['groupcam', 'groupcam.tt4', 'groupcam.api'],
+    extras_require={
+        # JPEG snapshots and streams, PNG only otherwise
+        'jpeg': ['Pillow'],
+    },
+    packages=['groupcam', 'groupcam.tt4', 'groupcam.api', 'groupcam.bench'],
     package_data={
         'groupcam': ['misc/*.*'],
+        'groupcam.bench': ['*.c'],
     },
     entry_points={
         'console_scripts': [